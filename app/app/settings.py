@@ -139,6 +139,78 @@ AUTH_USER_MODEL = 'core.User'
 
 TAGGIT_CASE_INSENSITIVE = True
 
+COLLECTION_PLAN_CACHE_SIZE = 1024
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache of the public product and collection responses, TIMEOUT in seconds.
+# SLUG_TIMEOUT bounds how long a worker resolves a renamed or deleted store
+# from its old slug when ALIAS is not shared by every worker, see core.stores
+STORE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'SLUG_TIMEOUT': 60,
+}
+
+# Seconds a cart holds the stock of its products, see core.inventory
+STOCK_HOLD_TTL = 15 * 60
+
+# Seconds a cart stays valid after its last activity, the expiry is
+# written again at most once per CART_EXPIRY_REFRESH seconds
+CART_LIFETIME = 10 * 24 * 60 * 60
+CART_EXPIRY_REFRESH = 60 * 60
+
+# Token bucket limits of the cart endpoints, 'N/period' allows bursts of N
+# requests, see core.throttling. STORES overrides RATES for a store slug,
+# e.g. {'main_store': {'cart-create': {'anon': '5/min'}}}. NUM_PROXIES is
+# the number of reverse proxies in front of Django, 0 keys anonymous
+# clients on REMOTE_ADDR and ignores X-Forwarded-For
+CART_THROTTLE = {
+    'ALIAS': 'default',
+    'NUM_PROXIES': 0,
+    'RATES': {
+        'cart-create': {'anon': '30/min', 'user': '60/min'},
+        'cart-mutate': {'anon': '120/min', 'user': '240/min'},
+    },
+    'STORES': {},
+}
+
+# Variants of the uploaded images, see core.images. SIZES are the longest
+# edge in pixels, FORMATS Pillow can not write are skipped, WORKERS is the
+# number of processes rendering them started by each web worker process,
+# None for one per core, 0 to render in the web worker after the commit
+IMAGE_VARIANTS = {
+    'SIZES': {'thumbnail': 160, 'medium': 640},
+    'FORMATS': ('webp', 'avif'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+}
+
+# Product images and attachments are stored once per content under PREFIX
+# of MEDIA_ROOT, see core.blobs. collect_media_blobs deletes the blobs
+# unreferenced and untouched for GC_GRACE seconds
+MEDIA_BLOBS = {
+    'PREFIX': 'blobs',
+    'GC_GRACE': 60 * 60,
+}
+
+# How attachment downloads are sent, see store.downloads. SENDFILE None
+# streams them from Django, 'x-accel-redirect' hands them to nginx from
+# the internal location ACCEL_PREFIX aliased to MEDIA_ROOT, 'x-sendfile'
+# to Apache mod_xsendfile or lighttpd
+ATTACHMENT_DOWNLOADS = {
+    'SENDFILE': None,
+    'ACCEL_PREFIX': '/protected-media/',
+}
+
+# Only store a cart on its first add-to-cart, creating a cart then returns
+# an id without writing a row
+LAZY_CARTS = False
+
 CITIES_LIGHT_TRANSLATION_LANGUAGES = ['fr', 'en']
 CITIES_LIGHT_INCLUDE_COUNTRIES = ['CA', 'US']
 CITIES_LIGHT_INCLUDE_CITY_TYPES = ['PPL', 'PPLA', 'PPLA2', 'PPLA3', 'PPLA4', 'PPLC', 'PPLF', 'PPLG', 'PPLL', 'PPLR', 'PPLS', 'STLMT',]
@@ -146,3 +218,6 @@ CITIES_LIGHT_INCLUDE_CITY_TYPES = ['PPL', 'PPLA', 'PPLA2', 'PPLA3', 'PPLA4', 'PP
 REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
+
+# Serve product and cart reads with the hand written serializers
+FAST_SERIALIZERS = False
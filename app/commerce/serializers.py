@@ -1,7 +1,12 @@
+from collections import OrderedDict
+
+from django.conf import settings
 from rest_framework import serializers
-from core.models import Shipping, Order, Cart, CartItem
+from core.models import Shipping, Order, Cart, CartItem, Product, \
+                        StockReservation
 from user.serializers import UserSerializer
-from store.serializers import SimpleProductSerializer
+from store.serializers import SimpleProductSerializer, \
+                              FastSimpleProductSerializer, price_field
 
 
 class ShippingSerializer(serializers.ModelSerializer):
@@ -55,13 +60,119 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'updated_at', 'created_at',)
 
 
+class StockReservationSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = StockReservation
+        fields = ('product', 'quantity', 'expires_at')
+        read_only_fields = fields
+
+
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+    note = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class CartAddSerializer(CartLineSerializer):
+    """A line added to a cart, at least one unit"""
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class CartBulkSerializer(serializers.Serializer):
+    """
+    Validate the lines of a bulk cart update, the products of the store in
+    context['store_id'] are loaded in one query and passed as `product`
+    """
+    items = CartLineSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        products = Product.objects.filter(
+            store_id=self.context['store_id']
+        ).in_bulk([item['product_id'] for item in items])
+        missing = sorted({
+            item['product_id'] for item in items
+            if item['product_id'] not in products
+        })
+        if missing:
+            raise serializers.ValidationError(
+                f'Unknown products: {", ".join(map(str, missing))}'
+            )
+        return [
+            {
+                'product': products[item['product_id']],
+                'quantity': item['quantity'],
+                'note': item['note'],
+            } for item in items
+        ]
+
+
 class CartSerializer(serializers.ModelSerializer):
     user = UserSerializer()
     cart_items = CartItemSerializer(many=True, read_only=True)
+    stale_prices = serializers.BooleanField(
+        source='has_stale_prices',
+        read_only=True
+    )
 
     class Meta:
         model = Cart
         fields = (
-            'id', 'user', 'amount', 'currency', 'cart_items'
+            'id', 'user', 'amount', 'currency', 'cart_items', 'stale_prices'
         )
         read_only_fields = ('id', 'updated_at', 'created_at',)
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load the user, items and item products of all carts in bulk"""
+        return queryset.select_related('user').prefetch_related(
+            'cart_items__product'
+        )
+
+
+class FastCartItemSerializer(serializers.BaseSerializer):
+    """
+    Read only CartItemSerializer building its output directly from a cart
+    item with its product loaded. Enabled by settings.FAST_SERIALIZERS.
+    """
+    product_serializer = FastSimpleProductSerializer()
+
+    def to_representation(self, item):
+        return OrderedDict((
+            ('id', item.id),
+            ('price', price_field.to_representation(item.price)),
+            ('quantity', int(item.quantity)),
+            ('product', self.product_serializer.to_representation(
+                item.product
+            )),
+        ))
+
+
+class FastCartSerializer(serializers.BaseSerializer):
+    """Read only CartSerializer, see FastCartItemSerializer"""
+    item_serializer = FastCartItemSerializer()
+
+    def to_representation(self, cart):
+        user = cart.user
+        return OrderedDict((
+            ('id', str(cart.id)),
+            ('user', OrderedDict((
+                ('email', str(user.email)),
+                ('name', str(user.name)),
+            )) if user is not None else None),
+            ('amount', price_field.to_representation(cart.amount)),
+            ('currency', str(cart.currency)),
+            ('cart_items', [
+                self.item_serializer.to_representation(item)
+                for item in cart.cart_items.all()
+            ]),
+            ('stale_prices', cart.has_stale_prices()),
+        ))
+
+    setup_eager_loading = staticmethod(CartSerializer.setup_eager_loading)
+
+
+def cart_serializer_class():
+    if settings.FAST_SERIALIZERS:
+        return FastCartSerializer
+    return CartSerializer
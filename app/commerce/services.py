@@ -0,0 +1,181 @@
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from core import inventory, membership
+from core.models import Cart, Condition, Order, OrderItem, \
+                        OrderStatusHistory, Product
+from store import cache
+
+
+class CheckoutError(Exception):
+    """The cart can not be turned into an order"""
+
+
+class CheckoutService:
+    """
+    Business logic to turn a cart into an order.
+
+    Everything happens in one transaction: the cart and the products it
+    holds are locked, the products in id order and before their holds and
+    buckets, so that concurrent checkouts, holds and the expiry sweeper
+    always lock them in the same order and can not deadlock. The holds of
+    the cart are settled and the stock checked under the lock, so it can
+    not be sold twice.
+    """
+
+    def __init__(self, instance=None):
+        self.instance = instance
+
+    def checkout(self, user):
+        with transaction.atomic():
+            cart = Cart.objects.select_for_update().get(pk=self.instance.pk)
+            if not cart.is_active:
+                raise CheckoutError(_('The cart is no longer active'))
+
+            items = list(cart.cart_items.all())
+            if not items:
+                raise CheckoutError(_('The cart is empty'))
+
+            quantities = {item.product_id: item.quantity for item in items}
+            # the products held by the cart are locked with the others,
+            # before the holds, in the order inventory locks them
+            inventory.lock_products(
+                set(quantities) | set(
+                    cart.reservations.values_list('product_id', flat=True)
+                )
+            )
+            products = list(Product.objects.filter(id__in=quantities))
+            short = self.settle_holds(cart, quantities)
+            if short:
+                raise CheckoutError(
+                    _('Not enough stock for products %(ids)s') % {
+                        'ids': ', '.join(map(str, short))
+                    }
+                )
+
+            self.take_stock(quantities)
+            order = Order.objects.create(
+                store_id=cart.store_id,
+                user=user,
+                currency=cart.currency
+            )
+            order.add_items([
+                OrderItem(
+                    product_id=item.product_id,
+                    quantity=item.quantity,
+                    price=item.price,
+                    discount_price=item.discount_price
+                ) for item in items
+            ])
+            OrderStatusHistory.objects.create(
+                user=user,
+                order=order,
+                status=order.status,
+                notes=_('Checkout of cart %(cart)s') % {'cart': cart.id}
+            )
+            Cart.objects.filter(pk=cart.pk).update(
+                is_active=False,
+                updated_at=timezone.now()
+            )
+            transaction.on_commit(
+                lambda: self.stock_changed(cart.store, products)
+            )
+
+        self.instance.is_active = False
+        return order
+
+    @staticmethod
+    def settle_holds(cart, quantities):
+        """
+        Release the holds of the cart and take its quantities from what can
+        be held, the products being locked nobody else can take the
+        released units. Return the ids of the products short of stock.
+        """
+        released = inventory.release(cart.reservations.all())
+        with_buckets = inventory.bucketed(quantities)
+        short = [
+            product_id for product_id, free in
+            Product.objects.filter(
+                id__in=quantities
+            ).exclude(
+                id__in=with_buckets
+            ).annotate(
+                free=F('stock') - F('reserved')
+            ).values_list('id', 'free')
+            if free < quantities[product_id]
+        ]
+        for product_id in sorted(with_buckets):
+            try:
+                inventory.take_from_buckets(
+                    product_id,
+                    quantities[product_id],
+                    prefer={
+                        reservation.bucket_id for reservation in released
+                        if reservation.product_id == product_id
+                    }
+                )
+            except inventory.OutOfStock:
+                short.append(product_id)
+        return sorted(short)
+
+    @staticmethod
+    def take_stock(quantities):
+        """Move the stock of every product to purchased in one statement"""
+        taken = Case(*[
+            When(id=product_id, then=quantity)
+            for product_id, quantity in quantities.items()
+        ])
+        Product.objects.filter(id__in=quantities).update(
+            stock=F('stock') - taken,
+            purchased=F('purchased') + taken
+        )
+
+    @staticmethod
+    def stock_changed(store, products):
+        """
+        The stock is updated without saving the products, refresh what
+        depends on it: cached responses and collections on stock
+        """
+        if Condition.objects.filter(
+            collection__store_id=store.id,
+            field_reference=Condition.PRODUCT_STOCK
+        ).exists():
+            for product in products:
+                membership.refresh_product(product)
+        cache.invalidate_store(store.slug)
+
+
+class CartMergeService:
+    """
+    Business logic to fold the guest cart of a user who logs in into
+    their active cart of the same store, so that they keep one cart.
+    Without an active cart the guest cart is simply given to the user.
+    """
+
+    def __init__(self, instance=None):
+        self.instance = instance
+
+    def merge(self, user):
+        """Return the cart of the user holding the guest lines"""
+        with transaction.atomic():
+            guest = Cart.objects.select_for_update().filter(
+                pk=self.instance.pk,
+                user__isnull=True,
+                is_active=True
+            ).first()
+            if guest is None:
+                return None
+
+            cart = Cart.objects.valid().select_for_update().filter(
+                user=user,
+                store_id=guest.store_id
+            ).order_by('-updated_at').first()
+            if cart is None:
+                Cart.objects.filter(pk=guest.pk).update(user=user)
+                guest.user = user
+                return guest
+
+            cart.merge(guest)
+            return cart
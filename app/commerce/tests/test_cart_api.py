@@ -1,11 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
+import threading
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
-from core.models import Store, Product
+from commerce import serializers
+from core import inventory, throttling
+from core.models import Store, Product, Cart, CartItem, StockReservation
 
 
 def get_cart_url(store, revurl='commerce:cart-list'):
@@ -105,6 +118,59 @@ class GuestCartApiTests(TestCase):
         self.assertEqual(res.data['user'], None)
         self.assertEqual(res.data['amount'], '20.00')
 
+    def test_unknown_cart_or_product(self):
+        cart = Cart.objects.create(store=self.store)
+        payload = {'product_id': self.product1.id}
+        for revurl in ('commerce:cart-add-to-cart',
+                       'commerce:cart-remove-from-cart'):
+            url = cart_detail_url(self.store.slug, uuid.uuid4(), revurl)
+            res = self.client.post(url, payload)
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+            url = cart_detail_url(self.store.slug, cart.id, revurl)
+            res = self.client.post(url, {'product_id': 0})
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_inactive_cart_is_not_changed(self):
+        cart = Cart.objects.create(store=self.store)
+        cart.add(self.product1)
+        Cart.objects.filter(pk=cart.pk).update(is_active=False)
+        requests = (
+            ('commerce:cart-add-to-cart', {'product_id': self.product1.id}),
+            ('commerce:cart-remove-from-cart',
+             {'product_id': self.product1.id}),
+            ('commerce:cart-bulk-update',
+             {'items': [{'product_id': self.product1.id, 'quantity': 3}]}),
+            ('commerce:cart-reprice', {}),
+        )
+        for revurl, payload in requests:
+            url = cart_detail_url(self.store.slug, cart.id, revurl)
+            res = self.client.post(url, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        cart.refresh_from_db()
+        self.assertEqual(cart.amount, Decimal('5.00'))
+        self.assertEqual(cart.cart_items.get().quantity, 1)
+
+    def test_add_invalid_quantity(self):
+        cart = Cart.objects.create(store=self.store)
+        url = cart_detail_url(
+            self.store.slug,
+            cart.id,
+            'commerce:cart-add-to-cart'
+        )
+        for quantity in (-2, 0, 'abc', 1.5, None):
+            res = self.client.post(
+                url,
+                {'product_id': self.product1.id, 'quantity': quantity},
+                format='json'
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        cart.refresh_from_db()
+        self.assertEqual(cart.amount, Decimal('0.00'))
+        self.assertFalse(cart.cart_items.exists())
+
     def test_delete_product(self):
         url = get_cart_url(self.store.slug)
         res = self.client.post(url)
@@ -175,3 +241,675 @@ class AuthenticatedCartApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data['user']['email'], self.customer.email)
         self.assertEqual(res.data['amount'], '5.00')
+
+
+class CartMutationTests(TestCase):
+
+    def setUp(self):
+        owner = sample_user()
+        self.store = sample_store(owner)
+        self.product = sample_product(owner, self.store, price=15.15)
+        self.cart = Cart.objects.create(store=self.store)
+
+    def test_add_takes_two_statements(self):
+        self.cart.add(self.product)
+        with CaptureQueriesContext(connection) as context:
+            self.cart.add(self.product, 2)
+
+        statements = [
+            query['sql'] for query in context.captured_queries
+            if 'SAVEPOINT' not in query['sql']
+        ]
+        self.assertEqual(len(statements), 2)
+
+        item = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(item.quantity, 3)
+        self.assertEqual(item.total_price, Decimal('45.45'))
+        self.assertEqual(self.cart.amount, Decimal('45.45'))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, Decimal('45.45'))
+
+    def test_existing_line_keeps_its_price(self):
+        self.cart.add(self.product)
+        self.product.price = 20
+        self.product.save()
+
+        self.cart.add(self.product)
+
+        item = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(item.total_price, Decimal('30.30'))
+        self.assertEqual(self.cart.amount, Decimal('30.30'))
+
+    def test_remove_moves_amount(self):
+        other = sample_product(
+            self.store.user,
+            self.store,
+            title='Other',
+            price=2.50
+        )
+        self.cart.add(self.product)
+        self.cart.add(other, 2)
+
+        self.cart.remove(self.product)
+        self.cart.remove(self.product)
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, Decimal('5.00'))
+
+
+class CartPricingTests(TestCase):
+
+    def setUp(self):
+        owner = sample_user()
+        self.store = sample_store(owner)
+        self.product = sample_product(owner, self.store, price=15.15)
+        self.cart = Cart.objects.create(store=self.store)
+
+    def change_price(self, price):
+        self.product.price = Decimal(price)
+        self.product.save()
+
+    def test_price_is_taken_once(self):
+        item = CartItem.objects.create(
+            cart=self.cart,
+            product=self.product,
+            quantity=2
+        )
+        self.assertEqual(item.price, Decimal('15.15'))
+        self.change_price('20.00')
+
+        item.quantity = 3
+        with self.assertNumQueries(2):
+            item.save()
+
+        self.assertEqual(item.price, Decimal('15.15'))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, Decimal('45.45'))
+
+        item.delete()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, Decimal('0.00'))
+
+    def test_cart_save_keeps_amount(self):
+        stale = Cart.objects.get(id=self.cart.id)
+        self.cart.add(self.product)
+
+        stale.currency = 'USD'
+        stale.save()
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.amount, Decimal('15.15'))
+
+    def test_reprice(self):
+        self.cart.add(self.product, 2)
+        self.assertFalse(self.cart.has_stale_prices())
+        self.change_price('20.00')
+        self.assertTrue(self.cart.has_stale_prices())
+
+        # savepoint, lines with their products, lines, amount, release
+        with self.assertNumQueries(5):
+            repriced = self.cart.reprice()
+
+        self.assertEqual(len(repriced), 1)
+        self.assertEqual(self.cart.amount, Decimal('40.00'))
+        self.assertFalse(self.cart.has_stale_prices())
+
+    def test_reprice_endpoint(self):
+        self.cart.add(self.product, 2)
+        self.change_price('20.00')
+        client = APIClient()
+
+        res = client.get(cart_detail_url(self.store.slug, self.cart.id))
+        self.assertTrue(res.data['stale_prices'])
+
+        res = client.post(cart_detail_url(
+            self.store.slug,
+            self.cart.id,
+            'commerce:cart-reprice'
+        ))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(res.data['stale_prices'])
+        self.assertEqual(res.data['amount'], '40.00')
+
+
+class CartBulkApiTests(TestCase):
+
+    def setUp(self):
+        self.owner = sample_user()
+        self.store = sample_store(self.owner)
+        self.products = [
+            sample_product(
+                self.owner,
+                self.store,
+                title=f'Product {i}',
+                price=i + 0.25
+            ) for i in range(1, 31)
+        ]
+        self.client = APIClient()
+        self.cart = Cart.objects.create(store=self.store)
+        self.url = cart_detail_url(
+            self.store.slug,
+            self.cart.id,
+            'commerce:cart-bulk-update'
+        )
+
+    def post(self, items):
+        return self.client.post(self.url, {'items': items}, format='json')
+
+    def test_set_add_and_remove_lines(self):
+        first, second, third = self.products[:3]
+        self.cart.add(first)
+        self.cart.add(second)
+
+        res = self.post([
+            {'product_id': first.id, 'quantity': 4, 'note': 'gift'},
+            {'product_id': second.id, 'quantity': 0},
+            {'product_id': third.id, 'quantity': 2},
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['amount'], '11.50')
+        lines = {
+            item.product_id: item for item in self.cart.cart_items.all()
+        }
+        self.assertEqual(set(lines), {first.id, third.id})
+        self.assertEqual(lines[first.id].quantity, 4)
+        self.assertEqual(lines[first.id].note, 'gift')
+        self.assertEqual(lines[third.id].total_price, Decimal('6.50'))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, Decimal('11.50'))
+
+    def test_unknown_product(self):
+        other_store = sample_store(self.owner, title='Other Store')
+        other = sample_product(self.owner, other_store)
+
+        res = self.post([
+            {'product_id': self.products[0].id, 'quantity': 1},
+            {'product_id': other.id, 'quantity': 1},
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.cart.cart_items.exists())
+
+    def test_negative_quantity(self):
+        res = self.post([{'product_id': self.products[0].id, 'quantity': -1}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_queries_do_not_grow_with_lines(self):
+        def count(products):
+            with CaptureQueriesContext(connection) as context:
+                res = self.post([
+                    {'product_id': product.id, 'quantity': 1}
+                    for product in products
+                ])
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return len(context.captured_queries)
+
+        count(self.products[:1])
+        self.assertEqual(
+            count(self.products[1:4]),
+            count(self.products[4:])
+        )
+
+
+class CartExpiryTests(TestCase):
+
+    def setUp(self):
+        owner = sample_user()
+        self.store = sample_store(owner)
+        self.product = sample_product(owner, self.store)
+        self.cart = Cart.objects.create(store=self.store)
+
+    def expire_in(self, **delta):
+        Cart.objects.filter(pk=self.cart.pk).update(
+            invalid_at=timezone.now() + timezone.timedelta(**delta)
+        )
+        self.cart.refresh_from_db()
+
+    def test_default_is_per_cart(self):
+        later = Cart.objects.create(store=self.store)
+        self.assertGreater(later.invalid_at, self.cart.invalid_at)
+        self.assertGreater(
+            self.cart.invalid_at,
+            timezone.now() + timezone.timedelta(days=9)
+        )
+
+    def test_recent_touch_does_not_write(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(self.cart.touch())
+
+    def test_touch_slides_expiry(self):
+        self.expire_in(days=1)
+        self.assertTrue(self.cart.touch())
+
+        self.cart.refresh_from_db()
+        self.assertGreater(
+            self.cart.invalid_at,
+            timezone.now() + timezone.timedelta(days=9)
+        )
+
+    def test_add_slides_expiry(self):
+        self.expire_in(days=1)
+        self.cart.add(self.product)
+
+        self.cart.refresh_from_db()
+        self.assertGreater(
+            self.cart.invalid_at,
+            timezone.now() + timezone.timedelta(days=9)
+        )
+
+    def test_retrieve_touches_cart(self):
+        self.expire_in(hours=1)
+        res = APIClient().get(cart_detail_url(self.store.slug, self.cart.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.cart.refresh_from_db()
+        self.assertTrue(self.cart.is_valid)
+        self.assertGreater(
+            self.cart.invalid_at,
+            timezone.now() + timezone.timedelta(days=9)
+        )
+
+    def test_valid(self):
+        self.expire_in(seconds=-1)
+        self.assertFalse(self.cart.is_valid)
+        self.assertFalse(self.cart.touch())
+        fresh = Cart.objects.create(store=self.store)
+        Cart.objects.create(store=self.store, is_active=False)
+
+        self.assertEqual(list(Cart.objects.valid()), [fresh])
+
+
+@override_settings(CART_THROTTLE={
+    'ALIAS': 'default',
+    'RATES': {
+        'cart-create': {'anon': '2/min', 'user': '3/min'},
+        'cart-mutate': {'anon': '1/s'},
+    },
+    'STORES': {'other-store': {'cart-create': {'anon': '1/min'}}},
+})
+class CartThrottleTests(TestCase):
+
+    def setUp(self):
+        throttling.get_cache().clear()
+        self.owner = sample_user()
+        self.store = sample_store(self.owner)
+        self.other = sample_store(self.owner, title='Other Store')
+        self.product = sample_product(self.owner, self.store)
+        self.client = APIClient()
+
+    def tearDown(self):
+        throttling.get_cache().clear()
+
+    def create(self, store, client=None, **extra):
+        client = client or self.client
+        return client.post(get_cart_url(store.slug), **extra)
+
+    def test_guest_creation_burst(self):
+        for _ in range(2):
+            res = self.create(self.store)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = self.create(self.store)
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(Cart.objects.count(), 2)
+
+        # another address has its own bucket
+        res = self.create(self.store, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_forwarded_for_is_ignored(self):
+        for addr in ('1.1.1.1', '2.2.2.2'):
+            res = self.create(self.store, HTTP_X_FORWARDED_FOR=addr)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = self.create(self.store, HTTP_X_FORWARDED_FOR='3.3.3.3')
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_forwarded_for_behind_proxy(self):
+        config = dict(settings.CART_THROTTLE, NUM_PROXIES=1)
+        with override_settings(CART_THROTTLE=config):
+            for _ in range(2):
+                self.create(
+                    self.store,
+                    HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.9'
+                )
+            res = self.create(
+                self.store,
+                HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.9'
+            )
+            self.assertEqual(
+                res.status_code,
+                status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+            # only the address appended by the proxy counts
+            res = self.create(
+                self.store,
+                HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.8'
+            )
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_parallel_requests(self):
+        """Requests in parallel never take the same token"""
+        throttle = throttling.TokenBucketThrottle()
+        start = threading.Barrier(8)
+
+        def consume(_):
+            start.wait()
+            return throttle.consume('throttle:parallel', 3, 3 / 60)
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(consume, range(8)))
+
+        self.assertEqual(results.count(True), 3)
+
+    def test_user_bucket(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        self.create(self.store)
+        self.create(self.store)
+
+        for _ in range(3):
+            res = self.create(self.store, client)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = self.create(self.store, client)
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_store_rates(self):
+        self.assertEqual(
+            self.create(self.other).status_code,
+            status.HTTP_201_CREATED
+        )
+        self.assertEqual(
+            self.create(self.other).status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(
+            self.create(self.store).status_code,
+            status.HTTP_201_CREATED
+        )
+
+    def test_bucket_refills(self):
+        cart = Cart.objects.create(store=self.store)
+        url = reverse(
+            'commerce:cart-add-to-cart',
+            args=[self.store.slug, cart.id]
+        )
+        payload = {'product_id': self.product.id}
+
+        with mock.patch.object(throttling.time, 'time', return_value=1000):
+            res = self.client.post(url, payload)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            res = self.client.post(url, payload)
+            self.assertEqual(
+                res.status_code,
+                status.HTTP_429_TOO_MANY_REQUESTS
+            )
+            self.assertEqual(res['Retry-After'], '1')
+
+        with mock.patch.object(throttling.time, 'time', return_value=1001):
+            res = self.client.post(url, payload)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        # reading a cart is not limited
+        res = self.client.get(cart_detail_url(self.store.slug, cart.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+@override_settings(LAZY_CARTS=True)
+class LazyCartTests(TestCase):
+
+    def setUp(self):
+        throttling.get_cache().clear()
+        owner = sample_user()
+        self.store = sample_store(owner)
+        self.product = sample_product(owner, self.store)
+        self.client = APIClient()
+
+    def test_cart_stored_on_first_add(self):
+        res = self.client.post(get_cart_url(self.store.slug))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['cart_items'], [])
+        self.assertFalse(Cart.objects.exists())
+
+        url = reverse(
+            'commerce:cart-add-to-cart',
+            args=[self.store.slug, res.data['id']]
+        )
+        self.client.post(url, {'product_id': self.product.id})
+        res = self.client.post(url, {'product_id': self.product.id})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        cart = Cart.objects.get()
+        self.assertEqual(str(cart.id), res.data['id'])
+        self.assertEqual(cart.store, self.store)
+        self.assertIsNone(cart.user)
+        self.assertEqual(cart.amount, Decimal('10.00'))
+
+    @override_settings(CART_THROTTLE={
+        'ALIAS': 'default',
+        'RATES': {'cart-create': {'anon': '1/min'}},
+    })
+    def test_storing_is_throttled_as_creation(self):
+        def add(cart_id):
+            url = reverse(
+                'commerce:cart-add-to-cart',
+                args=[self.store.slug, cart_id]
+            )
+            return self.client.post(url, {'product_id': self.product.id})
+
+        cart_id = uuid.uuid4()
+        self.assertEqual(add(cart_id).status_code, status.HTTP_200_OK)
+        self.assertEqual(add(cart_id).status_code, status.HTTP_200_OK)
+
+        res = add(uuid.uuid4())
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_cart_of_another_store(self):
+        other = sample_store(self.store.user, title='Other', slug='other')
+        cart = Cart.objects.create(store=other)
+        url = reverse(
+            'commerce:cart-add-to-cart',
+            args=[self.store.slug, cart.id]
+        )
+
+        res = self.client.post(url, {'product_id': self.product.id})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(cart.cart_items.exists())
+
+    def test_invalid_id(self):
+        url = reverse(
+            'commerce:cart-add-to-cart',
+            args=[self.store.slug, 'not-a-cart']
+        )
+        res = self.client.post(url, {'product_id': self.product.id})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Cart.objects.exists())
+
+
+class CartMergeTests(TestCase):
+
+    def setUp(self):
+        self.user = sample_user()
+        self.store = sample_store(self.user)
+        self.product1 = sample_product(self.user, self.store, price=5)
+        self.product2 = sample_product(
+            self.user,
+            self.store,
+            title='Product 2',
+            price=2.50
+        )
+        self.guest = Cart.objects.create(store=self.store)
+        self.guest.add(self.product1, 2)
+        self.guest.add(self.product2)
+
+    def login(self, cart_id):
+        return APIClient().post(reverse('user:token'), {
+            'email': 'tmp_user@cinolabs.com',
+            'password': 'testpass',
+            'cart': cart_id,
+        })
+
+    def test_merge_into_user_cart(self):
+        cart = Cart.objects.create(store=self.store, user=self.user)
+        cart.add(self.product1)
+        inventory.hold_cart(self.guest)
+
+        res = self.login(self.guest.id)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('token', res.data)
+        self.assertEqual(res.data['cart'], str(cart.id))
+        self.assertFalse(Cart.objects.filter(id=self.guest.id).exists())
+        quantities = dict(
+            cart.cart_items.values_list('product_id', 'quantity')
+        )
+        self.assertEqual(
+            quantities,
+            {self.product1.id: 3, self.product2.id: 1}
+        )
+        cart.refresh_from_db()
+        self.assertEqual(cart.amount, Decimal('17.50'))
+        self.assertEqual(
+            StockReservation.objects.filter(cart=cart).count(),
+            2
+        )
+
+    def test_guest_cart_given_to_user(self):
+        res = self.login(self.guest.id)
+
+        self.assertEqual(res.data['cart'], str(self.guest.id))
+        self.guest.refresh_from_db()
+        self.assertEqual(self.guest.user, self.user)
+
+    def test_cart_of_someone_else(self):
+        other = get_user_model().objects.create_user(
+            'other@cinolabs.com',
+            'testpass'
+        )
+        cart = Cart.objects.create(store=self.store, user=other)
+
+        res = self.login(cart.id)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('cart', res.data)
+        cart.refresh_from_db()
+        self.assertEqual(cart.user, other)
+
+    def test_inactive_cart_not_found(self):
+        cart = Cart.objects.create(
+            store=self.store,
+            user=self.user,
+            is_active=False
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.get(cart_detail_url(self.store.slug, cart.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ConcurrentCartAddTests(TransactionTestCase):
+    """Parallel adds to one cart must all be counted"""
+    workers = 8
+    adds = 40
+
+    def test_parallel_adds(self):
+        owner = sample_user()
+        store = sample_store(owner)
+        product = sample_product(owner, store, price=15.15)
+        cart_id = Cart.objects.create(store=store).id
+        start = threading.Barrier(self.workers)
+
+        def add(i):
+            if i < self.workers:
+                start.wait()
+            try:
+                Cart.objects.get(id=cart_id).add(product)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            list(executor.map(add, range(self.adds)))
+
+        item = CartItem.objects.get(cart_id=cart_id)
+        cart = Cart.objects.get(id=cart_id)
+        self.assertEqual(item.quantity, self.adds)
+        self.assertEqual(item.total_price, Decimal('15.15') * self.adds)
+        self.assertEqual(cart.amount, Decimal('15.15') * self.adds)
+
+
+class FastCartSerializerParityTests(TestCase):
+    """The fast serializers must render exactly the same bytes"""
+
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(
+            email='owner@cinolabs.com',
+            password='testpass',
+            name='store owner'
+        )
+        self.store = sample_store(self.owner)
+        self.product1 = sample_product(self.owner, self.store)
+        self.product2 = sample_product(
+            self.owner,
+            self.store,
+            title='Product 2',
+            price=15.15
+        )
+
+    def assertSameOutput(self, cart):
+        cart = serializers.CartSerializer.setup_eager_loading(
+            Cart.objects.filter(id=cart.id)
+        ).get()
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(serializers.FastCartSerializer(cart).data),
+            renderer.render(serializers.CartSerializer(cart).data)
+        )
+
+    def test_guest_cart(self):
+        cart = Cart.objects.create(store=self.store)
+        self.assertSameOutput(cart)
+
+        cart.add(self.product1, 2, 'gift')
+        cart.add(self.product2)
+        self.assertSameOutput(cart)
+
+    def test_stale_cart(self):
+        cart = Cart.objects.create(store=self.store)
+        cart.add(self.product1)
+        self.product1.price = 7
+        self.product1.save()
+
+        self.assertSameOutput(cart)
+
+    def test_customer_cart(self):
+        cart = Cart.objects.create(store=self.store, user=self.owner)
+        cart.add(self.product2, 3)
+
+        self.assertSameOutput(cart)
+
+    def test_cart_endpoint(self):
+        client = APIClient()
+        cart_id = client.post(get_cart_url(self.store.slug)).data['id']
+        Cart.objects.get(id=cart_id).add(self.product1, 2)
+        # removing a product that is not in the cart leaves it unchanged
+        url = cart_detail_url(
+            self.store.slug,
+            cart_id,
+            'commerce:cart-remove-from-cart'
+        )
+        payload = {'product_id': self.product2.id}
+        expected = client.post(url, payload, format='json').content
+
+        with self.settings(FAST_SERIALIZERS=True):
+            res = client.post(url, payload, format='json')
+
+        self.assertEqual(res.content, expected)
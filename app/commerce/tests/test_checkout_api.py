@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import threading
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from commerce.services import CheckoutError, CheckoutService
+from core.models import Store, Product, Cart, Order, OrderStatusHistory, \
+                        Collection, Condition
+
+
+def checkout_url(store, cart_id):
+    return reverse('commerce:cart-checkout', args=[store, cart_id])
+
+
+def sample_user(email='tmp_user@cinolabs.com', password='testpass'):
+    return get_user_model().objects.create_user(email, password)
+
+
+def sample_store(user, title='Main Store'):
+    return Store.objects.create(
+        user=user,
+        title=title
+    )
+
+
+def sample_product(user, store, **params):
+    """create and return sample product"""
+    defaults = {
+        'title': 'Sample Product',
+        'price': 5.00,
+        'stock': 3,
+        'published': True
+    }
+    defaults.update(params)
+
+    return Product.objects.create(
+        user=user,
+        store=store,
+        **defaults
+    )
+
+
+class CheckoutApiTests(TestCase):
+
+    def setUp(self):
+        self.owner = sample_user()
+        self.store = sample_store(self.owner)
+        self.customer = sample_user(email='customer@cinolabs.com')
+        self.product1 = sample_product(self.owner, self.store)
+        self.product2 = sample_product(
+            self.owner,
+            self.store,
+            title='Product 2',
+            price=15.15,
+            stock=10
+        )
+        self.cart = Cart.objects.create(store=self.store)
+        self.cart.add(self.product1, 2)
+        self.cart.add(self.product2, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_checkout(self):
+        res = self.client.post(checkout_url(self.store.slug, self.cart.id))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(id=res.data['id'])
+        self.assertEqual(order.user, self.customer)
+        self.assertEqual(order.final_amount, Decimal('55.45'))
+        self.assertEqual(
+            {(i.product_id, i.quantity) for i in order.order_items.all()},
+            {(self.product1.id, 2), (self.product2.id, 3)}
+        )
+        self.assertTrue(OrderStatusHistory.objects.filter(
+            order=order,
+            status=order.status
+        ).exists())
+
+        self.product1.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.assertEqual(
+            (self.product1.stock, self.product1.purchased),
+            (1, 2)
+        )
+        self.assertEqual(
+            (self.product2.stock, self.product2.purchased),
+            (7, 3)
+        )
+        self.cart.refresh_from_db()
+        self.assertFalse(self.cart.is_active)
+
+    def test_checkout_twice(self):
+        self.client.post(checkout_url(self.store.slug, self.cart.id))
+        res = self.client.post(checkout_url(self.store.slug, self.cart.id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_not_enough_stock(self):
+        self.cart.add(self.product1, 2)
+
+        res = self.client.post(checkout_url(self.store.slug, self.cart.id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product2.stock, 10)
+
+    def test_requires_authentication(self):
+        res = APIClient().post(checkout_url(self.store.slug, self.cart.id))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cart_of_another_customer(self):
+        self.cart.user = self.owner
+        self.cart.save()
+
+        res = self.client.post(checkout_url(self.store.slug, self.cart.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CommittedCheckoutTests(TransactionTestCase):
+    """Checkouts committing their own transaction"""
+    carts = 12
+    stock = 5
+
+    def test_no_overselling(self):
+        """Concurrent checkouts never sell more than the stock"""
+        owner = sample_user()
+        store = sample_store(owner)
+        scarce = sample_product(owner, store, stock=self.stock)
+        common = sample_product(owner, store, title='Common', stock=100)
+        carts = []
+        for i in range(self.carts):
+            cart = Cart.objects.create(store=store, user=owner)
+            # add the products in both orders, the locks must not deadlock
+            for product in (scarce, common)[::1 if i % 2 else -1]:
+                cart.add(product)
+            carts.append(cart)
+        start = threading.Barrier(self.carts)
+
+        def checkout(cart):
+            start.wait()
+            try:
+                CheckoutService(cart).checkout(owner)
+                return True
+            except CheckoutError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.carts) as executor:
+            results = list(executor.map(checkout, carts))
+
+        scarce.refresh_from_db()
+        common.refresh_from_db()
+        self.assertEqual(results.count(True), self.stock)
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual((scarce.stock, scarce.purchased), (0, self.stock))
+        self.assertEqual(common.purchased, self.stock)
+        self.assertEqual(
+            Cart.objects.filter(is_active=True).count(),
+            self.carts - self.stock
+        )
+
+    def test_stock_collections_are_refreshed(self):
+        owner = sample_user()
+        store = sample_store(owner)
+        product = sample_product(owner, store, stock=1)
+        collection = Collection.objects.create(
+            title='Sold out',
+            store=store,
+            user=owner
+        )
+        Condition.objects.create(
+            collection=collection,
+            field_reference=Condition.PRODUCT_STOCK,
+            filter_type=Condition.LTE,
+            field_val='0'
+        )
+        cart = Cart.objects.create(store=store)
+        cart.add(product)
+
+        CheckoutService(cart).checkout(owner)
+
+        self.assertEqual(list(collection.get_products()), [product])
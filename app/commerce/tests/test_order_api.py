@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
@@ -114,6 +116,85 @@ class OrderTests(TestCase):
         self.assertEqual(orderitem1.total_price, Decimal('5.00'))
         self.assertEqual(orderitem2.total_price, Decimal('30.30'))
 
+    def test_item_changes_move_the_amount(self):
+        product1 = sample_product(self.owner, self.store)
+        product2 = sample_product(
+            self.owner,
+            self.store,
+            title='Product 2',
+            price=15.15
+        )
+        sample_orderitem(self.order, product1)
+        sample_orderitem(self.order, product2)
+
+        item = OrderItem.objects.get(product=product2)
+        item.quantity = 3
+        item.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount, Decimal('50.45'))
+
+        item.delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount, Decimal('5.00'))
+        self.assertEqual(self.order.final_amount, Decimal('5.00'))
+
+    def test_save_does_not_aggregate(self):
+        product = sample_product(self.owner, self.store)
+
+        with CaptureQueriesContext(connection) as context:
+            sample_orderitem(self.order, product, quantity=2)
+
+        self.assertFalse(any(
+            'SUM(' in query['sql'] for query in context.captured_queries
+        ))
+        self.assertEqual(self.order.amount, Decimal('10.00'))
+
+    def test_save_keeps_item_changes(self):
+        """Saving an order loaded before an item change keeps the change"""
+        product = sample_product(self.owner, self.store)
+        stale = Order.objects.get(pk=self.order.pk)
+        sample_orderitem(self.order, product, quantity=2)
+
+        stale.status = Order.SHIPPED
+        stale.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.SHIPPED)
+        self.assertEqual(self.order.amount, Decimal('10.00'))
+        self.assertEqual(self.order.final_amount, Decimal('10.00'))
+
+        stale.discount_amount = Decimal('1.50')
+        stale.save()
+        self.assertEqual(stale.amount, Decimal('10.00'))
+        self.assertEqual(stale.final_amount, Decimal('8.50'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.final_amount, Decimal('8.50'))
+
+    def test_add_items(self):
+        products = [
+            sample_product(self.owner, self.store, title=f'Product {i}')
+            for i in range(5)
+        ]
+        self.order.discount_amount = Decimal('1.00')
+        self.order.save()
+
+        with CaptureQueriesContext(connection) as context:
+            items = self.order.add_items([
+                OrderItem(product=product, quantity=i + 1, price=product.price)
+                for i, product in enumerate(products)
+            ])
+
+        statements = [
+            query['sql'] for query in context.captured_queries
+            if 'SAVEPOINT' not in query['sql']
+        ]
+        self.assertEqual(len(statements), 2)
+
+        self.assertEqual(items[4].total_price, Decimal('25.00'))
+        self.assertEqual(self.order.amount, Decimal('75.00'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount, Decimal('75.00'))
+        self.assertEqual(self.order.final_amount, Decimal('74.00'))
+
 
 class PublicOrderApiTests(TestCase):
     """Basic test for authorization"""
@@ -88,7 +88,7 @@ class PrivateShippingApiTests(TestCase):
         res = self.client.get(url, {'userid': customer.id})
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 2)
+        self.assertEqual(len(res.data['results']), 2)
 
         url = shipping_url(
             self.store.slug,
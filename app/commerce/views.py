@@ -1,32 +1,45 @@
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import prefetch_related_objects
+from django.http import Http404
+from django.utils.translation import gettext as _
+
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import viewsets, status, permissions, mixins
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.generics import get_object_or_404
 
-from core.models import Shipping, Order, Cart, Store, Product
+from core import inventory
+from core.models import Shipping, Order, Cart, Product
+from core.pagination import KeysetPagination
 from core.permissions import IsOwnerOrStaff
+from core.stores import StoreScopedMixin
+from core.throttling import TokenBucketThrottle
 from commerce import serializers
+from commerce.services import CheckoutError, CheckoutService
 
 
-class ShippingViewSet(viewsets.ModelViewSet):
+class ShippingViewSet(StoreScopedMixin, viewsets.ModelViewSet):
     authentication_classes = (TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrStaff,)
     serializer_class = serializers.ShippingSerializer
     queryset = Shipping.objects.all()
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """Return objects for the base store"""
-        queryset = self.queryset
-        store_slug = self.kwargs['store']
+        queryset = self.queryset.filter(store_id=self.get_store_id())
         userid = self.request.query_params.get('userid', None)
 
         if userid:
             return queryset.filter(
-                store__slug=store_slug,
                 user__id=userid
             ).order_by('-updated_at')
 
-        return self.queryset.filter(store__slug=store_slug)
+        return queryset
 
     @action(methods=['GET'], detail=False, url_path='shipping-active')
     def get_active(self, request, store=None, *args):
@@ -49,6 +62,8 @@ class StoreOwnerOrderViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrStaff,)
     serializer_class = serializers.OrderSerializer
     queryset = Order.objects.all()
+    pagination_class = KeysetPagination
+    pagination_ordering = ('-created_at', '-id')
 
 
 class CustomerOrderViewSet(viewsets.ModelViewSet):
@@ -56,9 +71,12 @@ class CustomerOrderViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrStaff,)
     serializer_class = serializers.OrderSerializer
     queryset = Order.objects.all()
+    pagination_class = KeysetPagination
+    pagination_ordering = ('-created_at', '-id')
 
 
-class CartViewSet(mixins.CreateModelMixin,
+class CartViewSet(StoreScopedMixin,
+                  mixins.CreateModelMixin,
                   mixins.RetrieveModelMixin,
                   mixins.UpdateModelMixin,
                   mixins.DestroyModelMixin,
@@ -67,25 +85,43 @@ class CartViewSet(mixins.CreateModelMixin,
     authentication_classes = (TokenAuthentication,)
     serializer_class = serializers.CartSerializer
     queryset = Cart.objects.all()
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scopes = {
+        'create': 'cart-create',
+        'update': 'cart-mutate',
+        'partial_update': 'cart-mutate',
+        'destroy': 'cart-mutate',
+        'add_to_cart': 'cart-mutate',
+        'remove_from_cart': 'cart-mutate',
+        'bulk_update': 'cart-mutate',
+        'reprice': 'cart-mutate',
+        'reserve': 'cart-mutate',
+        'checkout': 'cart-mutate',
+    }
 
     def create(self, request, store=None, *args, **kwargs):
         """
-        Possible issue with spamming url can create unlimited entries in
-        the cart table.  Find a way to throttle and test
+        Creation is throttled, with settings.LAZY_CARTS the cart is only
+        stored by its first add-to-cart
         """
-        store = Store.objects.get(slug=store)
         user = self.request.user
         if request.user.is_anonymous:
             user = None
-        cart = Cart.objects.create(
-            store=store,
-            user=user
-        )
-        serializer = serializers.CartSerializer(cart)
+        cart = Cart(store_id=self.get_store_id_or_404(), user=user)
+        if not settings.LAZY_CARTS:
+            cart.save()
+        serializer = serializers.cart_serializer_class()(cart)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def retrieve(self, request, *args, **kwargs):
+        """Reading a cart counts as activity and keeps it from expiring"""
+        cart = self.get_object()
+        cart.touch()
+        serializer = self.get_serializer(cart)
+        return Response(serializer.data)
+
     def get_permissions(self):
-        if self.action == 'list':
+        if self.action in ('list', 'checkout'):
             permission_classes = [
                 permissions.IsAuthenticated, IsOwnerOrStaff,
             ]
@@ -93,51 +129,184 @@ class CartViewSet(mixins.CreateModelMixin,
             permission_classes = []
         return [permission() for permission in permission_classes]
 
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return serializers.cart_serializer_class()
+        return self.serializer_class
+
     def get_queryset(self):
-        """Return objects for the base store"""
-        queryset = self.queryset
-        store_slug = self.kwargs['store']
+        """Return the active carts of the base store"""
+        queryset = serializers.CartSerializer.setup_eager_loading(
+            self.queryset
+        )
+        queryset = queryset.filter(
+            store_id=self.get_store_id(),
+            is_active=True
+        )
         user = self.request.user
 
-        if user:
-            return queryset.filter(
-                store__slug=store_slug,
-                user=user
-            )
+        if user.is_authenticated:
+            return queryset.filter(user=user)
+        queryset = queryset.filter(user__isnull=True)
         id = self.request.query_params.get('id', None)
-        return queryset.filter(
-            store__slug=store_slug,
-            id=id
+        if id:
+            queryset = queryset.filter(id=id)
+        return queryset
+
+    def get_or_create_cart(self, id, store_id):
+        """
+        The cart of the store, stored now if it was created lazily. Storing
+        it is charged to the cart-create throttle, like the create endpoint
+        """
+        if settings.LAZY_CARTS:
+            try:
+                id = uuid.UUID(str(id))
+            except ValueError:
+                raise Http404
+            if not Cart.objects.filter(id=id).exists():
+                throttle = TokenBucketThrottle()
+                if not throttle.allow_scope(self.request, self, 'cart-create'):
+                    self.throttled(self.request, throttle.wait())
+                user = self.request.user
+                try:
+                    with transaction.atomic():
+                        return Cart.objects.create(
+                            id=id,
+                            store_id=store_id,
+                            user=user if user.is_authenticated else None
+                        )
+                except IntegrityError:
+                    # stored by a concurrent request
+                    pass
+        return get_object_or_404(
+            Cart,
+            id=id,
+            store_id=store_id,
+            is_active=True
         )
 
     @action(methods=['POST'], detail=True, url_path='add-to-cart')
     def add_to_cart(self, request, store, id, *args, **kwargs):
-        store = Store.objects.get(slug=store)
-        cart = Cart.objects.get(id=id)
-        # use get_object()
-        product_id = request.data.get('product_id', None)
-        product = Product.objects.get(store=store, id=product_id)
-        if product:
-            quantity = request.data.get('quantity', 1)
-            note = request.data.get('note', '')
-            cart.add(product, quantity, note)
-            serializer = serializers.CartSerializer(cart, many=False)
+        store_id = self.get_store_id_or_404()
+        line = serializers.CartAddSerializer(data=request.data)
+        if not line.is_valid():
+            return Response(
+                line.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        cart = self.get_or_create_cart(id, store_id)
+        product = get_object_or_404(
+            Product,
+            store_id=store_id,
+            id=line.validated_data['product_id']
+        )
+        cart.add(
+            product,
+            line.validated_data['quantity'],
+            line.validated_data['note']
+        )
+        serializer = serializers.cart_serializer_class()(cart)
+        return Response(serializer.data)
+
+    @action(methods=['POST'], detail=True, url_path='bulk-update')
+    def bulk_update(self, request, store, id, *args, **kwargs):
+        """
+        Set many lines at once from {"items": [{"product_id", "quantity",
+        "note"}]}, a zero quantity removes the line
+        """
+        store_id = self.get_store_id_or_404()
+        cart = get_object_or_404(
+            Cart,
+            id=id,
+            store_id=store_id,
+            is_active=True
+        )
+        serializer = serializers.CartBulkSerializer(
+            data=request.data,
+            context={'store_id': store_id}
+        )
+
+        if serializer.is_valid():
+            cart.set_items(serializer.validated_data['items'])
+            prefetch_related_objects([cart], 'cart_items__product')
+            serializer = serializers.cart_serializer_class()(cart)
             return Response(serializer.data)
         return Response(
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(methods=['POST'], detail=True, url_path='reprice')
+    def reprice(self, request, store, id, *args, **kwargs):
+        """Update the price of the lines to the current product prices"""
+        cart = get_object_or_404(
+            Cart,
+            id=id,
+            store_id=self.get_store_id_or_404(),
+            is_active=True
+        )
+        cart.reprice()
+        prefetch_related_objects([cart], 'cart_items__product')
+        serializer = serializers.cart_serializer_class()(cart)
+        return Response(serializer.data)
+
+    @action(methods=['POST'], detail=True, url_path='reserve')
+    def reserve(self, request, store, id, *args, **kwargs):
+        """Hold the stock of every line of the cart for a while"""
+        cart = get_object_or_404(
+            Cart,
+            id=id,
+            store_id=self.get_store_id_or_404(),
+            is_active=True
+        )
+        try:
+            holds = inventory.hold_cart(cart)
+        except inventory.OutOfStock as error:
+            return Response(
+                {'detail': _('Not enough stock for product %(id)s') % {
+                    'id': error.product_id
+                }},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = serializers.StockReservationSerializer(holds, many=True)
+        return Response(serializer.data)
+
+    @action(methods=['POST'], detail=True, url_path='checkout')
+    def checkout(self, request, store, id, *args, **kwargs):
+        """Turn the cart into an order of the authenticated user"""
+        cart = get_object_or_404(
+            Cart,
+            id=id,
+            store_id=self.get_store_id_or_404()
+        )
+        if cart.user_id not in (None, request.user.id):
+            raise Http404
+
+        try:
+            order = CheckoutService(cart).checkout(request.user)
+        except CheckoutError as error:
+            return Response(
+                {'detail': str(error)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = serializers.OrderSerializer(order)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(methods=['POST'], detail=True, url_path='remove-from-cart')
     def remove_from_cart(self, request, store, id, *args, **kwargs):
-        store = Store.objects.get(slug=store)
-        cart = Cart.objects.get(id=id)
+        store_id = self.get_store_id_or_404()
+        cart = get_object_or_404(
+            Cart,
+            id=id,
+            store_id=store_id,
+            is_active=True
+        )
         product_id = request.data.get('product_id', None)
-        product = Product.objects.get(store=store, id=product_id)
+        product = get_object_or_404(Product, store_id=store_id, id=product_id)
 
         if product:
             cart.remove(product)
-            serializer = serializers.CartSerializer(cart, many=False)
+            serializer = serializers.cart_serializer_class()(cart)
             return Response(serializer.data)
         return Response(
             serializer.errors,
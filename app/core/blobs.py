@@ -0,0 +1,140 @@
+"""
+Reference counts of the blob storage and its garbage collection.
+
+Every product image and attachment stored in the blob storage holds a
+reference to its blob, taken when the upload is saved and given back when
+the row is deleted or its file replaced. The count lives in MediaBlob and
+is only changed by single statements, so concurrent uploads of the same
+content can not lose a reference.
+
+A blob is deleted by collect() once it has been unreferenced, and its file
+untouched, for settings.MEDIA_BLOBS['GC_GRACE'] seconds. The grace period
+covers uploads whose file is written but whose reference is not committed
+yet; files never referenced at all are deleted by collect_orphans().
+"""
+from collections import Counter
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import MediaBlob
+from core.storage import blob_storage
+
+
+def _blob_names(names):
+    prefix = settings.MEDIA_BLOBS['PREFIX'] + '/'
+    return Counter(name for name in names if name and name.startswith(prefix))
+
+
+def acquire(names):
+    """Take a reference to each blob of names, in one statement"""
+    counts = _blob_names(names)
+    if not counts:
+        return
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {MediaBlob._meta.db_table} AS blob '
+            '(name, refcount, updated_at) VALUES '
+            + ', '.join(['(%s, %s, %s)'] * len(counts)) +
+            ' ON CONFLICT (name) DO UPDATE SET '
+            'refcount = blob.refcount + EXCLUDED.refcount, '
+            'updated_at = EXCLUDED.updated_at',
+            [value for name, count in counts.items()
+             for value in (name, count, now)]
+        )
+
+
+def release(names):
+    """Give back a reference to each blob of names"""
+    for name, count in _blob_names(names).items():
+        MediaBlob.objects.filter(name=name).update(
+            refcount=F('refcount') - count,
+            updated_at=timezone.now()
+        )
+
+
+def _cutoff(grace, now):
+    if grace is None:
+        grace = settings.MEDIA_BLOBS['GC_GRACE']
+    return (now or timezone.now()) - timezone.timedelta(seconds=grace)
+
+
+def _delete_files(storage, name, cutoff):
+    """Delete a blob and its variants unless it was saved again lately"""
+    if storage.exists(name):
+        if storage.get_modified_time(name) >= cutoff:
+            return False
+        storage.delete(name)
+    directory, filename = os.path.split(name)
+    digest = os.path.splitext(filename)[0]
+    for sibling in storage.listdir(directory)[1]:
+        if sibling.startswith(f'{digest}_'):
+            storage.delete(f'{directory}/{sibling}')
+    return True
+
+
+def collect(grace=None, batch_size=100, now=None):
+    """
+    Delete the unreferenced blobs, in batches of rows locked with SKIP
+    LOCKED. Yields the number of blobs deleted by each batch.
+    """
+    storage = blob_storage()
+    cutoff = _cutoff(grace, now)
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(
+                MediaBlob.objects.select_for_update(skip_locked=True).filter(
+                    refcount__lte=0,
+                    updated_at__lt=cutoff,
+                    id__gt=last_id
+                ).order_by('id')[:batch_size]
+            )
+            if not blobs:
+                return
+            last_id = blobs[-1].id
+            deleted = [
+                blob.id for blob in blobs
+                if _delete_files(storage, blob.name, cutoff)
+            ]
+            MediaBlob.objects.filter(id__in=deleted).delete()
+        yield len(deleted)
+
+
+def collect_orphans(grace=None, now=None):
+    """Delete the files of the blob storage without a MediaBlob row"""
+    storage = blob_storage()
+    cutoff = _cutoff(grace, now)
+    prefix = settings.MEDIA_BLOBS['PREFIX']
+    if not storage.exists(prefix):
+        return 0
+
+    deleted = 0
+    directories, leftovers = storage.listdir(prefix)
+    # temporary files of interrupted uploads
+    for filename in leftovers:
+        name = f'{prefix}/{filename}'
+        if storage.get_modified_time(name) < cutoff:
+            storage.delete(name)
+            deleted += 1
+
+    for directory in directories:
+        directory = f'{prefix}/{directory}'
+        known = {
+            os.path.splitext(os.path.basename(name))[0]
+            for name in MediaBlob.objects.filter(
+                name__startswith=f'{directory}/'
+            ).values_list('name', flat=True)
+        }
+        for filename in storage.listdir(directory)[1]:
+            name = f'{directory}/{filename}'
+            digest = os.path.splitext(filename)[0].split('_')[0]
+            if digest not in known and \
+                    storage.get_modified_time(name) < cutoff:
+                storage.delete(name)
+                deleted += 1
+    return deleted
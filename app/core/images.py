@@ -0,0 +1,152 @@
+"""
+Smaller variants of the uploaded images.
+
+Each size of settings.IMAGE_VARIANTS['SIZES'] is rendered in every format
+of IMAGE_VARIANTS['FORMATS'] that Pillow can write, and stored next to the
+original, in the storage of the original, as <original name without
+extension>_<size>.<format>. The names only depend on the original, and
+serializers only list the variants found in the storage, so a variant not
+rendered yet or whose render failed is never linked.
+
+Rendering happens once the upload is committed, in a pool of worker
+processes sized by IMAGE_VARIANTS['WORKERS'] (0 to render in the calling
+process), then the caller is told so it can drop cached responses. Every
+web worker process starts its own pool, so keep it small.
+The workers only use the storage, never the database. A failed render is
+logged and leaves the image without variants, it never fails the upload.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def supported_formats():
+    """The configured formats Pillow has an encoder for"""
+    Image.init()
+    return [
+        fmt for fmt in settings.IMAGE_VARIANTS['FORMATS']
+        if fmt.upper() in Image.SAVE
+    ]
+
+
+def variant_name(name, size, fmt):
+    return f'{os.path.splitext(name)[0]}_{size}.{fmt}'
+
+
+def variant_names(name):
+    """{size: {format: name}} of the variants of an original"""
+    formats = supported_formats()
+    return {
+        size: {fmt: variant_name(name, size, fmt) for fmt in formats}
+        for size in settings.IMAGE_VARIANTS['SIZES']
+    }
+
+
+def variant_urls(value, request=None):
+    """
+    The URLs of the rendered variants of an image field value, the way
+    file_url does, None before any is rendered
+    """
+    if not value:
+        return None
+    urls = {}
+    for size, names in variant_names(value.name).items():
+        for fmt, name in names.items():
+            if not value.storage.exists(name):
+                continue
+            url = value.storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls.setdefault(size, {})[fmt] = url
+    return urls or None
+
+
+def render(name, storage=None):
+    """Write every variant of an original, return how many were written"""
+    storage = storage or default_storage
+    sizes = settings.IMAGE_VARIANTS['SIZES']
+    quality = settings.IMAGE_VARIANTS['QUALITY']
+    names = variant_names(name)
+
+    with storage.open(name) as original:
+        image = Image.open(original)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    written = 0
+    for size, edge in sizes.items():
+        variant = image.copy()
+        variant.thumbnail((edge, edge), Image.LANCZOS)
+        for fmt, variant_path in names[size].items():
+            content = BytesIO()
+            variant.save(content, format=fmt.upper(), quality=quality)
+            # the name is fixed, replace a variant of a previous render
+            if storage.exists(variant_path):
+                storage.delete(variant_path)
+            storage.save(variant_path, ContentFile(content.getvalue()))
+            written += 1
+    return written
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(settings.IMAGE_VARIANTS['WORKERS'])
+    return _pool
+
+
+def _rendered(name, done):
+    """The callback of a render in the pool"""
+    def callback(future):
+        if future.exception() is not None:
+            logger.error(
+                'Rendering image variants of %s failed: %s',
+                name,
+                future.exception()
+            )
+        elif done is not None:
+            done()
+    return callback
+
+
+def submit(name, storage=None, done=None):
+    """
+    Render the variants of an original now or in a worker, then call done
+    unless the render failed
+    """
+    if settings.IMAGE_VARIANTS['WORKERS'] == 0:
+        try:
+            written = render(name, storage)
+        except Exception:
+            logger.exception('Rendering image variants of %s failed', name)
+            return 0
+        if done is not None:
+            done()
+        return written
+    get_pool().submit(render, name, storage).add_done_callback(
+        _rendered(name, done)
+    )
+
+
+def schedule(value, done=None):
+    """
+    Render the variants of an image field value once committed, in the
+    storage of the value
+    """
+    if value:
+        name, storage = value.name, value.storage
+        transaction.on_commit(lambda: submit(name, storage, done))
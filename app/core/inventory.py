@@ -0,0 +1,245 @@
+"""
+Hold product units for carts.
+
+A hold (StockReservation) takes units away from what other carts can hold
+until it expires, is released, or is settled by the checkout of its cart.
+Product.stock keeps counting held units until they are sold.
+
+Holds on most products are counted on the product row (Product.reserved),
+what can still be held is stock - reserved. A hot product can be split in
+StockBuckets: its free units are spread over the buckets and holds take
+units from a random bucket, so concurrent holds on the product mostly
+update different rows instead of queueing on the lock of one row. A
+product with buckets has no product level holds.
+
+Every change is a conditional UPDATE, units are never read then written.
+
+Locks are always taken in the same order so that concurrent holds,
+releases, checkouts and the expiry sweeper can not deadlock: the product
+rows first, in id order, then their holds, then their buckets.
+"""
+from collections import Counter
+import random
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from core.models import Product, StockBucket, StockReservation
+
+
+class OutOfStock(Exception):
+    """Not enough units of a product can be held"""
+
+    def __init__(self, product_id):
+        super().__init__(product_id)
+        self.product_id = product_id
+
+
+def bucketed(product_ids):
+    """Return the ids of the products which have stock buckets"""
+    return set(StockBucket.objects.filter(
+        product_id__in=product_ids
+    ).values_list('product_id', flat=True).distinct())
+
+
+def lock_products(product_ids, skip_locked=False):
+    """Lock the product rows in id order, return the ids locked"""
+    return list(Product.objects.select_for_update(
+        skip_locked=skip_locked
+    ).filter(
+        id__in=product_ids
+    ).order_by('id').values_list('id', flat=True))
+
+
+def take_from_buckets(product_id, quantity, prefer=()):
+    """
+    Take units from the buckets of a product, trying the buckets in prefer
+    first then the others in random order, and return the quantity taken
+    from each bucket. Raise OutOfStock, the caller's transaction must roll
+    back the partial takes.
+    """
+    buckets = list(StockBucket.objects.filter(
+        product_id=product_id,
+        available__gt=0
+    ).values_list('id', 'available'))
+    random.shuffle(buckets)
+    buckets.sort(key=lambda bucket: bucket[0] not in prefer)
+
+    taken = {}
+    left = quantity
+    for bucket_id, available in buckets:
+        take = min(left, available)
+        if StockBucket.objects.filter(
+            id=bucket_id,
+            available__gte=take
+        ).update(available=F('available') - take):
+            taken[bucket_id] = take
+            left -= take
+            if not left:
+                return taken
+    raise OutOfStock(product_id)
+
+
+def hold(cart, product, quantity, ttl=None):
+    """Hold units of a product for a cart, raise OutOfStock"""
+    expires_at = timezone.now() + timezone.timedelta(
+        seconds=ttl or settings.STOCK_HOLD_TTL
+    )
+    with transaction.atomic():
+        if not product.stock_buckets.exists():
+            if not Product.objects.filter(
+                id=product.id,
+                stock__gte=F('reserved') + quantity
+            ).update(reserved=F('reserved') + quantity):
+                raise OutOfStock(product.id)
+            return [StockReservation.objects.create(
+                cart=cart,
+                product=product,
+                quantity=quantity,
+                expires_at=expires_at
+            )]
+
+        # the insert of the holds takes this lock anyway, taking it before
+        # the buckets keeps the lock order of checkout; holds still share it
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT 1 FROM {Product._meta.db_table} '
+                'WHERE id = %s FOR KEY SHARE',
+                [product.id]
+            )
+        return StockReservation.objects.bulk_create([
+            StockReservation(
+                cart=cart,
+                product=product,
+                bucket_id=bucket_id,
+                quantity=taken,
+                expires_at=expires_at
+            ) for bucket_id, taken in
+            take_from_buckets(product.id, quantity).items()
+        ])
+
+
+def hold_cart(cart, ttl=None):
+    """Replace the holds of a cart by holds on every line of it"""
+    with transaction.atomic():
+        release(cart.reservations.all())
+        holds = []
+        for item in cart.cart_items.select_related('product'):
+            holds.extend(hold(cart, item.product, item.quantity, ttl))
+        return holds
+
+
+def release(reservations):
+    """
+    Give the units of the holds back and delete them. The products of the
+    holds are locked before the holds and rows are updated in id order, so
+    that concurrent releases can not deadlock. Return the released holds.
+    """
+    with transaction.atomic():
+        product_ids = lock_products(
+            reservations.values_list('product_id', flat=True)
+        )
+        holds = list(reservations.filter(
+            product_id__in=product_ids
+        ).select_for_update().only(
+            'id', 'product_id', 'bucket_id', 'quantity'
+        ))
+        products, buckets = Counter(), Counter()
+        for reservation in holds:
+            if reservation.bucket_id:
+                buckets[reservation.bucket_id] += reservation.quantity
+            else:
+                products[reservation.product_id] += reservation.quantity
+
+        for product_id in sorted(products):
+            Product.objects.filter(id=product_id).update(
+                reserved=F('reserved') - products[product_id]
+            )
+        for bucket_id in sorted(buckets):
+            StockBucket.objects.filter(id=bucket_id).update(
+                available=F('available') + buckets[bucket_id]
+            )
+        StockReservation.objects.filter(
+            id__in=[reservation.id for reservation in holds]
+        ).delete()
+    return holds
+
+
+def release_expired(batch_size=500, now=None):
+    """
+    Release the expired holds in batches of batch_size, each in its own
+    transaction, and yield the number of holds released per batch.
+    Holds on products locked by a checkout in progress are skipped.
+    """
+    now = now or timezone.now()
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            expired = list(StockReservation.objects.filter(
+                expires_at__lte=now,
+                id__gt=last_id
+            ).order_by('id').values_list('id', 'product_id')[:batch_size])
+            if not expired:
+                return
+            last_id = expired[-1][0]
+            product_ids = lock_products(
+                {product_id for _, product_id in expired},
+                skip_locked=True
+            )
+            released = len(release(StockReservation.objects.filter(
+                id__in=[hold_id for hold_id, _ in expired],
+                product_id__in=product_ids,
+                expires_at__lte=now
+            )))
+        yield released
+
+
+def shard(product, count):
+    """
+    Spread the free units of a product over count buckets, the holds on
+    the product are moved to the first bucket. Sharding a product again
+    spreads its stock anew.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product.pk)
+        gather(product)
+        product.refresh_from_db(fields=['stock', 'reserved'])
+        free = max(product.stock - product.reserved, 0)
+        buckets = StockBucket.objects.bulk_create([
+            StockBucket(
+                product=product,
+                index=index,
+                available=free // count + (index < free % count)
+            ) for index in range(count)
+        ])
+        StockReservation.objects.filter(product=product).update(
+            bucket=buckets[0]
+        )
+        Product.objects.filter(pk=product.pk).update(reserved=0)
+        return buckets
+
+
+def rebalance(product):
+    """Spread the stock of a sharded product again after it changed"""
+    with transaction.atomic():
+        lock_products([product.pk])
+        count = StockBucket.objects.filter(product=product).count()
+        if count:
+            shard(product, count)
+
+
+def gather(product):
+    """Merge the buckets of a product back into the product row"""
+    with transaction.atomic():
+        lock_products([product.pk])
+        held = StockReservation.objects.filter(
+            product=product,
+            bucket__isnull=False
+        ).aggregate(held=Sum('quantity'))['held'] or 0
+        StockReservation.objects.filter(product=product).update(bucket=None)
+        Product.objects.filter(pk=product.pk).update(
+            reserved=F('reserved') + held
+        )
+        StockBucket.objects.filter(product=product).delete()
@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Store
+
+
+class BenchmarkCommand(BaseCommand):
+    """
+    Base class for benchmark commands.
+
+    The benchmark runs inside a transaction that is rolled back at the end,
+    so the fixtures it creates never reach the database.
+    """
+    default_repeat = 100
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=self.default_repeat,
+            help='Number of iterations per measurement',
+        )
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        with transaction.atomic():
+            self.run(**options)
+            transaction.set_rollback(True)
+
+    def run(self, **options):
+        raise NotImplementedError
+
+    def sample_store(self, title='Benchmark Store'):
+        user = get_user_model().objects.create_user(
+            email=f'benchmark-{time.time_ns()}@cinolabs.com',
+            password='benchmark'
+        )
+        return Store.objects.create(user=user, title=title)
+
+    def timeit(self, func, repeat=None, setup=None):
+        """Return the average seconds per call of func"""
+        repeat = repeat or self.repeat
+        total = 0.0
+        for _ in range(repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            total += time.perf_counter() - start
+        return total / repeat
+
+    def report(self, label, seconds, extra=''):
+        self.stdout.write(f'{label:<40} {seconds * 1e6:>12.1f} us {extra}')
@@ -0,0 +1,112 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.test import RequestFactory, override_settings
+from django.views import static
+
+from core.management.benchmark import BenchmarkCommand
+from core.models import Product, ProductAttachment
+from store.views import ProductAttachmentViewSet
+
+
+class Command(BenchmarkCommand):
+    """
+    Download an attachment of --size MB through the static() media view and
+    through the download view, streamed or offloaded to the web server, as
+    a whole and as a --range-size MB range.
+
+    Worker time is how long the Django process is busy with one request,
+    reading the response as a WSGI server without sendfile would. With
+    X-Accel-Redirect the bytes are left to nginx.
+    """
+    help = 'Benchmark attachment downloads in MB/s and worker time'
+    default_repeat = 20
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=50,
+            help='Size of the attachment in MB',
+        )
+        parser.add_argument(
+            '--range-size',
+            type=int,
+            default=1,
+            help='Size of the requested range in MB',
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            super().handle(*args, **options)
+
+    def run(self, **options):
+        store = self.sample_store()
+        product = Product.objects.create(
+            title='Manual',
+            price=0,
+            stock=1,
+            published=True,
+            store=store,
+            user=store.user
+        )
+        size = options['size'] * 1024 * 1024
+        attachment = ProductAttachment.objects.create(
+            product=product,
+            title='User Manual',
+            file=ContentFile(os.urandom(size), name='manual.pdf')
+        )
+        start = size // 2
+        end = start + options['range_size'] * 1024 * 1024 - 1
+        byte_range = f'bytes={start}-{end}'
+
+        factory = RequestFactory()
+        download = ProductAttachmentViewSet.as_view({'get': 'download'})
+
+        def fetch_static(**headers):
+            return self.consume(static.serve(
+                factory.get('/', **headers),
+                attachment.file.name,
+                document_root=settings.MEDIA_ROOT
+            ))
+
+        def fetch_download(**headers):
+            return self.consume(download(
+                factory.get('/', **headers),
+                store=store.slug,
+                product_pk=product.id,
+                pk=attachment.id
+            ))
+
+        accel = override_settings(ATTACHMENT_DOWNLOADS={
+            'SENDFILE': 'x-accel-redirect',
+            'ACCEL_PREFIX': '/protected-media/',
+        })
+        cases = (
+            ('static() whole file', fetch_static, {}),
+            ('static() range', fetch_static, {'HTTP_RANGE': byte_range}),
+            ('download whole file', fetch_download, {}),
+            ('download range', fetch_download, {'HTTP_RANGE': byte_range}),
+            ('download X-Accel-Redirect', accel(fetch_download), {}),
+        )
+        for label, fetch, headers in cases:
+            sent = fetch(**headers)
+            seconds = self.timeit(lambda: fetch(**headers))
+            self.stdout.write(
+                f'{label:<28} {sent / 1024 / 1024:>8.1f} MB sent '
+                f'{sent / 1024 / 1024 / seconds:>10.1f} MB/s '
+                f'{seconds * 1000:>10.2f} ms worker time'
+            )
+
+    def consume(self, response):
+        """Read the response, return the number of bytes sent"""
+        if not response.streaming:
+            return len(response.content)
+        sent = sum(len(chunk) for chunk in response.streaming_content)
+        # response.close() would end the request and close the connection
+        response.file_to_stream.close()
+        return sent
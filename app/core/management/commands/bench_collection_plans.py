@@ -0,0 +1,40 @@
+from core import rules
+from core.management.benchmark import BenchmarkCommand
+from core.models import Collection, Condition
+
+
+class Command(BenchmarkCommand):
+    """Compare cold and warm compilation of collection plans"""
+    help = 'Benchmark compiled collection plans'
+    sizes = (1, 10, 50)
+
+    def run(self, **options):
+        store = self.sample_store()
+        for size in self.sizes:
+            collection = Collection.objects.create(
+                title=f'Collection {size}',
+                store=store,
+                user=store.user
+            )
+            fields = [key for key, _ in Condition.FIELD_REF_CHOICES]
+            Condition.objects.bulk_create([
+                Condition(
+                    collection=collection,
+                    field_reference=fields[i % len(fields)],
+                    filter_type=Condition.EQUAL,
+                    field_val=f'value {i}'
+                ) for i in range(size)
+            ])
+
+            cold = self.timeit(
+                lambda: rules.get_plan(collection),
+                setup=rules.clear_plans
+            )
+            warm = self.timeit(lambda: rules.get_plan(collection))
+            self.report(f'{size} conditions, cold', cold)
+            self.report(
+                f'{size} conditions, warm',
+                warm,
+                f'({cold / warm:.0f}x)'
+            )
+        self.stdout.write(f'Plan cache: {rules.plans.stats()}')
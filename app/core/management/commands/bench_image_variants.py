@@ -0,0 +1,78 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+import os
+import tempfile
+import time
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from PIL import Image
+
+from core import images
+from core.management.benchmark import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    """
+    Render the variants of --repeat originals of --size pixels with one
+    worker process then with --workers, in a temporary storage.
+    """
+    help = 'Benchmark image variant rendering in images per second per core'
+    default_repeat = 32
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes of the second measurement',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=2000,
+            help='Width of the originals, the height is 3/4 of it',
+        )
+
+    def handle(self, *args, **options):
+        # nothing is written to the database
+        self.repeat = options['repeat']
+        with tempfile.TemporaryDirectory() as location:
+            self.run(FileSystemStorage(location), **options)
+
+    def run(self, storage, **options):
+        size = options['size']
+        original = Image.merge('RGB', (
+            Image.linear_gradient('L').resize((size, size * 3 // 4)),
+            Image.effect_noise((size, size * 3 // 4), 64),
+            Image.radial_gradient('L').resize((size, size * 3 // 4)),
+        ))
+        content = BytesIO()
+        original.save(content, format='JPEG', quality=90)
+        names = [
+            storage.save(f'original_{index}.jpg', ContentFile(
+                content.getvalue()
+            ))
+            for index in range(self.repeat)
+        ]
+        self.stdout.write(
+            f'{self.repeat} originals of {size}x{size * 3 // 4}, formats '
+            f'{", ".join(images.supported_formats())}'
+        )
+
+        for workers in sorted({1, options['workers']}):
+            with ProcessPoolExecutor(workers) as pool:
+                # start the processes before measuring
+                list(pool.map(time.sleep, [0] * workers))
+                began = time.perf_counter()
+                list(pool.map(partial(images.render, storage=storage), names))
+                seconds = time.perf_counter() - began
+
+            rate = self.repeat / seconds
+            self.stdout.write(
+                f'{workers:>3} workers {rate:>10.1f} images/s '
+                f'{rate / workers:>10.1f} images/s per core'
+            )
@@ -0,0 +1,71 @@
+from django.db import models
+from django.db.models import Sum
+
+from core.management.benchmark import BenchmarkCommand
+from core.models import Order, OrderItem, Product
+
+
+class Command(BenchmarkCommand):
+    """
+    Compare building an order line by line with a full re-aggregation of
+    the amount after every line (the previous OrderItem.save), line by line
+    with the incremental amount, and with Order.add_items
+    """
+    help = 'Benchmark the construction of orders of 1 to 1000 lines'
+    default_repeat = 3
+    sizes = (1, 10, 100, 1000)
+
+    def run(self, **options):
+        store = self.sample_store()
+        Product.objects.bulk_create([
+            Product(
+                title=f'Product {i}',
+                slug=f'product-{i}',
+                price=i % 50 + 0.99,
+                stock=10,
+                store=store,
+                user=store.user
+            ) for i in range(max(self.sizes))
+        ])
+        products = list(Product.objects.filter(store=store).order_by('id'))
+
+        for size in self.sizes:
+            def lines():
+                return [
+                    OrderItem(product=product, quantity=2, price=product.price)
+                    for product in products[:size]
+                ]
+
+            def reaggregate():
+                order = Order.objects.create(store=store, user=store.user)
+                for item in lines():
+                    item.order = order
+                    item.compute_total()
+                    models.Model.save(item)
+                    order_items = order.order_items.all()
+                    order.amount = order_items.aggregate(
+                        Sum('total_price')
+                    )['total_price__sum'] if order_items.exists() else 0
+                    order.final_amount = order.amount
+                    models.Model.save(order)
+
+            def incremental():
+                order = Order.objects.create(store=store, user=store.user)
+                for item in lines():
+                    item.order = order
+                    item.save()
+
+            def bulk():
+                order = Order.objects.create(store=store, user=store.user)
+                order.add_items(lines())
+
+            before = self.timeit(reaggregate)
+            self.report(f'{size} lines, re-aggregate per line', before)
+            for label, func in (('delta per line', incremental),
+                                ('add_items', bulk)):
+                seconds = self.timeit(func)
+                self.report(
+                    f'{size} lines, {label}',
+                    seconds,
+                    f'({before / seconds:.1f}x)'
+                )
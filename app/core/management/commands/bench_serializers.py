@@ -0,0 +1,91 @@
+from commerce import serializers as commerce_serializers
+from core.management.benchmark import BenchmarkCommand
+from core.models import Cart, CartItem, Product, ProductType
+from store import serializers as store_serializers
+
+
+class Command(BenchmarkCommand):
+    """Compare the ModelSerializers with the fast serializers"""
+    help = 'Benchmark product and cart serializers in items/second'
+    default_repeat = 20
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=500,
+            help='Number of products to serialize',
+        )
+
+    def run(self, **options):
+        store = self.sample_store()
+        product_type = ProductType.objects.create(
+            name='Benchmark',
+            store=store,
+            user=store.user
+        )
+        Product.objects.bulk_create([
+            Product(
+                title=f'Product {i}',
+                slug=f'product-{i}',
+                body='Lorem ipsum dolor sit amet',
+                price=i % 50 + 0.99,
+                stock=i % 7,
+                store=store,
+                user=store.user,
+                type=product_type
+            ) for i in range(options['products'])
+        ])
+        for i, product in enumerate(Product.objects.filter(store=store)):
+            product.tags.add(f'tag {i % 10}', 'benchmark')
+        products = list(
+            store_serializers.ProductSerializer.setup_eager_loading(
+                Product.objects.filter(store=store)
+            )
+        )
+
+        cart = Cart.objects.create(store=store, user=store.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, price=product.price)
+            for product in products
+        ])
+        cart = commerce_serializers.CartSerializer.setup_eager_loading(
+            Cart.objects.filter(id=cart.id)
+        ).get()
+
+        self.compare(
+            'ProductSerializer',
+            lambda: store_serializers.ProductSerializer(
+                products, many=True
+            ).data,
+            lambda: store_serializers.FastProductSerializer(
+                products, many=True
+            ).data,
+            len(products)
+        )
+        self.compare(
+            'SimpleProductSerializer',
+            lambda: store_serializers.SimpleProductSerializer(
+                products, many=True
+            ).data,
+            lambda: store_serializers.FastSimpleProductSerializer(
+                products, many=True
+            ).data,
+            len(products)
+        )
+        self.compare(
+            'CartSerializer',
+            lambda: commerce_serializers.CartSerializer(cart).data,
+            lambda: commerce_serializers.FastCartSerializer(cart).data,
+            len(products)
+        )
+
+    def compare(self, label, slow, fast, items):
+        slow_seconds = self.timeit(slow)
+        fast_seconds = self.timeit(fast)
+        self.stdout.write(
+            f'{label:<26} {items / slow_seconds:>10.0f} items/s  '
+            f'fast {items / fast_seconds:>10.0f} items/s  '
+            f'({slow_seconds / fast_seconds:.1f}x)'
+        )
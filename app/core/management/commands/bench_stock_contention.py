@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from django.db import connection, transaction
+
+from core import inventory
+from core.management.benchmark import BenchmarkCommand
+from core.models import Cart, Product
+
+
+class Command(BenchmarkCommand):
+    """
+    Parallel workers hold units of one product, each hold in a transaction
+    lasting --work-ms, first on the product row then spread over buckets.
+
+    The workers use their own connections, so unlike the other benchmarks
+    the fixtures are committed, then deleted at the end. Each layout is
+    measured --repeat times, the holds of a round released before the next.
+    """
+    help = 'Benchmark concurrent stock holds on a single product'
+    default_repeat = 3
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Number of parallel workers',
+        )
+        parser.add_argument(
+            '--holds',
+            type=int,
+            default=50,
+            help='Number of holds per worker',
+        )
+        parser.add_argument(
+            '--buckets',
+            type=int,
+            default=16,
+            help='Number of stock buckets of the sharded product',
+        )
+        parser.add_argument(
+            '--work-ms',
+            type=float,
+            default=2.0,
+            help='Time spent in each hold transaction after the hold',
+        )
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        self.store = self.sample_store()
+        try:
+            self.run(**options)
+        finally:
+            self.store.user.delete()
+
+    def run(self, **options):
+        store = self.store
+        workers = options['workers']
+        holds = options['holds']
+        work = options['work_ms'] / 1000
+        product = Product.objects.create(
+            title='Flash sale',
+            price=9.99,
+            stock=workers * holds,
+            store=store,
+            user=store.user
+        )
+        carts = [
+            Cart.objects.create(store=store) for _ in range(workers)
+        ]
+
+        def worker(cart, start):
+            start.wait()
+            try:
+                for _ in range(holds):
+                    with transaction.atomic():
+                        inventory.hold(cart, product, 1)
+                        time.sleep(work)
+            finally:
+                connection.close()
+
+        def hold_all():
+            start = threading.Barrier(workers)
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(worker, carts, [start] * workers))
+
+        for label, buckets in (('product row', 0),
+                               (f'{options["buckets"]} buckets',
+                                options['buckets'])):
+            def reset():
+                for cart in carts:
+                    inventory.release(cart.reservations.all())
+                if buckets:
+                    inventory.shard(product, buckets)
+
+            seconds = self.timeit(hold_all, setup=reset)
+            self.stdout.write(
+                f'{label:<16} {workers} workers '
+                f'{workers * holds / seconds:>10.0f} holds/s'
+            )
@@ -1,11 +1,19 @@
+import time
+
 from django.utils import timezone
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from core.models import Cart
+from core.models import Cart, Store
 
 
 class Command(BaseCommand):
-    """Django command to inactivate or delete cart items"""
+    """
+    Django command to inactivate or delete cart items.
+
+    Carts are processed in batches ordered by id, each batch in its own
+    statement, so that locks are short and the work can pause between
+    batches or stop when its time budget is spent.
+    """
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -13,17 +21,102 @@ class Command(BaseCommand):
             action='store_true',
             help='Delete carts that are no longer active',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of carts per batch',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches',
+        )
+        parser.add_argument(
+            '--store',
+            help='Only clean the carts of the store with this slug',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the carts that would be cleaned',
+        )
+        parser.add_argument(
+            '--max-runtime',
+            type=float,
+            help='Stop after the batch running past this many seconds',
+        )
 
     def handle(self, *args, **options):
         if options['delete']:
-            carts = Cart.objects.filter(
-                is_active=False
-            ).delete()
-            self.stdout.write(self.style.SUCCESS(f'Deleting {carts[0]} items'))
+            carts = Cart.objects.filter(is_active=False)
+            verb = 'Deleting'
         else:
             carts = Cart.objects.filter(
+                is_active=True,
                 invalid_at__lte=timezone.now()
-            ).update(is_active=False)
-            self.stdout.write(self.style.SUCCESS(f'Updating {carts} items'))
+            )
+            verb = 'Updating'
+
+        if options['store']:
+            store = Store.objects.filter(slug=options['store']).first()
+            if store is None:
+                raise CommandError(f'Unknown store {options["store"]}')
+            carts = carts.filter(store=store)
 
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'{verb} {carts.count()} items (dry run)'
+            ))
+            return
+
+        total = self.process(carts, options)
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} items'))
         self.stdout.write(self.style.SUCCESS('Cart cleanup complete'))
+
+    def process(self, carts, options):
+        start = time.monotonic()
+        total = 0
+        last_id = None
+        batch = 0
+        while True:
+            page = carts.order_by('id')
+            if last_id is not None:
+                page = page.filter(id__gt=last_id)
+            ids = list(
+                page.values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+
+            batch += 1
+            began = time.monotonic()
+            if options['delete']:
+                count = Cart.objects.filter(id__in=ids).delete()[1].get(
+                    Cart._meta.label, 0
+                )
+            else:
+                count = Cart.objects.filter(
+                    id__in=ids,
+                    is_active=True
+                ).update(is_active=False, updated_at=timezone.now())
+            total += count
+            last_id = ids[-1]
+            self.stdout.write(
+                f'Batch {batch}: {count} carts in '
+                f'{(time.monotonic() - began) * 1000:.1f}ms'
+            )
+
+            if len(ids) < options['batch_size']:
+                break
+            if options['max_runtime'] is not None and \
+                    time.monotonic() - start >= options['max_runtime']:
+                self.stdout.write(self.style.WARNING(
+                    f'Stopping after {batch} batches, '
+                    f'max runtime of {options["max_runtime"]}s reached'
+                ))
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        return total
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import blobs
+
+
+class Command(BaseCommand):
+    """Django command to delete the blobs no product file refers to"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of blobs deleted per transaction',
+        )
+        parser.add_argument(
+            '--grace',
+            type=int,
+            help='Seconds a blob stays unreferenced before it is deleted, '
+                 'settings.MEDIA_BLOBS["GC_GRACE"] by default',
+        )
+        parser.add_argument(
+            '--orphans',
+            action='store_true',
+            help='Also delete the stored files no blob row knows of',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        start = time.perf_counter()
+        for deleted in blobs.collect(options['grace'], options['batch_size']):
+            total += deleted
+            self.stdout.write(f'Deleted {deleted} blobs')
+
+        if options['orphans']:
+            orphans = blobs.collect_orphans(options['grace'])
+            self.stdout.write(f'Deleted {orphans} orphan files')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {total} unreferenced blobs in '
+            f'{time.perf_counter() - start:.2f}s'
+        ))
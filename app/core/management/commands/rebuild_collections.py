@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import membership
+from core.models import Store
+
+
+class Command(BaseCommand):
+    """Django command to rebuild the materialized collection membership"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store',
+            help='Slug of the store to rebuild, all stores by default',
+        )
+
+    def handle(self, *args, **options):
+        stores = Store.objects.all()
+        if options['store']:
+            stores = stores.filter(slug=options['store'])
+            if not stores:
+                raise CommandError(f'Store "{options["store"]}" not found')
+
+        for store in stores:
+            start = time.perf_counter()
+            count = membership.rebuild_store(store)
+            self.stdout.write(
+                f'{store.slug}: rebuilt {count} collections '
+                f'in {time.perf_counter() - start:.2f}s'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Collection rebuild complete'))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import inventory
+
+
+class Command(BaseCommand):
+    """Django command to give back the stock of expired cart holds"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of holds released per transaction',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        start = time.perf_counter()
+        for released in inventory.release_expired(options['batch_size']):
+            total += released
+            self.stdout.write(f'Released {released} holds')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {total} expired holds in '
+            f'{time.perf_counter() - start:.2f}s'
+        ))
@@ -0,0 +1,106 @@
+"""
+Maintain the materialized CollectionMembership table.
+
+Membership records which products match the conditions of a collection.
+Whether a product is published or available yet is not part of it, those
+filters are applied when the products of a collection are listed.
+"""
+import threading
+
+from django.db import transaction
+
+from core import rules
+from core.models import Collection, CollectionMembership, Condition, Product
+
+
+_local = threading.local()
+
+
+def _deleting():
+    if not hasattr(_local, 'collections'):
+        _local.collections = set()
+    return _local.collections
+
+
+def begin_delete(collection):
+    """Skip maintenance of a collection while it is being deleted"""
+    _deleting().add(collection.id)
+
+
+def end_delete(collection):
+    _deleting().discard(collection.id)
+
+
+def matching_products(collection):
+    """Return the ids of the products matching the collection conditions"""
+    plan = rules.get_plan(collection)
+    return Product.objects.filter(
+        store_id=collection.store_id
+    ).filter(
+        plan.query
+    ).values_list('id', flat=True)
+
+
+def rebuild_collection(collection, batch_size=1000):
+    """Re-evaluate every product of the store against one collection"""
+    if collection.id in _deleting():
+        return
+
+    with transaction.atomic():
+        CollectionMembership.objects.filter(collection=collection).delete()
+        CollectionMembership.objects.bulk_create([
+            CollectionMembership(collection=collection, product_id=product_id)
+            for product_id in matching_products(collection).iterator()
+        ], batch_size=batch_size)
+
+
+def rebuild_store(store):
+    """Rebuild the membership of every collection of a store"""
+    collections = Collection.objects.filter(store=store)
+    for collection in collections:
+        rebuild_collection(collection)
+    return len(collections)
+
+
+def rebuild_field_collections(store_id, field_reference):
+    """Rebuild the collections of a store having a condition on a field"""
+    collections = Collection.objects.filter(
+        store_id=store_id,
+        id__in=Condition.objects.filter(
+            field_reference=field_reference
+        ).values('collection_id')
+    )
+    for collection in collections:
+        rebuild_collection(collection)
+
+
+def refresh_product(product):
+    """
+    Re-evaluate one product against every collection of its store.
+    The conditions are tested in memory, so this takes the same number of
+    queries however many collections the store has.
+    """
+    product = Product.objects.select_related('type').prefetch_related(
+        'tags'
+    ).get(pk=product.pk)
+    collections = [
+        collection for collection in
+        Collection.objects.filter(store_id=product.store_id)
+        if collection.id not in _deleting()
+    ]
+    matched = rules.matching_collections(product, collections)
+
+    with transaction.atomic():
+        CollectionMembership.objects.filter(
+            product=product
+        ).exclude(
+            collection__in=matched
+        ).delete()
+        CollectionMembership.objects.bulk_create([
+            CollectionMembership(collection=collection, product=product)
+            for collection in matched
+        ], ignore_conflicts=True)
+
+
+def refresh_product_type(product_type):
+    rebuild_field_collections(product_type.store_id, Condition.PRODUCT_TYPE)
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-17 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_auto_20210329_1932'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='conditions_revision',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
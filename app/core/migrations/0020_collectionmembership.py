@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-17 19:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_collection_conditions_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.collection')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.product')),
+            ],
+            options={
+                'unique_together': {('collection', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-17 19:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_collectionmembership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-17 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['is_active', 'invalid_at'], name='core_cart_is_acti_b9de55_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-17 20:36
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_cart_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='invalid_at',
+            field=models.DateTimeField(default=core.models.cart_expiry, verbose_name='Invalid'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(is_active=True), fields=['invalid_at'], name='core_cart_active_expiry_idx'),
+        ),
+    ]
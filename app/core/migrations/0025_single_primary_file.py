@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-17 20:47
+
+from django.db import migrations, models
+
+
+# keep the first primary of each product before the constraint is added
+KEEP_FIRST_PRIMARY = (
+    'UPDATE {table} SET is_primary = false WHERE is_primary '
+    'AND id NOT IN (SELECT MIN(id) FROM {table} WHERE is_primary '
+    'GROUP BY product_id)'
+)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_cart_sliding_expiry'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            KEEP_FIRST_PRIMARY.format(table='core_productattachment'),
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            KEEP_FIRST_PRIMARY.format(table='core_productimage'),
+            migrations.RunSQL.noop
+        ),
+        migrations.AddConstraint(
+            model_name='productattachment',
+            constraint=models.UniqueConstraint(condition=models.Q(is_primary=True), fields=('product',), name='core_productattachment_one_primary'),
+        ),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(condition=models.Q(is_primary=True), fields=('product',), name='core_productimage_one_primary'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-17 20:58
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_single_primary_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('refcount', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='productattachment',
+            name='file',
+            field=models.FileField(storage=core.storage.blob_storage, upload_to=core.models.upload_path_handler, verbose_name='File'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=core.storage.blob_storage, upload_to=core.models.upload_path_handler, verbose_name='Image'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.14 on 2026-10-17 21:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_media_blobs'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cart',
+            name='core_cart_is_acti_b9de55_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(is_active=False), fields=['id'], name='core_cart_inactive_idx'),
+        ),
+    ]
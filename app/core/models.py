@@ -1,25 +1,27 @@
 import uuid
 import operator
 
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
                                         PermissionsMixin
 from django.conf import settings
 from django.utils.translation import gettext as _
 from django.utils.text import slugify
-from django.db.models import Q, Sum
+from django.db.models import Exists, F, Q, Subquery
 from django.utils import timezone
 from django.core.validators import MaxValueValidator, MinValueValidator
 
 from phonenumber_field.modelfields import PhoneNumberField
 from taggit.managers import TaggableManager
-from functools import reduce
 from decimal import Decimal, ROUND_HALF_UP
 
+from core import rules
+from core.storage import blob_storage
 
-def return_date_time(days=10):
-    now = timezone.now()
-    return now + timezone.timedelta(days=days)
+
+def cart_expiry():
+    """When a cart touched now stops being valid"""
+    return timezone.now() + timezone.timedelta(seconds=settings.CART_LIFETIME)
 
 
 def store_image_file_path(instance, filename):
@@ -152,6 +154,8 @@ class Product(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
     purchased = models.PositiveIntegerField(default=0)
     stock = models.PositiveIntegerField()
+    # units of the stock held for carts, maintained by core.inventory
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     length = models.FloatField(_("Length"), default=.5)
     fulfillment = models.CharField(
         _('Fulfillment Service'),
@@ -191,6 +195,14 @@ class Product(models.Model):
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.title)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # never overwrite holds taken since the product was loaded
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'reserved'
+                and field.attname not in deferred
+            ]
         super(Product, self).save(*args, **kwargs)
 
     def get_images(self):
@@ -212,14 +224,90 @@ class Product(models.Model):
         return reviews
 
 
-class ProductImage(models.Model):
+class PrimaryFileMixin:
+    """
+    One image and one attachment of a product is primary, the partial
+    unique index on (product) WHERE is_primary makes sure there is never
+    two. A primary is saved under the lock of its product, so that primaries
+    of the same product saved at once take the flag in turn instead of
+    failing on the index.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            if self.is_primary:
+                self.lock_product(self.product_id)
+            super().save(*args, **kwargs)
+
+    @staticmethod
+    def lock_product(product_id):
+        list(Product.objects.select_for_update().filter(
+            pk=product_id
+        ).values_list('pk', flat=True))
+
+    @classmethod
+    def unset_primary(cls, product_id, keep=None):
+        """Take the flag from the primary of the product but keep"""
+        cls.objects.filter(
+            product_id=product_id,
+            is_primary=True
+        ).exclude(
+            id=keep
+        ).update(
+            is_primary=False
+        )
+
+    def claim_primary(self):
+        """Without a primary for its product, this instance becomes it"""
+        primary = type(self).objects.filter(
+            product_id=self.product_id,
+            is_primary=True
+        )
+        try:
+            # another save claiming the flag at the same time wins
+            with transaction.atomic():
+                self.is_primary = bool(type(self).objects.filter(
+                    ~Exists(primary),
+                    id=self.id
+                ).update(is_primary=True))
+        except IntegrityError:
+            pass
+
+    @classmethod
+    def promote_primary(cls, product_id):
+        """The first instance of the product replaces a deleted primary"""
+        remaining = cls.objects.filter(product_id=product_id)
+        try:
+            with transaction.atomic():
+                cls.objects.filter(
+                    ~Exists(remaining.filter(is_primary=True)),
+                    id=Subquery(remaining.order_by('id').values('id')[:1])
+                ).update(is_primary=True)
+        except IntegrityError:
+            pass
+
+
+class ProductImage(PrimaryFileMixin, models.Model):
     title = models.CharField(_("Title"), max_length=32, blank=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    image = models.ImageField(_("Image"), upload_to=upload_path_handler)
+    image = models.ImageField(
+        _("Image"),
+        upload_to=upload_path_handler,
+        storage=blob_storage
+    )
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product'],
+                condition=Q(is_primary=True),
+                name='core_productimage_one_primary'
+            ),
+        ]
+
     def __str__(self):
         return '{}_{}({})'.format(
             self.product.title,
@@ -228,18 +316,44 @@ class ProductImage(models.Model):
         )
 
 
-class ProductAttachment(models.Model):
+class ProductAttachment(PrimaryFileMixin, models.Model):
     title = models.CharField(_("Title"), max_length=32, blank=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    file = models.FileField(_("File"), upload_to=upload_path_handler)
+    file = models.FileField(
+        _("File"),
+        upload_to=upload_path_handler,
+        storage=blob_storage
+    )
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product'],
+                condition=Q(is_primary=True),
+                name='core_productattachment_one_primary'
+            ),
+        ]
+
     def __str__(self):
         return '{}: {}'.format(self.product.title, self.title)
 
 
+class MediaBlob(models.Model):
+    """
+    A file of the blob storage and how many product images and
+    attachments use it, maintained by core.blobs
+    """
+    name = models.CharField(max_length=100, unique=True)
+    refcount = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+
 class ProductReview(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     user = models.ForeignKey(
@@ -282,6 +396,10 @@ class Collection(models.Model):
         choices=CONDITION_MATCH_CHOICES,
         default=ALL
     )
+    conditions_revision = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
     store = models.ForeignKey(
         Store,
         on_delete=models.CASCADE
@@ -290,6 +408,8 @@ class Collection(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def operator_type(self):
         if self.type == self.ANY:
@@ -301,47 +421,11 @@ class Collection(models.Model):
         super(Collection, self).save(*args, **kwargs)
 
     def get_products(self):
-        conditions = Condition.objects.prefetch_related('collection').filter(
-            collection__id=self.id
-        ).order_by('field_reference')
-
-        products = Product.objects.all().filter(
-            store__slug=self.store.slug,
+        products = Product.objects.filter(
+            memberships__collection_id=self.id,
             published=True,
             date_available__lte=timezone.now()
         )
-        prev = None
-        nquery = []
-        nquery2 = []
-        for c in conditions:
-            choice = next(
-                item for item in Condition._CHOICES
-                if item["key"] == c.field_reference
-            )
-            if choice:
-                dynamic_filter = {
-                    f"{choice['field']}"
-                    f"{choice['choices'][c.filter_type]['match']}": c.field_val
-                }
-                if prev and prev != c.field_reference:
-                    nquery2.append(
-                        (reduce(operator.or_, nquery))
-                    )
-                    nquery = []
-                if choice['choices'][c.filter_type]['negation']:
-                    q = ~Q(**dynamic_filter)
-                else:
-                    q = Q(**dynamic_filter)
-                nquery.append(q)
-            prev = c.field_reference
-
-        nquery2.append(
-            (reduce(operator.or_, nquery))
-        )
-
-        query = (reduce(self.operator_type(), nquery2))
-        products = products.filter(query)
-        products = products.distinct()
 
         return products
 
@@ -424,6 +508,7 @@ class Condition(models.Model):
             'field': PRODUCT_PRICE.lower(),
         },
     ]
+    _CHOICES_BY_KEY = {item['key']: item for item in _CHOICES}
     FIELD_REF_CHOICES = tuple([
         (v['key'], v['label']) for i, v in enumerate(_CHOICES)
     ])
@@ -446,6 +531,17 @@ class Condition(models.Model):
         on_delete=models.CASCADE
     )
 
+    def as_rule(self):
+        """Return the lookup this condition applies to products"""
+        choice = self._CHOICES_BY_KEY[self.field_reference]
+        match = choice['choices'][self.filter_type]
+        return rules.Rule(
+            choice['field'],
+            match['match'],
+            match['negation'],
+            self.field_val
+        )
+
     def __str__(self):
         return '{} {} {}'.format(
             dict(self.FIELD_REF_CHOICES)[self.field_reference],
@@ -454,6 +550,26 @@ class Condition(models.Model):
         )
 
 
+class CollectionMembership(models.Model):
+    """Products matching the conditions of a collection"""
+    collection = models.ForeignKey(
+        Collection,
+        on_delete=models.CASCADE,
+        related_name='memberships'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='memberships'
+    )
+
+    class Meta:
+        unique_together = ('collection', 'product')
+
+    def __str__(self):
+        return f'{self.collection_id}: {self.product_id}'
+
+
 class Shipping(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -582,17 +698,87 @@ class Order(models.Model):
         return f'{self.store}_{self.user.name}: {self.amount}/{self.currency}'
 
     def save(self, *args, **kwargs):
-        cents = Decimal('0.01')
-        order_items = self.order_items.all()
-        self.amount = order_items.aggregate(
-            Sum('total_price')
-        )['total_price__sum'] if order_items.exists() else 0.00
-        self.final_amount = Decimal(self.amount)-Decimal(self.discount_amount)
-        self.final_amount = Decimal(self.final_amount).quantize(
-            cents,
-            ROUND_HALF_UP
+        """
+        The amount is maintained by the order items as they are saved, a new
+        order has none so its amount starts at 0. Saving an order never
+        writes the amounts over the changes made since it was loaded, a
+        new discount takes the final amount from the amount in the database.
+        """
+        if self._state.adding:
+            self.amount = Decimal('0.00')
+            self.final_amount = (-Decimal(self.discount_amount)).quantize(
+                Decimal('0.01'),
+                ROUND_HALF_UP
+            )
+            super(Order, self).save(*args, **kwargs)
+            return
+
+        amounts = ('amount', 'final_amount')
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+            ]
+        kwargs['update_fields'] = [
+            name for name in update_fields if name not in amounts
+        ]
+        with transaction.atomic(savepoint=False):
+            super(Order, self).save(*args, **kwargs)
+            if 'discount_amount' in kwargs['update_fields']:
+                self.recompute_final_amount()
+
+    def recompute_final_amount(self):
+        """The amount less the discount, computed in the database"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Order._meta.db_table} '
+                'SET final_amount = amount - discount_amount '
+                'WHERE id = %s RETURNING amount, final_amount',
+                [self.pk]
+            )
+            self.amount, self.final_amount = cursor.fetchone()
+
+    def move_amount(self, delta):
+        """Add delta to the amount in the database and on this instance"""
+        Order.objects.filter(pk=self.pk).update(
+            amount=F('amount') + delta,
+            final_amount=F('final_amount') + delta,
+            updated_at=timezone.now()
         )
-        super(Order, self).save(*args, **kwargs)
+        self.amount = Decimal(self.amount) + delta
+        self.final_amount = Decimal(self.final_amount) + delta
+
+    def recompute_amount(self):
+        """Sum the total of every item in one statement"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Order._meta.db_table} SET amount = totals.amount, '
+                'final_amount = totals.amount - discount_amount, '
+                'updated_at = %s FROM ('
+                'SELECT COALESCE(SUM(total_price), 0) AS amount '
+                f'FROM {OrderItem._meta.db_table} WHERE order_id = %s'
+                ') AS totals WHERE id = %s RETURNING totals.amount, '
+                'final_amount',
+                [timezone.now(), self.pk, self.pk]
+            )
+            self.amount, self.final_amount = cursor.fetchone()
+
+    def add_items(self, items, batch_size=None):
+        """
+        Insert many unsaved OrderItems of this order at once and recompute
+        the amount a single time.
+        """
+        for item in items:
+            item.order = self
+            item.compute_total()
+        with transaction.atomic():
+            items = OrderItem.objects.bulk_create(items, batch_size)
+            self.recompute_amount()
+        for item in items:
+            item.saved_total = item.total_price
+        return items
 
 
 class OrderStatusHistory(models.Model):
@@ -647,7 +833,13 @@ class OrderItem(models.Model):
     def __str__(self):
         return f'{self.order.id}: {self.total_price}'
 
-    def save(self,  *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_total = instance.__dict__.get('total_price')
+        return instance
+
+    def compute_total(self):
         cents = Decimal('0.01')
         self.final_price = \
             self.discount_price if self.discount_price > 0 else self.price
@@ -656,8 +848,37 @@ class OrderItem(models.Model):
             cents,
             ROUND_HALF_UP
         )
-        super(OrderItem, self).save(*args, **kwargs)
-        self.order.save()
+
+    def save(self,  *args, **kwargs):
+        """Move the order amount by the change of the item total"""
+        self.compute_total()
+        adding = self._state.adding
+        previous = getattr(self, 'saved_total', None)
+        with transaction.atomic(savepoint=False):
+            super(OrderItem, self).save(*args, **kwargs)
+            if adding:
+                self.order.move_amount(self.total_price)
+            elif previous is None:
+                self.order.recompute_amount()
+            elif self.total_price != previous:
+                self.order.move_amount(self.total_price - previous)
+        self.saved_total = self.total_price
+
+    def delete(self, *args, **kwargs):
+        previous = getattr(self, 'saved_total', None)
+        with transaction.atomic(savepoint=False):
+            deleted = super(OrderItem, self).delete(*args, **kwargs)
+            if previous is None:
+                self.order.recompute_amount()
+            else:
+                self.order.move_amount(-previous)
+        return deleted
+
+
+class CartManager(models.Manager):
+
+    def valid(self):
+        return self.filter(is_active=True, invalid_at__gt=timezone.now())
 
 
 class Cart(models.Model):
@@ -686,37 +907,231 @@ class Cart(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    invalid_at = models.DateTimeField(_("Invalid"), default=return_date_time())
+    # slides forward on activity, see touch()
+    invalid_at = models.DateTimeField(_("Invalid"), default=cart_expiry)
+
+    objects = CartManager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['invalid_at'],
+                name='core_cart_active_expiry_idx',
+                condition=Q(is_active=True)
+            ),
+            # batches of clean_carts --delete, ordered by id
+            models.Index(
+                fields=['id'],
+                name='core_cart_inactive_idx',
+                condition=Q(is_active=False)
+            ),
+        ]
 
     def __str__(self):
         return f'{self.id}: {self.amount}/{self.currency}'
 
     def save(self, *args, **kwargs):
-        cents = Decimal('0.01')
-        cart_items = self.cart_items.all()
-        self.amount = cart_items.aggregate(
-            Sum('total_price')
-        )['total_price__sum'] if cart_items.exists() else 0.00
-        self.amount = Decimal(self.amount).quantize(
-            cents,
-            ROUND_HALF_UP
-        )
+        """
+        The amount is maintained by the cart items, saving a cart never
+        writes it over the changes made since the cart was loaded
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'amount'
+                and field.attname not in deferred
+            ]
         super(Cart, self).save(*args, **kwargs)
 
-    def add(self, product, quantity=1, note=""):
-        """Add or increment product to cart"""
-        item, created = self.cart_items.get_or_create(
-            product=product,
-            defaults={'quantity': quantity, 'note': note}
+    @property
+    def is_valid(self):
+        return self.is_active and self.invalid_at > timezone.now()
+
+    def touch(self):
+        """
+        Slide the expiry forward on activity, the row is written at most
+        once per CART_EXPIRY_REFRESH seconds so reads stay cheap
+        """
+        expiry = cart_expiry()
+        refresh = timezone.timedelta(seconds=settings.CART_EXPIRY_REFRESH)
+        if not self.is_valid or self.invalid_at > expiry - refresh:
+            return False
+        Cart.objects.filter(pk=self.pk, is_active=True).update(
+            invalid_at=expiry
         )
-        if not created:
-            item.quantity += quantity
-            item.save()
+        self.invalid_at = expiry
+        return True
+
+    def recompute_amount(self):
+        """Sum the total of every item in one statement"""
+        expiry = cart_expiry()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Cart._meta.db_table} SET amount = COALESCE(('
+                f'SELECT SUM(total_price) FROM {CartItem._meta.db_table} '
+                'WHERE cart_id = %s), 0), updated_at = %s, invalid_at = %s '
+                'WHERE id = %s RETURNING amount',
+                [self.id, timezone.now(), expiry, self.id]
+            )
+            self.amount = cursor.fetchone()[0]
+        self.invalid_at = expiry
+
+    def _move_amount(self, cursor, delta):
+        """Add delta to the stored amount, slide the expiry and reload"""
+        expiry = cart_expiry()
+        cursor.execute(
+            f'UPDATE {Cart._meta.db_table} '
+            'SET amount = amount + %s, updated_at = %s, invalid_at = %s '
+            'WHERE id = %s RETURNING amount',
+            [delta, timezone.now(), expiry, self.id]
+        )
+        self.amount = cursor.fetchone()[0]
+        self.invalid_at = expiry
+
+    def add(self, product, quantity=1, note=""):
+        """
+        Add or increment product to cart.
+        The line is upserted in one statement and the amount is moved by the
+        added total, so concurrent adds to a cart do not lose updates. An
+        existing line keeps the price it was added at.
+        """
+        quantity = int(quantity)
+        price = Decimal(product.price).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {CartItem._meta.db_table} AS item '
+                '(cart_id, product_id, note, quantity, price, '
+                'discount_price, final_price, total_price) '
+                'VALUES (%s, %s, %s, %s, %s, 0, %s, %s) '
+                'ON CONFLICT (cart_id, product_id) DO UPDATE SET '
+                'quantity = item.quantity + EXCLUDED.quantity, '
+                'total_price = (item.quantity + EXCLUDED.quantity) '
+                '* item.final_price '
+                'RETURNING final_price',
+                [self.id, product.id, note, quantity, price, price,
+                 quantity * price]
+            )
+            final_price = cursor.fetchone()[0]
+            self._move_amount(cursor, quantity * final_price)
+
+    def merge(self, other):
+        """
+        Fold the lines and holds of other into this cart then delete it.
+        The lines are upserted in one statement, a product in both carts
+        adds up the quantities at the price of this cart, and the amount
+        is recomputed once.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {CartItem._meta.db_table} AS item '
+                '(cart_id, product_id, note, quantity, price, '
+                'discount_price, final_price, total_price) '
+                'SELECT %s, product_id, note, quantity, price, '
+                'discount_price, final_price, total_price '
+                f'FROM {CartItem._meta.db_table} WHERE cart_id = %s '
+                'ON CONFLICT (cart_id, product_id) DO UPDATE SET '
+                'quantity = item.quantity + EXCLUDED.quantity, '
+                'total_price = (item.quantity + EXCLUDED.quantity) '
+                '* item.final_price',
+                [self.id, other.id]
+            )
+            other.reservations.update(cart=self)
+            other.delete()
+            self.recompute_amount()
+
+    def set_items(self, lines):
+        """
+        Set the quantity and note of many lines in one go, a zero quantity
+        removes the line. lines is a list of dicts with product, quantity
+        and note; the amount is recomputed once at the end.
+        """
+        cents = Decimal('0.01')
+        lines = {line['product'].id: line for line in lines}
+        with transaction.atomic():
+            existing = {
+                item.product_id: item for item in
+                self.cart_items.select_for_update().filter(
+                    product_id__in=lines.keys()
+                )
+            }
+            created, updated, removed = [], [], []
+            for product_id, line in lines.items():
+                item = existing.get(product_id)
+                quantity = line['quantity']
+                note = line.get('note', '')
+                if not quantity:
+                    if item:
+                        removed.append(item.id)
+                elif item:
+                    item.quantity = quantity
+                    item.note = note
+                    item.total_price = quantity * item.final_price
+                    updated.append(item)
+                else:
+                    price = Decimal(line['product'].price).quantize(
+                        cents,
+                        ROUND_HALF_UP
+                    )
+                    created.append(CartItem(
+                        cart=self,
+                        product=line['product'],
+                        quantity=quantity,
+                        note=note,
+                        price=price,
+                        final_price=price,
+                        total_price=quantity * price
+                    ))
+
+            if removed:
+                CartItem.objects.filter(id__in=removed).delete()
+            if created:
+                CartItem.objects.bulk_create(created)
+            if updated:
+                CartItem.objects.bulk_update(
+                    updated,
+                    ['quantity', 'note', 'total_price']
+                )
+            self.recompute_amount()
+
+    def reprice(self):
+        """
+        Set the price of every line to the current price of its product,
+        the lines and their products are read in one query. Return the
+        repriced lines.
+        """
+        with transaction.atomic():
+            repriced = []
+            for item in self.cart_items.select_related(
+                'product'
+            ).select_for_update(of=('self',)):
+                if item.price_is_stale:
+                    item.price = item.product.price
+                    item.compute_total()
+                    repriced.append(item)
+            if repriced:
+                CartItem.objects.bulk_update(
+                    repriced,
+                    ['price', 'final_price', 'total_price']
+                )
+                self.recompute_amount()
+            return repriced
+
+    def has_stale_prices(self):
+        """Whether a line was priced before its product price changed"""
+        return any(item.price_is_stale for item in self.cart_items.all())
 
     def remove(self, product):
-        self.cart_items.filter(
-            product=product
-        ).delete()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {CartItem._meta.db_table} '
+                'WHERE cart_id = %s AND product_id = %s '
+                'RETURNING total_price',
+                [self.id, product.id]
+            )
+            removed = cursor.fetchone()
+            if removed:
+                self._move_amount(cursor, -removed[0])
 
 
 class CartItem(models.Model):
@@ -758,14 +1173,18 @@ class CartItem(models.Model):
     class Meta:
         unique_together = ('cart', 'product')
 
-    def save(self,  *args, **kwargs):
-        cents = Decimal('0.01')
-        if not self.product.price:
-            p = Product.objects.get(id=self.product.id)
-            self.price = p.price
-        else:
-            self.price = self.product.price
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_total = instance.__dict__.get('total_price')
+        return instance
+
+    @property
+    def price_is_stale(self):
+        return self.price != self.product.price
 
+    def compute_total(self):
+        cents = Decimal('0.01')
         self.final_price = \
             self.discount_price if self.discount_price > 0 else self.price
         self.total_price = Decimal(self.quantity) * Decimal(self.final_price)
@@ -773,5 +1192,90 @@ class CartItem(models.Model):
             cents,
             ROUND_HALF_UP
         )
-        super(CartItem, self).save(*args, **kwargs)
-        self.cart.save()
+
+    def save(self,  *args, **kwargs):
+        """
+        The price of the product is taken when the line is created, see
+        Cart.reprice. The cart amount is moved by the change of the total.
+        """
+        adding = self._state.adding
+        if adding and not self.price:
+            self.price = Decimal(self.product.price).quantize(
+                Decimal('0.01'),
+                ROUND_HALF_UP
+            )
+        self.compute_total()
+        previous = getattr(self, 'saved_total', None)
+        cart = self.cart if CartItem.cart.is_cached(self) \
+            else Cart(id=self.cart_id)
+        with transaction.atomic(savepoint=False), \
+                connection.cursor() as cursor:
+            super(CartItem, self).save(*args, **kwargs)
+            if adding:
+                cart._move_amount(cursor, self.total_price)
+            elif previous is None:
+                cart.recompute_amount()
+            elif self.total_price != previous:
+                cart._move_amount(cursor, self.total_price - previous)
+        self.saved_total = self.total_price
+
+    def delete(self, *args, **kwargs):
+        previous = getattr(self, 'saved_total', None)
+        cart = self.cart if CartItem.cart.is_cached(self) \
+            else Cart(id=self.cart_id)
+        with transaction.atomic(savepoint=False), \
+                connection.cursor() as cursor:
+            deleted = super(CartItem, self).delete(*args, **kwargs)
+            if previous is None:
+                cart.recompute_amount()
+            else:
+                cart._move_amount(cursor, -previous)
+        return deleted
+
+
+class StockBucket(models.Model):
+    """
+    A shard of the stock of a hot product. Holds on a product with buckets
+    take units from a random bucket instead of the product row, so that
+    concurrent holds mostly lock different rows.
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='stock_buckets'
+    )
+    index = models.PositiveSmallIntegerField()
+    available = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'index')
+
+    def __str__(self):
+        return f'{self.product_id}/{self.index}: {self.available}'
+
+
+class StockReservation(models.Model):
+    """Units of a product held for a cart until expires_at"""
+    cart = models.ForeignKey(
+        Cart,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    bucket = models.ForeignKey(
+        StockBucket,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='reservations'
+    )
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.cart_id} - {self.product_id}: {self.quantity}'
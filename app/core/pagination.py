@@ -0,0 +1,165 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from collections import OrderedDict
+from functools import reduce
+import operator
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext as _
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering, (created_at, id) by default.
+
+    The cursor holds the ordering values of the last row of the page, and
+    the next page filters on them instead of using OFFSET, so fetching a
+    deep page costs the same as fetching the first one.
+
+    Views can override `pagination_ordering`, `page_size` and
+    `max_page_size`; clients choose a page size with ?page_size=.
+    """
+    ordering = ('created_at', 'id')
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = getattr(view, 'pagination_ordering', self.ordering)
+        self.page_size = self.get_page_size(request, view)
+
+        cursor = self.decode_cursor(request, queryset.model)
+        self.reverse = cursor is not None and cursor['r']
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self._reverse_field(f) for f in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(ordering, cursor['p']))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+        self.has_cursor = cursor is not None
+
+        return self.page
+
+    def get_page_size(self, request, view=None):
+        page_size = getattr(view, 'page_size', self.page_size)
+        max_page_size = getattr(view, 'max_page_size', self.max_page_size)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return min(page_size, max_page_size)
+        return max(1, min(requested, max_page_size))
+
+    @staticmethod
+    def _reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, position):
+        """
+        Rows strictly after a position for a multi column ordering:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        clauses = []
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                prev.lstrip('-'): value
+                for prev, value in zip(ordering[:i], position)
+            }
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': position[i]}))
+        return reduce(operator.or_, clauses)
+
+    def position(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(
+                value.isoformat() if hasattr(value, 'isoformat')
+                else str(value)
+            )
+        return values
+
+    def decode_cursor(self, request, model):
+        """The cursor of the request with its position values of model"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if len(cursor['p']) != len(self.ordering):
+                raise ValueError
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, cursor['p'])
+            ]
+            if None in position:
+                raise ValueError
+            return {'p': position, 'r': bool(cursor['r'])}
+        except (DecodeError, KeyError, TypeError, ValueError,
+                ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        cursor = json.dumps({'p': self.position(instance), 'r': reverse})
+        encoded = urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            encoded
+        )
+
+    def get_next_link(self):
+        if not self.page:
+            return None
+        if self.reverse or self.has_more:
+            return self.encode_cursor(self.page[-1], reverse=False)
+        return None
+
+    def get_previous_link(self):
+        if not self.page:
+            if self.has_cursor:
+                return remove_query_param(
+                    self.base_url,
+                    self.cursor_query_param
+                )
+            return None
+        if (self.reverse and self.has_more) or \
+                (not self.reverse and self.has_cursor):
+            return self.encode_cursor(self.page[0], reverse=True)
+        return None
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
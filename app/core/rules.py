@@ -0,0 +1,272 @@
+"""
+Compile the Conditions of a smart Collection into a reusable filter plan.
+
+A plan is built once per collection and conditions revision and kept in a
+per-process cache, so listing the products of a collection does not need
+to query or interpret its Condition rows again until they change.
+
+A plan can be applied either as a Q object on a Product queryset, or to a
+single product in memory with the same semantics as the SQL lookups.
+
+This is the only place where Conditions are interpreted: the storefront
+API, the membership maintenance and the management commands all go
+through get_plan() and share its cache.
+"""
+import operator
+import threading
+from collections import namedtuple, OrderedDict
+from decimal import Decimal, InvalidOperation
+from functools import reduce
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, OuterRef, Q
+
+
+Rule = namedtuple('Rule', ('field', 'match', 'negation', 'value'))
+
+CENTS = Decimal('0.01')
+
+# Values of a product for each condition field, as a list so that tags
+# (many values) and a missing type (no value) are handled alike.
+_FIELD_VALUES = {
+    'title': lambda product: [product.title],
+    'type__name': lambda product: (
+        [product.type.name] if product.type_id else []
+    ),
+    'tags__name': lambda product: [tag.name for tag in product.tags.all()],
+    'stock': lambda product: [int(product.stock)],
+    'price': lambda product: [Decimal(str(product.price)).quantize(CENTS)],
+}
+
+_NUMERIC_FIELDS = {
+    'stock': int,
+    'price': Decimal,
+}
+
+# The text lookups cast the column to text and the case insensitive ones
+# compare both sides in upper case, the same way Postgres does.
+_MATCHERS = {
+    '__iexact': lambda actual, value: str(actual).upper() == value.upper(),
+    '__istartswith': lambda actual, value: (
+        str(actual).upper().startswith(value.upper())
+    ),
+    '__iendswith': lambda actual, value: (
+        str(actual).upper().endswith(value.upper())
+    ),
+    '__contains': lambda actual, value: value in str(actual),
+    '__gte': operator.ge,
+    '__lte': operator.le,
+}
+
+
+def tags_exist(**lookups):
+    """
+    Correlated EXISTS on the tags of the outer Product queryset rows.
+    Unlike a join on tags__name it never returns a product twice, so the
+    queryset does not need distinct().
+    """
+    product = apps.get_model('core', 'Product')
+    tags = product.tags.through.objects.filter(
+        content_type=ContentType.objects.get_for_model(product),
+        object_id=OuterRef('pk')
+    )
+    return Exists(tags.filter(**{
+        f'tag__{lookup}': value for lookup, value in lookups.items()
+    }))
+
+
+def type_exists(**lookups):
+    """Correlated EXISTS on the type of the outer Product queryset rows"""
+    product_type = apps.get_model('core', 'ProductType')
+    return Exists(product_type.objects.filter(
+        pk=OuterRef('type_id'),
+        **lookups
+    ))
+
+
+_RELATED_EXISTS = {
+    'tags__name': tags_exist,
+    'type__name': type_exists,
+}
+
+
+def _rule_value(rule):
+    """
+    Return the value a rule compares against, converted to the type of the
+    field for numeric comparisons, or None when it can not be converted.
+    """
+    if rule.match not in ('__gte', '__lte'):
+        return rule.value
+    try:
+        return _NUMERIC_FIELDS[rule.field](rule.value)
+    except (ValueError, InvalidOperation):
+        return None
+
+
+def _rule_predicate(rule):
+    """Return a function testing one rule against a product in memory"""
+    value = _rule_value(rule)
+    values = _FIELD_VALUES[rule.field]
+    matcher = _MATCHERS[rule.match]
+
+    def predicate(product):
+        matched = value is not None and any(
+            matcher(actual, value) for actual in values(product)
+        )
+        return not matched if rule.negation else matched
+    return predicate
+
+
+class CompiledCollection:
+    """Filter plan for one collection at a given conditions revision"""
+
+    def __init__(self, collection_id, revision, connector, groups):
+        self.collection_id = collection_id
+        self.revision = revision
+        self.connector = connector
+        self.groups = groups
+        self.query = self._build_query()
+        self.predicates = tuple(
+            tuple(_rule_predicate(rule) for rule in group)
+            for group in groups
+        )
+
+    def _build_query(self):
+        """
+        Conditions on the same field are OR'ed together, and each of those
+        groups is combined with the collection type (all / any).
+        A collection without conditions matches no product.
+        """
+        if not self.groups:
+            return Q(pk__in=[])
+
+        combine = operator.or_ if self.connector == Q.OR else operator.and_
+        return reduce(combine, [
+            reduce(operator.or_, [self._rule_query(r) for r in group])
+            for group in self.groups
+        ])
+
+    @staticmethod
+    def _rule_query(rule):
+        value = _rule_value(rule)
+        if value is None:
+            q = Q(pk__in=[])
+        elif rule.field in _RELATED_EXISTS:
+            q = Q(_RELATED_EXISTS[rule.field](
+                **{f'name{rule.match}': value}
+            ))
+        else:
+            q = Q(**{f'{rule.field}{rule.match}': value})
+        return ~q if rule.negation else q
+
+    def matches(self, product):
+        """
+        Test a product against the plan without querying the database.
+        The tags and type of the product should be prefetched.
+        """
+        if not self.predicates:
+            return False
+
+        combine = any if self.connector == Q.OR else all
+        return combine(
+            any(predicate(product) for predicate in group)
+            for group in self.predicates
+        )
+
+    def is_current(self, collection):
+        return (
+            self.revision == collection.conditions_revision and
+            self.connector == collection.type
+        )
+
+
+class PlanCache:
+    """Thread safe LRU of compiled plans keyed by collection id"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, collection):
+        """Return the current plan of a collection, or None"""
+        with self._lock:
+            plan = self._plans.get(collection.id)
+            if plan is not None and plan.is_current(collection):
+                self._plans.move_to_end(collection.id)
+                self.hits += 1
+                return plan
+            self.misses += 1
+            return None
+
+    def put(self, plan):
+        with self._lock:
+            cached = self._plans.get(plan.collection_id)
+            if cached is not None and cached.revision > plan.revision:
+                return
+            self._plans[plan.collection_id] = plan
+            self._plans.move_to_end(plan.collection_id)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._plans),
+            'maxsize': self.maxsize,
+        }
+
+
+plans = PlanCache(getattr(settings, 'COLLECTION_PLAN_CACHE_SIZE', 1024))
+
+
+def compile_collection(collection):
+    """Build the plan of a collection from its conditions (uncached)"""
+    conditions = collection.condition_set.order_by('field_reference', 'id')
+
+    groups = []
+    prev = None
+    for condition in conditions:
+        if condition.field_reference != prev:
+            groups.append([])
+            prev = condition.field_reference
+        groups[-1].append(condition.as_rule())
+
+    return CompiledCollection(
+        collection.id,
+        collection.conditions_revision,
+        collection.type,
+        tuple(tuple(group) for group in groups)
+    )
+
+
+def get_plan(collection):
+    """Return the cached plan of a collection, compiling it if stale"""
+    plan = plans.get(collection)
+    if plan is None:
+        plan = compile_collection(collection)
+        plans.put(plan)
+    return plan
+
+
+def matching_collections(product, collections):
+    """Return the collections whose conditions match a product"""
+    return [
+        collection for collection in collections
+        if get_plan(collection).matches(product)
+    ]
+
+
+def clear_plans():
+    plans.clear()
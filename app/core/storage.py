@@ -0,0 +1,74 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class BlobStorage(FileSystemStorage):
+    """
+    Content addressed storage, a file is stored once under the sha256 of
+    its content as <PREFIX>/<first two hex digits>/<digest><extension>
+    whatever name it was uploaded with.
+
+    The content is hashed while it is copied to a temporary file next to
+    the blobs, then renamed to its digest unless that blob already exists.
+    Saving an existing blob refreshes its modification time, which keeps
+    it from the garbage collector, see core.blobs.
+
+    A name already under the prefix is a file derived from a blob, such as
+    an image variant, and is stored as named.
+    """
+
+    @property
+    def prefix(self):
+        return settings.MEDIA_BLOBS['PREFIX']
+
+    def blob_name(self, digest, ext):
+        return f'{self.prefix}/{digest[:2]}/{digest}{ext}'
+
+    def get_available_name(self, name, max_length=None):
+        # the final name only depends on the content
+        return name
+
+    def _save(self, name, content):
+        derived = name.startswith(f'{self.prefix}/')
+        ext = os.path.splitext(name)[1].lower()
+        directory = self.path(self.prefix)
+        os.makedirs(directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temp = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as blob:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    blob.write(chunk)
+
+            if not derived:
+                name = self.blob_name(digest.hexdigest(), ext)
+            path = self.path(name)
+            if os.path.exists(path) and not derived:
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp, path)
+                temp = None
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+        finally:
+            if temp is not None:
+                os.remove(temp)
+        return name
+
+
+_blob_storage = None
+
+
+def blob_storage():
+    """The storage of product images and attachments"""
+    global _blob_storage
+    if _blob_storage is None:
+        _blob_storage = BlobStorage()
+    return _blob_storage
@@ -0,0 +1,61 @@
+"""
+Resolve the <slug:store> URL kwarg of store scoped views.
+
+The slug to id mapping is kept in the Django cache named by
+settings.STORE_CACHE['ALIAS'] and on the view for the rest of the request,
+so store scoped queries filter on store_id instead of joining core_store.
+The Store signals forget a slug when the store is renamed or deleted, in
+the cache of the process saving the store only when the backend is not
+shared, so a slug is also cached for STORE_CACHE['SLUG_TIMEOUT'] seconds
+at most: that long, other workers may still resolve a renamed or deleted
+store from its old slug.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+
+from core.models import Store
+
+
+def _key(slug):
+    return f'store-id:{slug}'
+
+
+def resolve_store_id(slug):
+    """Return the id of the store with this slug, or None"""
+    cache = caches[settings.STORE_CACHE['ALIAS']]
+    store_id = cache.get(_key(slug))
+    if store_id is None:
+        store_id = Store.objects.filter(
+            slug=slug
+        ).values_list('id', flat=True).first()
+        if store_id is not None:
+            cache.set(
+                _key(slug),
+                store_id,
+                settings.STORE_CACHE['SLUG_TIMEOUT']
+            )
+    return store_id
+
+
+def forget_store(slug):
+    caches[settings.STORE_CACHE['ALIAS']].delete(_key(slug))
+
+
+class StoreScopedMixin:
+    """Resolve the store of the URL once per request"""
+    store_url_kwarg = 'store'
+
+    def get_store_id(self):
+        """Id of the store of the URL, None when there is no such store"""
+        if not hasattr(self, '_store_id'):
+            self._store_id = resolve_store_id(
+                self.kwargs[self.store_url_kwarg]
+            )
+        return self._store_id
+
+    def get_store_id_or_404(self):
+        store_id = self.get_store_id()
+        if store_id is None:
+            raise Http404
+        return store_id
@@ -0,0 +1,189 @@
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import blobs
+from core.models import Store, Product, ProductImage, ProductAttachment, \
+                        MediaBlob
+from core.storage import blob_storage
+
+
+def sample_user(email='tmp_user@cinolabs.com', password='testpass'):
+    return get_user_model().objects.create_user(email, password)
+
+
+def sample_product(user, **params):
+    """create and return sample product"""
+    defaults = {
+        'title': 'Sample Product',
+        'price': 5.00,
+        'stock': 10,
+        'published': True
+    }
+    defaults.update(params)
+
+    return Product.objects.create(
+        user=user,
+        store=Store.objects.create(user=user, title='Main Store'),
+        **defaults
+    )
+
+
+def upload(content, name='supplier.txt'):
+    return SimpleUploadedFile(name, content)
+
+
+class BlobStorageTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.product = sample_product(sample_user())
+        self.storage = blob_storage()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def attach(self, content, name='supplier.txt'):
+        return ProductAttachment.objects.create(
+            product=self.product,
+            title='Sample',
+            file=upload(content, name)
+        )
+
+    def refcount(self, name):
+        return MediaBlob.objects.get(name=name).refcount
+
+    def age(self, name, seconds=7200):
+        """Pretend the blob was last touched seconds ago"""
+        past = timezone.now() - timezone.timedelta(seconds=seconds)
+        MediaBlob.objects.filter(name=name).update(updated_at=past)
+        path = self.storage.path(name)
+        os.utime(path, (past.timestamp(), past.timestamp()))
+
+    def test_same_content_stored_once(self):
+        first = self.attach(b'Id,Title', 'first.TXT')
+        second = self.attach(b'Id,Title', 'second.txt')
+        other = self.attach(b'Id,Price')
+
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertRegex(
+            first.file.name,
+            r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.txt$'
+        )
+        with self.storage.open(first.file.name) as blob:
+            self.assertEqual(blob.read(), b'Id,Title')
+        self.assertEqual(self.refcount(first.file.name), 2)
+        self.assertEqual(self.refcount(other.file.name), 1)
+        stored = [
+            filename for _, _, filenames in os.walk(self.media_root)
+            for filename in filenames
+        ]
+        self.assertEqual(len(stored), 2)
+
+    def test_derived_file_stored_as_named(self):
+        name = self.attach(b'Id,Title').file.name
+        variant = name.replace('.txt', '_thumbnail.webp')
+
+        saved = self.storage.save(variant, ContentFile(b'a'))
+        self.assertEqual(saved, variant)
+        # rendering again replaces it
+        saved = self.storage.save(variant, ContentFile(b'b'))
+        self.assertEqual(saved, variant)
+        with self.storage.open(variant) as content:
+            self.assertEqual(content.read(), b'b')
+
+    def test_delete_and_replace_release(self):
+        first = self.attach(b'Id,Title')
+        second = self.attach(b'Id,Title')
+        name = first.file.name
+
+        first.delete()
+        self.assertEqual(self.refcount(name), 1)
+
+        second.file = upload(b'Id,Price')
+        second.save()
+        self.assertEqual(self.refcount(name), 0)
+        self.assertEqual(self.refcount(second.file.name), 1)
+
+    def test_bulk_acquire(self):
+        name = self.storage.save('a.txt', ContentFile(b'Id,Title'))
+
+        blobs.acquire([name, name, 'uploads/legacy.txt', ''])
+
+        self.assertEqual(self.refcount(name), 2)
+        self.assertEqual(MediaBlob.objects.count(), 1)
+
+    def test_collect(self):
+        kept = self.attach(b'Id,Title')
+        dropped = self.attach(b'Id,Price')
+        recent = self.attach(b'Id,Stock')
+        # variants are written next to the blob, under their own name
+        variant = self.storage.save(
+            dropped.file.name.replace('.txt', '_thumbnail.webp'),
+            ContentFile(b'')
+        )
+        ProductAttachment.objects.exclude(id=kept.id).delete()
+        self.age(kept.file.name)
+        self.age(dropped.file.name)
+
+        out = StringIO()
+        call_command('collect_media_blobs', stdout=out)
+
+        self.assertIn('Deleted 1 unreferenced blobs', out.getvalue())
+        self.assertTrue(self.storage.exists(kept.file.name))
+        self.assertFalse(self.storage.exists(dropped.file.name))
+        self.assertTrue(self.storage.exists(recent.file.name))
+        self.assertEqual(
+            set(MediaBlob.objects.values_list('name', flat=True)),
+            {kept.file.name, recent.file.name}
+        )
+        self.assertFalse(self.storage.exists(variant))
+
+    def test_saving_again_keeps_blob(self):
+        attachment = self.attach(b'Id,Title')
+        name = attachment.file.name
+        attachment.delete()
+        self.age(name)
+
+        # the content is uploaded again before its row is committed
+        self.storage.save('again.txt', ContentFile(b'Id,Title'))
+
+        self.assertEqual(list(blobs.collect()), [0])
+        self.assertTrue(self.storage.exists(name))
+
+    def test_collect_orphans(self):
+        referenced = self.attach(b'Id,Title')
+        orphan = self.storage.save('orphan.txt', ContentFile(b'Id,Price'))
+        past = timezone.now() - timezone.timedelta(hours=2)
+        os.utime(self.storage.path(orphan), (past.timestamp(),) * 2)
+
+        self.assertEqual(blobs.collect_orphans(), 1)
+
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(referenced.file.name))
+
+    def test_product_images_share_blobs(self):
+        content = b'GIF89a\x01\x00\x01\x00\x00\x00\x00;'
+        images = [
+            ProductImage.objects.create(
+                product=self.product,
+                title='Sample',
+                image=upload(content, 'pixel.gif')
+            )
+            for _ in range(3)
+        ]
+
+        self.assertEqual(len({image.image.name for image in images}), 1)
+        self.assertEqual(self.refcount(images[0].image.name), 3)
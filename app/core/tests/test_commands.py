@@ -1,9 +1,16 @@
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from django.utils import timezone
+
+from core.models import Store, Product, Collection, Condition, \
+                        CollectionMembership, Cart, CartItem
+
 
 class CommandTests(TestCase):
 
@@ -21,3 +28,108 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+    def test_rebuild_collections(self):
+        """Test rebuilding collection membership for a store"""
+        user = get_user_model().objects.create_user(
+            'owner@cinolabs.com',
+            'testpass'
+        )
+        store = Store.objects.create(user=user, title='Main Store')
+        collection = Collection.objects.create(
+            title='Disney',
+            store=store,
+            user=user
+        )
+        Condition.objects.create(
+            collection=collection,
+            field_reference=Condition.PRODUCT_TITLE,
+            filter_type=Condition.STARTSWITH,
+            field_val='disney'
+        )
+        product = Product.objects.create(
+            title='Disney Mickey',
+            price=5,
+            stock=1,
+            store=store,
+            user=user
+        )
+        CollectionMembership.objects.all().delete()
+
+        call_command(
+            'rebuild_collections',
+            store=store.slug,
+            stdout=StringIO()
+        )
+
+        self.assertTrue(CollectionMembership.objects.filter(
+            collection=collection,
+            product=product
+        ).exists())
+
+
+class CleanCartsCommandTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            'owner@cinolabs.com',
+            'testpass'
+        )
+        self.store = Store.objects.create(user=user, title='Main Store')
+        self.other = Store.objects.create(user=user, title='Other Store')
+        product = Product.objects.create(
+            title='Sample Product',
+            price=5,
+            stock=10,
+            store=self.store,
+            user=user
+        )
+        expired = timezone.now() - timezone.timedelta(days=1)
+        for store in (self.store, self.store, self.store, self.other):
+            cart = Cart.objects.create(store=store)
+            cart.add(product)
+            Cart.objects.filter(pk=cart.pk).update(invalid_at=expired)
+        Cart.objects.create(store=self.store)
+
+    def clean(self, **options):
+        out = StringIO()
+        call_command('clean_carts', stdout=out, **options)
+        return out.getvalue()
+
+    def test_inactivate_in_batches(self):
+        out = self.clean(batch_size=2)
+
+        self.assertIn('Batch 2: 2 carts', out)
+        self.assertIn('Updating 4 items', out)
+        self.assertEqual(Cart.objects.filter(is_active=True).count(), 1)
+
+    def test_delete_in_batches(self):
+        self.clean()
+
+        out = self.clean(delete=True, batch_size=3)
+
+        self.assertIn('Deleting 4 items', out)
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_store_filter(self):
+        self.clean(store=self.other.slug)
+
+        self.assertEqual(
+            list(Cart.objects.filter(is_active=False).values_list(
+                'store_id', flat=True
+            )),
+            [self.other.id]
+        )
+
+    def test_dry_run(self):
+        out = self.clean(dry_run=True)
+
+        self.assertIn('Updating 4 items (dry run)', out)
+        self.assertEqual(Cart.objects.filter(is_active=True).count(), 5)
+
+    def test_max_runtime(self):
+        out = self.clean(batch_size=1, max_runtime=0)
+
+        self.assertIn('max runtime', out)
+        self.assertEqual(Cart.objects.filter(is_active=False).count(), 1)
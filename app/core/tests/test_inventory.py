@@ -0,0 +1,255 @@
+from io import StringIO
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from commerce.services import CheckoutError, CheckoutService
+from core import inventory
+from core.models import Store, Product, Cart, StockBucket, StockReservation
+
+
+def sample_user(email='tmp_user@cinolabs.com', password='testpass'):
+    return get_user_model().objects.create_user(email, password)
+
+
+def sample_store(user, title='Main Store'):
+    return Store.objects.create(
+        user=user,
+        title=title
+    )
+
+
+def sample_product(user, store, **params):
+    """create and return sample product"""
+    defaults = {
+        'title': 'Sample Product',
+        'price': 5.00,
+        'stock': 10,
+        'published': True
+    }
+    defaults.update(params)
+
+    return Product.objects.create(
+        user=user,
+        store=store,
+        **defaults
+    )
+
+
+class InventoryTests(TestCase):
+
+    def setUp(self):
+        self.user = sample_user()
+        self.store = sample_store(self.user)
+        self.product = sample_product(self.user, self.store)
+        self.cart = Cart.objects.create(store=self.store)
+        self.other_cart = Cart.objects.create(store=self.store)
+
+    def assertFree(self, free):
+        """Units that can still be held, wherever they are counted"""
+        self.product.refresh_from_db()
+        buckets = StockBucket.objects.filter(product=self.product)
+        if buckets.exists():
+            self.assertEqual(self.product.reserved, 0)
+            actual = buckets.aggregate(free=Sum('available'))['free']
+        else:
+            actual = self.product.stock - self.product.reserved
+        self.assertEqual(actual, free)
+
+    def test_hold_and_release(self):
+        inventory.hold(self.cart, self.product, 7)
+        self.assertFree(3)
+
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.hold(self.other_cart, self.product, 4)
+
+        inventory.release(self.cart.reservations.all())
+        self.assertFree(10)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_save_keeps_holds(self):
+        product = Product.objects.get(pk=self.product.pk)
+        inventory.hold(self.cart, self.product, 4)
+
+        product.title = 'Renamed'
+        product.save()
+
+        self.assertFree(6)
+
+    def test_release_expired(self):
+        inventory.hold(self.cart, self.product, 2, ttl=60)
+        inventory.hold(self.other_cart, self.product, 3, ttl=60)
+        inventory.hold(self.other_cart, self.product, 1, ttl=3600)
+
+        released = list(inventory.release_expired(
+            batch_size=1,
+            now=timezone.now() + timezone.timedelta(minutes=5)
+        ))
+
+        self.assertEqual(released, [1, 1])
+        self.assertFree(9)
+
+    def test_release_reservations_command(self):
+        inventory.hold(self.cart, self.product, 2, ttl=-1)
+        out = StringIO()
+
+        call_command('release_reservations', stdout=out)
+
+        self.assertIn('Released 1 expired holds', out.getvalue())
+        self.assertFree(10)
+
+    def test_deleted_cart_releases(self):
+        inventory.hold(self.cart, self.product, 2)
+
+        self.cart.delete()
+
+        self.assertFree(10)
+
+    def test_shard_and_gather(self):
+        inventory.hold(self.cart, self.product, 3)
+
+        buckets = inventory.shard(self.product, 3)
+        self.assertEqual(
+            sorted(bucket.available for bucket in buckets),
+            [2, 2, 3]
+        )
+        self.assertFree(7)
+
+        holds = inventory.hold(self.other_cart, self.product, 5)
+        self.assertGreater(len(holds), 1)
+        self.assertEqual(sum(hold.quantity for hold in holds), 5)
+        self.assertFree(2)
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.hold(self.other_cart, self.product, 3)
+        self.assertFree(2)
+
+        inventory.gather(self.product)
+        self.assertFree(2)
+        inventory.release(StockReservation.objects.all())
+        self.assertFree(10)
+
+    def test_stock_change_rebalances_buckets(self):
+        inventory.shard(self.product, 3)
+        inventory.hold(self.cart, self.product, 4)
+
+        self.product.stock = 20
+        self.product.save()
+        self.assertFree(16)
+        self.assertEqual(StockBucket.objects.count(), 3)
+        inventory.hold(self.other_cart, self.product, 16)
+        self.assertFree(0)
+
+        inventory.release(self.other_cart.reservations.all())
+        self.product.stock = 5
+        self.product.save()
+        self.assertFree(1)
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.hold(self.other_cart, self.product, 2)
+
+    def test_checkout_settles_holds(self):
+        inventory.shard(self.product, 4)
+        self.cart.add(self.product, 6)
+        inventory.hold_cart(self.cart)
+        self.other_cart.add(self.product, 5)
+
+        with self.assertRaises(CheckoutError):
+            CheckoutService(self.other_cart).checkout(self.user)
+        CheckoutService(self.cart).checkout(self.user)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
+        self.assertFree(4)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_respects_other_holds(self):
+        inventory.hold(self.other_cart, self.product, 8)
+        self.cart.add(self.product, 3)
+
+        with self.assertRaises(CheckoutError):
+            CheckoutService(self.cart).checkout(self.user)
+
+        self.cart.remove(self.product)
+        self.cart.add(self.product, 2)
+        CheckoutService(self.cart).checkout(self.user)
+        self.assertFree(0)
+
+    def test_reserve_endpoint(self):
+        self.cart.add(self.product, 4)
+        url = reverse(
+            'commerce:cart-reserve',
+            args=[self.store.slug, self.cart.id]
+        )
+
+        res = APIClient().post(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0]['quantity'], 4)
+        self.assertFree(6)
+
+        # reserving again replaces the holds of the cart
+        res = APIClient().post(url)
+        self.assertFree(6)
+
+        self.cart.add(self.product, 7)
+        res = APIClient().post(url)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFree(6)
+
+
+class CommittedInventoryTests(TransactionTestCase):
+    """Holds released while a checkout commits its own transaction"""
+
+    def test_sweeper_skips_products_of_checkout(self):
+        """The sweeper and a checkout of the same product never deadlock"""
+        user = sample_user()
+        product = sample_product(user, sample_store(user))
+        cart = Cart.objects.create(store=product.store)
+        cart.add(product, 3)
+        inventory.hold_cart(cart, ttl=-1)
+        other_cart = Cart.objects.create(store=product.store)
+        inventory.hold(other_cart, product, 2, ttl=-1)
+
+        locked, swept = threading.Event(), threading.Event()
+        settle_holds = CheckoutService.settle_holds
+
+        def settle_when_swept(cart, quantities):
+            # the products are locked, the holds not yet
+            locked.set()
+            self.assertTrue(swept.wait(5))
+            return settle_holds(cart, quantities)
+
+        def sweep():
+            locked.wait(5)
+            try:
+                return sum(inventory.release_expired())
+            finally:
+                swept.set()
+                connection.close()
+
+        sweeper = threading.Thread(target=sweep)
+        sweeper.start()
+        with mock.patch.object(
+            CheckoutService,
+            'settle_holds',
+            staticmethod(settle_when_swept)
+        ):
+            order = CheckoutService(cart).checkout(user)
+        sweeper.join()
+
+        self.assertEqual(order.order_items.count(), 1)
+        self.assertEqual(
+            list(StockReservation.objects.values_list('cart', flat=True)),
+            [other_cart.id]
+        )
+        self.assertEqual(sum(inventory.release_expired()), 1)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.reserved), (7, 0))
@@ -0,0 +1,450 @@
+import operator
+import random
+from functools import reduce
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.test import TestCase
+from django.utils import timezone
+
+from core import rules
+from core.models import Store, Product, Collection, Condition, \
+                        CollectionMembership, ProductType
+from store.services import CollectionService
+
+
+def sample_store(user, title='Main Store'):
+    return Store.objects.create(user=user, title=title)
+
+
+def sample_product(user, store, **params):
+    """create and return sample product"""
+    defaults = {
+        'title': 'Sample Product',
+        'price': 5.00,
+        'stock': 3,
+        'published': True
+    }
+    defaults.update(params)
+
+    return Product.objects.create(user=user, store=store, **defaults)
+
+
+class CollectionPlanTests(TestCase):
+
+    def setUp(self):
+        rules.clear_plans()
+        self.user = get_user_model().objects.create_user(
+            'owner@cinolabs.com',
+            'testpass'
+        )
+        self.store = sample_store(self.user)
+        self.collection = Collection.objects.create(
+            title='Disney',
+            store=self.store,
+            user=self.user,
+            type=Collection.ANY
+        )
+
+    def add_condition(self, **params):
+        defaults = {
+            'field_reference': Condition.PRODUCT_TAG,
+            'filter_type': Condition.EQUAL,
+            'field_val': 'Disney'
+        }
+        defaults.update(params)
+        return Condition.objects.create(collection=self.collection, **defaults)
+
+    def test_plan_groups_conditions_by_field(self):
+        self.add_condition(field_val='Disney')
+        self.add_condition(
+            field_reference=Condition.PRODUCT_PRICE,
+            filter_type=Condition.GTE,
+            field_val='10'
+        )
+        self.add_condition(field_val='Marvel')
+
+        plan = rules.compile_collection(self.collection)
+
+        self.assertEqual(len(plan.groups), 2)
+        self.assertEqual(
+            [rule.value for rule in plan.groups[1]],
+            ['Disney', 'Marvel']
+        )
+        self.assertEqual(plan.groups[0][0].match, '__gte')
+
+    def test_warm_plan_does_not_query_conditions(self):
+        self.add_condition()
+        collection = Collection.objects.get(pk=self.collection.pk)
+        rules.get_plan(collection)
+
+        with self.assertNumQueries(0):
+            plan = rules.get_plan(collection)
+
+        self.assertIs(plan, rules.get_plan(collection))
+
+    def test_condition_changes_invalidate_plan(self):
+        product = sample_product(self.user, self.store)
+        product.tags.add('Marvel')
+        condition = self.add_condition()
+        self.assertNotIn(product, self.collection.get_products())
+
+        condition.field_val = 'Marvel'
+        condition.save()
+        collection = Collection.objects.get(pk=self.collection.pk)
+        self.assertIn(product, collection.get_products())
+
+        condition.delete()
+        collection.refresh_from_db()
+        self.assertNotIn(product, collection.get_products())
+
+    def test_collection_type_change_invalidates_plan(self):
+        product = sample_product(self.user, self.store, price=20)
+        product.tags.add('Marvel')
+        self.add_condition()
+        self.add_condition(
+            field_reference=Condition.PRODUCT_PRICE,
+            filter_type=Condition.GTE,
+            field_val='10'
+        )
+        self.assertIn(product, self.collection.get_products())
+
+        self.collection.type = Collection.ALL
+        self.collection.save()
+        self.assertNotIn(product, self.collection.get_products())
+
+    def test_collection_without_conditions_is_empty(self):
+        sample_product(self.user, self.store)
+
+        self.assertEqual(self.collection.get_products().count(), 0)
+
+
+class CollectionMembershipTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'owner@cinolabs.com',
+            'testpass'
+        )
+        self.store = sample_store(self.user)
+        self.collection = Collection.objects.create(
+            title='Quilting',
+            store=self.store,
+            user=self.user,
+            type=Collection.ANY
+        )
+        self.product_type = ProductType.objects.create(
+            name='Cotton',
+            store=self.store,
+            user=self.user
+        )
+        Condition.objects.create(
+            collection=self.collection,
+            field_reference=Condition.PRODUCT_TYPE,
+            field_val='Cotton'
+        )
+        Condition.objects.create(
+            collection=self.collection,
+            field_reference=Condition.PRODUCT_TAG,
+            field_val='quilt'
+        )
+
+    def members(self):
+        return set(CollectionMembership.objects.filter(
+            collection=self.collection
+        ).values_list('product_id', flat=True))
+
+    def test_product_tags_update_membership(self):
+        product = sample_product(self.user, self.store)
+        self.assertEqual(self.members(), set())
+
+        product.tags.add('quilt')
+        self.assertEqual(self.members(), {product.id})
+
+        product.tags.remove('quilt')
+        self.assertEqual(self.members(), set())
+
+    def test_product_type_update_membership(self):
+        product = sample_product(
+            self.user,
+            self.store,
+            type=self.product_type
+        )
+        self.assertEqual(self.members(), {product.id})
+
+        self.product_type.name = 'Linen'
+        self.product_type.save()
+        self.assertEqual(self.members(), set())
+
+    def test_unpublished_products_are_members_but_not_listed(self):
+        product = sample_product(self.user, self.store, published=False)
+        product.tags.add('quilt')
+
+        self.assertEqual(self.members(), {product.id})
+        self.assertNotIn(product, self.collection.get_products())
+
+    def test_delete_collection(self):
+        product = sample_product(self.user, self.store)
+        product.tags.add('quilt')
+
+        self.collection.delete()
+
+        self.assertFalse(CollectionMembership.objects.exists())
+
+
+class InMemoryEvaluatorTests(TestCase):
+
+    def setUp(self):
+        rules.clear_plans()
+        self.user = get_user_model().objects.create_user(
+            'owner@cinolabs.com',
+            'testpass'
+        )
+        self.store = sample_store(self.user)
+        product_type = ProductType.objects.create(
+            name='Quilting Cotton',
+            store=self.store,
+            user=self.user
+        )
+        product = sample_product(
+            self.user,
+            self.store,
+            title='Mickey Fabric',
+            price=12.5,
+            stock=4,
+            type=product_type
+        )
+        product.tags.add('Disney', 'cotton')
+        untyped = sample_product(self.user, self.store, title='Zipper')
+        untyped.tags.add('notions')
+
+        self.products = Product.objects.select_related(
+            'type'
+        ).prefetch_related('tags')
+
+    def assertSameAsQuery(self, field_reference, filter_type, field_val):
+        collection = Collection.objects.create(
+            title=f'{field_reference} {filter_type} {field_val}',
+            store=self.store,
+            user=self.user
+        )
+        Condition.objects.create(
+            collection=collection,
+            field_reference=field_reference,
+            filter_type=filter_type,
+            field_val=field_val
+        )
+        collection.refresh_from_db()
+        plan = rules.get_plan(collection)
+
+        expected = set(self.products.filter(plan.query))
+        actual = {p for p in self.products if plan.matches(p)}
+        self.assertEqual(actual, expected, str(plan.groups))
+
+    def test_text_conditions(self):
+        values = ('mickey', 'Fabric', 'ZIP', 'disney', 'cot', 'Quilting')
+        for field in (Condition.PRODUCT_TITLE, Condition.PRODUCT_TAG,
+                      Condition.PRODUCT_TYPE):
+            for filter_type in Condition._default_choices:
+                for value in values:
+                    self.assertSameAsQuery(field, filter_type, value)
+
+    def test_numeric_conditions(self):
+        values = ('4', '12.50', '12.5', '3', '13', 'abc')
+        for field in (Condition.PRODUCT_STOCK, Condition.PRODUCT_PRICE):
+            for filter_type in Condition._numeric_choices:
+                for value in values:
+                    self.assertSameAsQuery(field, filter_type, value)
+
+    def test_matching_collections_in_one_pass(self):
+        collections = []
+        for title in ('Mickey', 'Zipper', 'Minnie'):
+            collection = Collection.objects.create(
+                title=title,
+                store=self.store,
+                user=self.user
+            )
+            Condition.objects.create(
+                collection=collection,
+                field_reference=Condition.PRODUCT_TITLE,
+                filter_type=Condition.STARTSWITH,
+                field_val=title
+            )
+            collection.refresh_from_db()
+            collections.append(collection)
+        product = self.products.get(title='Mickey Fabric')
+
+        with self.assertNumQueries(0):
+            matched = rules.matching_collections(product, collections)
+
+        self.assertEqual(matched, collections[:1])
+
+
+def legacy_get_products(collection):
+    """Collection.get_products() as implemented before core.rules"""
+    conditions = Condition.objects.filter(
+        collection__id=collection.id
+    ).order_by('field_reference')
+
+    products = Product.objects.all().filter(
+        store__slug=collection.store.slug,
+        published=True,
+        date_available__lte=timezone.now()
+    )
+    prev = None
+    nquery = []
+    nquery2 = []
+    for c in conditions:
+        choice = next(
+            item for item in Condition._CHOICES
+            if item["key"] == c.field_reference
+        )
+        dynamic_filter = {
+            f"{choice['field']}"
+            f"{choice['choices'][c.filter_type]['match']}": c.field_val
+        }
+        if prev and prev != c.field_reference:
+            nquery2.append(reduce(operator.or_, nquery))
+            nquery = []
+        if choice['choices'][c.filter_type]['negation']:
+            q = ~Q(**dynamic_filter)
+        else:
+            q = Q(**dynamic_filter)
+        nquery.append(q)
+        prev = c.field_reference
+
+    nquery2.append(reduce(operator.or_, nquery))
+    query = reduce(collection.operator_type(), nquery2)
+
+    return products.filter(query).distinct()
+
+
+class RuleEngineEquivalenceTests(TestCase):
+    """
+    Randomized condition sets must select the same products through the
+    rule engine, the membership table and in memory as the query builder
+    the engine replaced.
+    """
+    seed = 20210329
+    trials = 60
+    words = ('Disney', 'disney', 'Cotton', 'Mickey', 'Zip', 'fabric', 'ey')
+    numbers = {
+        Condition.PRODUCT_STOCK: ('0', '3', '5', '20'),
+        Condition.PRODUCT_PRICE: ('3', '5', '5.00', '12.5', '20'),
+    }
+
+    def setUp(self):
+        rules.clear_plans()
+        self.random = random.Random(self.seed)
+        self.user = get_user_model().objects.create_user(
+            'owner@cinolabs.com',
+            'testpass'
+        )
+        self.store = sample_store(self.user)
+        types = [None] + [
+            ProductType.objects.create(
+                name=name,
+                store=self.store,
+                user=self.user
+            ) for name in ('Quilting Cotton', 'Zippers', 'Disney Prints')
+        ]
+        for i in range(20):
+            product = sample_product(
+                self.user,
+                self.store,
+                title=' '.join(self.random.sample(self.words, 2)) + f' {i}',
+                price=self.random.choice((3, 5, 12.5, 20, 45.99)),
+                stock=self.random.randint(0, 6),
+                type=self.random.choice(types),
+                published=self.random.random() > 0.1
+            )
+            product.tags.add(*self.random.sample(
+                self.words,
+                self.random.randint(0, 3)
+            ))
+
+    def random_condition(self, collection):
+        field = self.random.choice(Condition._CHOICES)
+        filter_type = self.random.choice(list(field['choices']))
+        if field['key'] in self.numbers:
+            value = self.random.choice(self.numbers[field['key']])
+        else:
+            value = self.random.choice(self.words)
+        return Condition.objects.create(
+            collection=collection,
+            field_reference=field['key'],
+            filter_type=filter_type,
+            field_val=value
+        )
+
+    def test_same_products_as_legacy_query(self):
+        products = Product.objects.filter(
+            published=True
+        ).select_related('type').prefetch_related('tags')
+
+        for trial in range(self.trials):
+            collection = Collection.objects.create(
+                title=f'Random {trial}',
+                store=self.store,
+                user=self.user,
+                type=self.random.choice((Collection.ALL, Collection.ANY))
+            )
+            for _ in range(self.random.randint(1, 5)):
+                self.random_condition(collection)
+            collection.refresh_from_db()
+
+            expected = set(legacy_get_products(collection))
+            plan = rules.get_plan(collection)
+            message = f'{collection.type} {plan.groups}'
+
+            self.assertEqual(
+                set(collection.get_products()),
+                expected,
+                message
+            )
+            self.assertEqual(
+                {p for p in products if plan.matches(p)},
+                expected,
+                message
+            )
+            self.assertEqual(
+                set(products.filter(
+                    CollectionService(collection).get_products_filter()
+                ).distinct()),
+                expected,
+                message
+            )
+
+    def test_plan_cache_counters(self):
+        collection = Collection.objects.create(
+            title='Counted',
+            store=self.store,
+            user=self.user
+        )
+        self.random_condition(collection)
+        rules.clear_plans()
+
+        rules.get_plan(collection)
+        rules.get_plan(collection)
+        rules.get_plan(collection)
+
+        stats = rules.plans.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_plan_cache_evicts_least_recently_used(self):
+        cache = rules.PlanCache(maxsize=2)
+        collections = []
+        for title in ('A', 'B', 'C'):
+            collection = Collection.objects.create(
+                title=title,
+                store=self.store,
+                user=self.user
+            )
+            collections.append(collection)
+            cache.put(rules.compile_collection(collection))
+            cache.get(collections[0])
+
+        self.assertIsNotNone(cache.get(collections[0]))
+        self.assertIsNone(cache.get(collections[1]))
+        self.assertIsNotNone(cache.get(collections[2]))
@@ -0,0 +1,115 @@
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Store, Product
+from core.stores import resolve_store_id
+
+
+def sample_user(email='tmp_user@cinolabs.com', password='testpass'):
+    return get_user_model().objects.create_user(email, password)
+
+
+def sample_store(user, title='Main Store'):
+    return Store.objects.create(
+        user=user,
+        title=title
+    )
+
+
+class StoreResolverTests(TestCase):
+
+    def setUp(self):
+        caches[settings.STORE_CACHE['ALIAS']].clear()
+        self.user = sample_user()
+        self.store = sample_store(self.user)
+
+    def test_resolve_is_cached(self):
+        self.assertEqual(resolve_store_id(self.store.slug), self.store.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                resolve_store_id(self.store.slug),
+                self.store.id
+            )
+
+    def test_unknown_slug(self):
+        self.assertIsNone(resolve_store_id('unknown'))
+
+        other = sample_store(self.user, title='Unknown')
+        self.assertEqual(resolve_store_id('unknown'), other.id)
+
+    def test_renamed_store_forgets_previous_slug(self):
+        previous = self.store.slug
+        resolve_store_id(previous)
+
+        self.store.title = 'Renamed Store'
+        self.store.save()
+
+        self.assertIsNone(resolve_store_id(previous))
+        self.assertEqual(resolve_store_id('renamed-store'), self.store.id)
+
+    def test_deleted_store_is_forgotten(self):
+        slug = self.store.slug
+        resolve_store_id(slug)
+
+        self.store.delete()
+
+        self.assertIsNone(resolve_store_id(slug))
+
+    def test_slug_expires(self):
+        """Workers whose cache was not cleared see a rename in the end"""
+        slug = self.store.slug
+        now = time.time()
+        resolve_store_id(slug)
+
+        # renamed by another worker
+        Store.objects.filter(id=self.store.id).update(slug='renamed-store')
+        with mock.patch('time.time', return_value=now + 30):
+            self.assertEqual(resolve_store_id(slug), self.store.id)
+        with mock.patch('time.time', return_value=now + 61):
+            self.assertIsNone(resolve_store_id(slug))
+
+    def test_store_scoped_queries_do_not_join_store(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        Product.objects.create(
+            title='Sample Product',
+            price=5.00,
+            stock=3,
+            store=self.store,
+            user=self.user
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            res = client.post(reverse(
+                'commerce:cart-list',
+                args=[self.store.slug]
+            ))
+            client.get(reverse(
+                'commerce:shipping-list',
+                args=[self.store.slug]
+            ))
+            client.get(reverse(
+                'store:collection-list',
+                args=[self.store.slug]
+            ))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        for query in context.captured_queries:
+            self.assertNotIn('JOIN "core_store"', query['sql'])
+
+    def test_unknown_store_cart_is_not_found(self):
+        res = APIClient().post(reverse('commerce:cart-list', args=['nope']))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
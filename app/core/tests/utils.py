@@ -0,0 +1,23 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """Assert that a block of code stays within a number of queries"""
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with CaptureQueriesContext(connection) as ctx:
+            yield ctx
+        executed = len(ctx.captured_queries)
+        self.assertLessEqual(
+            executed,
+            budget,
+            '{} queries executed, budget is {}:\n{}'.format(
+                executed,
+                budget,
+                '\n'.join(q['sql'] for q in ctx.captured_queries)
+            )
+        )
@@ -0,0 +1,120 @@
+"""
+Token bucket throttles for the store endpoints.
+
+A bucket holds up to N tokens for a rate of 'N/period' and refills at
+N tokens per period, so clients may burst N requests then keep to the
+rate. Authenticated requests are counted per user, anonymous ones per
+client IP, in separate buckets for each scope and store. The client IP is
+REMOTE_ADDR, behind CART_THROTTLE['NUM_PROXIES'] reverse proxies it is the
+address the outermost of them appended to X-Forwarded-For; the rest of
+that header is sent by the client and never trusted.
+
+A token is taken under a lock on its bucket, an entry added to the cache
+with cache.add(), so parallel requests can not all read a full bucket.
+
+Buckets live in the Django cache named by settings.CART_THROTTLE['ALIAS'],
+locmem keeps them per process, a shared backend such as Redis or
+Memcached makes the limits hold across every worker.
+
+Views list the scope of each action in `throttle_scopes`, the rates come
+from CART_THROTTLE['RATES'] and can be overridden for a store slug in
+CART_THROTTLE['STORES']. Actions without a scope or rate are not limited.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from rest_framework.throttling import BaseThrottle
+
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+# a bucket stays locked this long at most if its request dies holding it
+LOCK_TIMEOUT = 1
+# parallel requests of a client wait for the lock this many times
+LOCK_ATTEMPTS = 20
+LOCK_WAIT = .005
+
+
+def get_cache():
+    return caches[settings.CART_THROTTLE['ALIAS']]
+
+
+def parse_rate(rate):
+    """'30/min' as (30 tokens, refilled at 0.5 tokens per second)"""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / DURATIONS[period[0]]
+
+
+def get_rate(scope, kind, store_slug=None):
+    """The rate of anon or user requests of a scope, None if unlimited"""
+    config = settings.CART_THROTTLE
+    rates = dict(config['RATES'].get(scope, {}))
+    rates.update(config.get('STORES', {}).get(store_slug, {}).get(scope, {}))
+    return rates.get(kind)
+
+
+class TokenBucketThrottle(BaseThrottle):
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scopes', {}).get(view.action)
+        return self.allow_scope(request, view, scope)
+
+    def allow_scope(self, request, view, scope):
+        """Take a token of scope, also for work done outside its action"""
+        self.delay = None
+        if scope is None:
+            return True
+
+        store_slug = view.kwargs.get('store')
+        if request.user.is_authenticated:
+            kind, ident = 'user', request.user.pk
+        else:
+            kind, ident = 'anon', self.get_ident(request)
+        rate = get_rate(scope, kind, store_slug)
+        if rate is None:
+            return True
+
+        key = f'throttle:{scope}:{store_slug}:{kind}:{ident}'
+        return self.consume(key, *parse_rate(rate))
+
+    def get_ident(self, request):
+        """The client IP, X-Forwarded-For is only read behind proxies"""
+        num_proxies = settings.CART_THROTTLE.get('NUM_PROXIES', 0)
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if num_proxies and forwarded:
+            addrs = [addr.strip() for addr in forwarded.split(',')]
+            return addrs[-min(num_proxies, len(addrs))]
+        return request.META.get('REMOTE_ADDR')
+
+    def consume(self, key, capacity, refill):
+        """Take a token from the bucket, refilled for the time elapsed"""
+        cache = get_cache()
+        lock = f'{key}:lock'
+        for _ in range(LOCK_ATTEMPTS):
+            if cache.add(lock, 1, LOCK_TIMEOUT):
+                break
+            time.sleep(LOCK_WAIT)
+        else:
+            # too many parallel requests of one client, let them retry
+            self.delay = 1 / refill
+            return False
+
+        try:
+            now = time.time()
+            tokens, stamp = cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * refill)
+            if tokens < 1:
+                self.delay = (1 - tokens) / refill
+                return False
+
+            # a bucket left alone this long is full again, let the entry go
+            cache.set(key, (tokens - 1, now), capacity / refill)
+            return True
+        finally:
+            cache.delete(lock)
+
+    def wait(self):
+        return self.delay
@@ -0,0 +1,100 @@
+"""
+Response cache for the public store endpoints.
+
+Responses are cached per store, keyed by host, path and query parameters,
+in the Django cache named by settings.STORE_CACHE['ALIAS'] (locmem unless
+configured otherwise, any backend with get/set/add works, e.g. Redis).
+
+Each store has a generation token that is part of every key. Changing the
+catalogue of a store replaces its token, which invalidates all of its
+cached responses at once without having to find their keys.
+"""
+import functools
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import urlencode
+
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[settings.STORE_CACHE['ALIAS']]
+
+
+def _generation_key(store_slug):
+    return f'store-response:{store_slug}:generation'
+
+
+def get_generation(store_slug):
+    key = _generation_key(store_slug)
+    cache = get_cache()
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def invalidate_store(store_slug):
+    """Drop every cached response of a store"""
+    get_cache().set(_generation_key(store_slug), uuid.uuid4().hex, None)
+
+
+def response_key(store_slug, request):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    resource = f'{request.get_host()}{request.path}?{query}'
+    return 'store-response:{}:{}:{}'.format(
+        store_slug,
+        get_generation(store_slug),
+        hashlib.md5(resource.encode('utf-8')).hexdigest()
+    )
+
+
+def etag_for(data):
+    content = JSONRenderer().render(data)
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or any(
+        tag == etag or tag == f'W/{etag}' for tag in candidates
+    )
+
+
+def cached_store_response(view_method):
+    """
+    Cache the data of a successful store scoped GET response and answer
+    requests carrying a matching If-None-Match with 304 Not Modified.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return view_method(self, request, *args, **kwargs)
+
+        cache = get_cache()
+        key = response_key(self.kwargs['store'], request)
+        entry = cache.get(key)
+        if entry is None:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = (response.data, etag_for(response.data))
+            cache.set(key, entry, settings.STORE_CACHE['TIMEOUT'])
+
+        data, etag = entry
+        if etag_matches(request, etag):
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED,
+                headers={'ETag': etag}
+            )
+        return Response(data, headers={'ETag': etag})
+    return wrapper
@@ -0,0 +1,186 @@
+"""
+File downloads with HTTP Range and conditional requests.
+
+The response is validated by an ETag and Last-Modified, so If-None-Match,
+If-Modified-Since and the other preconditions are answered without
+sending the file, and a single byte range is served as 206 Partial
+Content. If-Range falls back to the whole file when it does not match.
+
+How the bytes are sent depends on settings.ATTACHMENT_DOWNLOADS['SENDFILE']:
+
+ - 'x-accel-redirect' hands the file to nginx, from the internal location
+   ACCEL_PREFIX aliased to MEDIA_ROOT; nginx serves the range itself.
+ - 'x-sendfile' hands the absolute path to Apache mod_xsendfile or
+   lighttpd.
+ - None streams a FileResponse over the open file. WSGI servers with a
+   file_wrapper using sendfile (e.g. gunicorn) send it without copying
+   it through Python, others read it by blocks, never past the range.
+   A view never holds the client socket, so sendfile is left to them.
+
+Attachments are only downloaded this way: the blobs of attachments are not
+served from MEDIA_URL, see serve_media, so the web server in front must
+not serve the blobs directory of MEDIA_ROOT either.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views import static
+
+from core.models import ProductAttachment, ProductImage
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """A file read from start for length bytes, for FileResponse"""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive of a single byte range header, None to send
+    the whole file, or False when the range can not be satisfied
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        # several ranges or a malformed header, send the whole file
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if not suffix:
+            return False
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def content_disposition(filename):
+    """The header FileResponse sets for an attachment named filename"""
+    try:
+        filename.encode('ascii')
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+def file_etag(value, modified, size):
+    """The digest of a blob, the modification time and size otherwise"""
+    prefix = settings.MEDIA_BLOBS['PREFIX'] + '/'
+    if value.name.startswith(prefix):
+        return quote_etag(os.path.splitext(os.path.basename(value.name))[0])
+    return quote_etag(f'{int(modified)}-{size}')
+
+
+def _if_range_matches(request, etag, modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(modified)
+
+
+def serve(request, value, filename):
+    """The response downloading a file field value as filename"""
+    storage = value.storage
+    size = storage.size(value.name)
+    modified = storage.get_modified_time(value.name).timestamp()
+    etag = file_etag(value, modified, size)
+
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(modified)
+    )
+    if response is not None:
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and \
+            _if_range_matches(request, etag, modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    sendfile = settings.ATTACHMENT_DOWNLOADS['SENDFILE']
+    if sendfile:
+        response = HttpResponse(content_type=(
+            mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        ))
+        response['Content-Disposition'] = content_disposition(filename)
+        if sendfile == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = (
+                settings.ATTACHMENT_DOWNLOADS['ACCEL_PREFIX'] + value.name
+            )
+        else:
+            response['X-Sendfile'] = storage.path(value.name)
+    else:
+        file = storage.open(value.name, 'rb')
+        if byte_range is None:
+            response = FileResponse(
+                RangeFile(file, 0, size),
+                as_attachment=True,
+                filename=filename
+            )
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            response = FileResponse(
+                RangeFile(file, start, end - start + 1),
+                as_attachment=True,
+                filename=filename,
+                status=206
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.block_size = 64 * 1024
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    return response
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve for MEDIA_URL, except the blobs of
+    attachments, which are only downloaded after the store checks
+    """
+    name = posixpath.normpath(path).lstrip('/')
+    # a blob is content addressed, public when an image has the same content
+    if ProductAttachment.objects.filter(file=name).exists() and \
+            not ProductImage.objects.filter(image=name).exists():
+        raise Http404
+    return static.serve(request, path, document_root, show_indexes)
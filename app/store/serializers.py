@@ -1,27 +1,44 @@
+from collections import OrderedDict
+
+import functools
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
 from rest_framework import serializers
 from core.models import Store, Product, ProductType, Collection, \
                         ProductImage, ProductAttachment
+from core import blobs
+from core.images import schedule as schedule_variants, variant_urls
+from store import cache
 
 
 class StringListField(serializers.ListField):
     child = serializers.CharField()
 
     def to_representation(self, data):
-        return ' '.join(data.values_list('name', flat=True))
+        # iterate all() so that prefetched tags are used, sorted as the
+        # prefetched and queried tags do not come in the same order
+        return ' '.join(sorted(tag.name for tag in data.all()))
 
 
 class StoreSerializer(serializers.ModelSerializer):
     """"Serialize a recipe"""
+    logo_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Store
         lookup_field = 'slug'
 
         fields = (
-            'title', 'logo', 'slug',
+            'title', 'logo', 'logo_variants', 'slug',
         )
         read_only_fields = ('id', 'logo',)
 
+    def get_logo_variants(self, obj):
+        return variant_urls(obj.logo, self.context.get('request'))
+
 
 class StoreImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading the logo to the store"""
@@ -54,6 +71,13 @@ class ProductSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('id',)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load the store, type and tags of all products in bulk"""
+        return queryset.select_related(
+            'store', 'type'
+        ).prefetch_related('tags')
+
 
 class SimpleProductSerializer(serializers.ModelSerializer):
 
@@ -65,6 +89,81 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+price_field = serializers.DecimalField(max_digits=20, decimal_places=2)
+
+
+def file_url(value, request=None):
+    """Represent a file the way a DRF FileField does"""
+    if not value:
+        return None
+    try:
+        url = value.url
+    except AttributeError:
+        return None
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class FastProductSerializer(serializers.BaseSerializer):
+    """
+    Read only ProductSerializer building its output directly from a
+    product whose store, type and tags are loaded, without the per field
+    dispatch of a ModelSerializer. Enabled by settings.FAST_SERIALIZERS.
+    """
+    setup_eager_loading = staticmethod(ProductSerializer.setup_eager_loading)
+
+    def to_representation(self, product):
+        store = product.store
+        product_type = product.type
+        return OrderedDict((
+            ('id', product.id),
+            ('title', str(product.title)),
+            ('body', str(product.body)),
+            ('store', OrderedDict((
+                ('title', str(store.title)),
+                ('logo', file_url(store.logo, self.context.get('request'))),
+                ('logo_variants', variant_urls(
+                    store.logo,
+                    self.context.get('request')
+                )),
+                ('slug', str(store.slug)),
+            ))),
+            ('fulfillment', product.fulfillment),
+            ('taxable', bool(product.taxable)),
+            ('price', price_field.to_representation(product.price)),
+            ('stock', int(product.stock)),
+            ('length', float(product.length)),
+            ('purchased', int(product.purchased)),
+            ('tags', ' '.join(
+                sorted(tag.name for tag in product.tags.all())
+            )),
+            ('type', OrderedDict((
+                ('id', product_type.id),
+                ('name', str(product_type.name)),
+            )) if product_type is not None else None),
+        ))
+
+
+class FastSimpleProductSerializer(serializers.BaseSerializer):
+    """Read only SimpleProductSerializer, see FastProductSerializer"""
+
+    def to_representation(self, product):
+        return OrderedDict((
+            ('id', product.id),
+            ('title', str(product.title)),
+            ('taxable', bool(product.taxable)),
+            ('price', price_field.to_representation(product.price)),
+            ('length', float(product.length)),
+        ))
+
+
+def product_serializer_class():
+    if settings.FAST_SERIALIZERS:
+        return FastProductSerializer
+    return ProductSerializer
+
+
 class CollectionSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -75,6 +174,11 @@ class CollectionSerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading product images"""
+    variants = serializers.SerializerMethodField()
+
+    def get_variants(self, obj):
+        return variant_urls(obj.image, self.context.get('request'))
+
     def create(self, validated_data):
         product = Product.objects.get(
             pk=self.context["view"].kwargs["product_pk"]
@@ -85,14 +189,87 @@ class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
         fields = (
-            'id', 'title', 'product', 'image',
+            'id', 'title', 'product', 'image', 'variants',
             'is_primary', 'created_at'
         )
         read_only_fields = ('id', 'created_at', 'product')
 
 
+class ProductImageBulkSerializer(serializers.Serializer):
+    """
+    Serializer for uploading many images of a product at once, the product
+    comes from the context. The rows are inserted with one bulk_create and
+    with is_primary the first image becomes the primary one.
+    """
+    images = serializers.ListField(
+        child=serializers.ImageField(),
+        allow_empty=False,
+        max_length=100
+    )
+    is_primary = serializers.BooleanField(default=False)
+
+    def create(self, validated_data):
+        product = self.context['product']
+        title_length = ProductImage._meta.get_field('title').max_length
+        created = []
+        for upload in validated_data['images']:
+            image = ProductImage(
+                product=product,
+                title=os.path.splitext(upload.name)[0][:title_length]
+            )
+            # stored before the transaction, the blob of a rolled back
+            # upload is deleted by collect_media_blobs --orphans
+            image.image.save(upload.name, upload, save=False)
+            created.append(image)
+
+        # bulk_create sends no signals, maintain the blob references, the
+        # primary and the cache and render the variants here
+        first = created[0]
+        first.is_primary = validated_data['is_primary']
+        with transaction.atomic():
+            if first.is_primary:
+                ProductImage.lock_product(product.id)
+                ProductImage.unset_primary(product.id)
+            ProductImage.objects.bulk_create(created)
+            blobs.acquire([image.image.name for image in created])
+            if not first.is_primary:
+                first.claim_primary()
+        slug = product.store.slug
+        cache.invalidate_store(slug)
+        for image in created:
+            schedule_variants(
+                image.image, functools.partial(cache.invalidate_store, slug)
+            )
+        return created
+
+
+class AttachmentFileField(serializers.FileField):
+    """
+    Uploads the file and links the download action, the blob itself is not
+    served from MEDIA_URL
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = reverse(
+            'store:product-attachments-download',
+            args=[
+                self.context['view'].kwargs['store'],
+                value.instance.product_id,
+                value.instance.id
+            ]
+        )
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class ProductAttachmentSerializer(serializers.ModelSerializer):
     """Serializer for uploading product images"""
+    file = AttachmentFileField()
+
     def create(self, validated_data):
         product = Product.objects.get(
             pk=self.context["view"].kwargs["product_pk"]
@@ -1,5 +1,4 @@
-from core.models import Condition
-from django.db.models import Q
+from core import rules
 
 
 class CollectionService:
@@ -12,32 +11,11 @@ class CollectionService:
 
     def get_products_filter(self):
         """
-        Put simply, this method will loop through all conditions on a
-        Collection and dynamically build the filter query to find products.
+        Return the Q object selecting the products of the collection.
 
-        Using the Condition Model and the constant _CHOICES variable, it will
-        do the following:
-
-        Loop all conditions on the Collection:
-            Find the record in the Condition._CHOICE
-            Build the filter List
-                {f"{tag__name}{__contains}: 'Disney'"}
+        The conditions are compiled by core.rules, which groups them by
+        field_reference (OR within a field) and combines the groups with
+        the collection type. The compiled plan is cached until the
+        conditions or the collection type change.
         """
-        query = Q()
-        conditions = Condition.objects.prefetch_related('collection').filter(
-            collection__id=self.instance.id
-        )
-
-        for c in conditions:
-            choice = next(item for item in Condition._CHOICES
-                          if item["key"] == c.field_reference)
-            if choice:
-                dynamic_filter = {
-                    f"{choice['field']}"
-                    f"{choice['choices'][c.filter_type]['match']}": c.field_val
-                }
-                if choice['choices'][c.filter_type]['negation']:
-                    query.add(~Q(dynamic_filter), self.instance.type)
-                else:
-                    query.add(Q(dynamic_filter), self.instance.type)
-        return query
+        return rules.get_plan(self.instance).query
@@ -1,101 +1,255 @@
 # post_save and post_delete
-from core import models
-from django.db.models.signals import post_save, post_delete
+import functools
+
+from core import blobs, images, inventory, models, membership, stores
+from store import cache
+from django.db.models.signals import post_save, post_delete, pre_delete, \
+                                     pre_save, m2m_changed
 from django.dispatch import receiver
-from django.db.models import Count, Q
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F
 
 
-@receiver(post_save, sender=models.ProductImage)
-def update_primary(sender, instance, created, **kwargs):
+# Keep one primary image and attachment per product, see PrimaryFileMixin.
+# Each save costs a single conditional UPDATE on top of its own write.
+
+@receiver(pre_save, sender=models.ProductImage)
+@receiver(pre_save, sender=models.ProductAttachment)
+def unset_other_primary(sender, instance, **kwargs):
+    """The primary being saved takes the flag from the others"""
     if instance.is_primary:
-        models.ProductImage.objects.filter(
-            product__id=instance.product.id,
-            is_primary=True
-        ).exclude(
-            id=instance.id
-        ).update(
-            is_primary=False
-        )
-    else:
-        alternate_primary = models.ProductImage.objects.filter(
-            product__id=instance.product.id,
-            is_primary=True
-        ).exclude(
-            id=instance.id
-        ).count()
-        if not alternate_primary:
-            instance.is_primary = True
-            post_save.disconnect(update_primary, sender=models.ProductImage)
-            instance.save()
-            post_save.connect(update_primary, sender=models.ProductImage)
+        sender.unset_primary(instance.product_id, keep=instance.id)
+
+
+@receiver(post_save, sender=models.ProductImage)
+@receiver(post_save, sender=models.ProductAttachment)
+def claim_primary(sender, instance, **kwargs):
+    if not instance.is_primary:
+        instance.claim_primary()
 
 
 @receiver(post_delete, sender=models.ProductImage)
-def update_alternative_is_primary(sender, instance, **kwargs):
-    q = models.ProductImage.objects.filter(
-        product__id=instance.product.id
-    ).annotate(
-        total=Count('id', distinct=True)
-    ).annotate(
-        primary=Count('is_primary', filter=Q(is_primary=True), distinct=True)
-    )
-    if q and q[0].total and not q[0].primary:
-        post_save.disconnect(update_primary, sender=models.ProductImage)
-        pi = models.ProductImage.objects.filter(
-            product__id=instance.product.id
-        )[:1].get()
-        pi.is_primary = True
-        pi.save()
-        post_save.connect(update_primary, sender=models.ProductImage)
+@receiver(post_delete, sender=models.ProductAttachment)
+def promote_primary(sender, instance, **kwargs):
+    if instance.is_primary:
+        sender.promote_primary(instance.product_id)
+
+
+BLOB_FIELDS = {
+    models.ProductImage: 'image',
+    models.ProductAttachment: 'file',
+}
 
 
+@receiver(pre_save, sender=models.ProductImage)
+@receiver(pre_save, sender=models.ProductAttachment)
+def detect_blob_upload(sender, instance, **kwargs):
+    """An upload takes a blob, and gives back the one it replaces"""
+    field = BLOB_FIELDS[sender]
+    value = getattr(instance, field)
+    instance._blob_uploaded = bool(value) and not value._committed
+    instance._blob_replaced = None
+    if instance._blob_uploaded and instance.pk:
+        instance._blob_replaced = sender.objects.filter(
+            pk=instance.pk
+        ).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=models.ProductImage)
 @receiver(post_save, sender=models.ProductAttachment)
-def update_primary_attachment(sender, instance, created, **kwargs):
-    if instance.is_primary:
-        models.ProductAttachment.objects.filter(
-            product__id=instance.product.id,
-            is_primary=True
-        ).exclude(
-            id=instance.id
-        ).update(
-            is_primary=False
+def count_blob_references(sender, instance, **kwargs):
+    if getattr(instance, '_blob_uploaded', False):
+        instance._blob_uploaded = False
+        blobs.acquire([getattr(instance, BLOB_FIELDS[sender]).name])
+        if instance._blob_replaced:
+            blobs.release([instance._blob_replaced])
+
+
+@receiver(post_delete, sender=models.ProductImage)
+@receiver(post_delete, sender=models.ProductAttachment)
+def release_blob(sender, instance, **kwargs):
+    blobs.release([getattr(instance, BLOB_FIELDS[sender]).name])
+
+
+IMAGE_FIELDS = {
+    models.Store: 'logo',
+    models.Collection: 'image',
+    models.ProductImage: 'image',
+}
+
+
+@receiver(pre_save, sender=models.Store)
+@receiver(pre_save, sender=models.Collection)
+@receiver(pre_save, sender=models.ProductImage)
+def detect_image_upload(sender, instance, **kwargs):
+    """A file not committed yet is stored by this save"""
+    value = getattr(instance, IMAGE_FIELDS[sender])
+    instance._image_uploaded = bool(value) and not value._committed
+
+
+@receiver(post_save, sender=models.Store)
+@receiver(post_save, sender=models.Collection)
+@receiver(post_save, sender=models.ProductImage)
+def render_image_variants(sender, instance, **kwargs):
+    """Render once committed, then drop the responses without the variants"""
+    if getattr(instance, '_image_uploaded', False):
+        instance._image_uploaded = False
+        if sender is models.Store:
+            slug = instance.slug
+        else:
+            store_id = instance.store_id if sender is models.Collection \
+                else instance.product.store_id
+            slug = models.Store.objects.values_list(
+                'slug', flat=True
+            ).get(id=store_id)
+        images.schedule(
+            getattr(instance, IMAGE_FIELDS[sender]),
+            functools.partial(cache.invalidate_store, slug)
         )
-    else:
-        alternate_primary = models.ProductAttachment.objects.filter(
-            product__id=instance.product.id,
-            is_primary=True
-        ).exclude(
-            id=instance.id
-        ).count()
-        if not alternate_primary:
-            instance.is_primary = True
-            post_save.disconnect(
-                update_primary_attachment, sender=models.ProductAttachment
-            )
-            instance.save()
-            post_save.connect(
-                update_primary_attachment, sender=models.ProductAttachment
-            )
 
 
+@receiver(post_save, sender=models.Condition)
+@receiver(post_delete, sender=models.Condition)
+def bump_conditions_revision(sender, instance, **kwargs):
+    """Invalidate the compiled plan and rebuild the collection"""
+    models.Collection.objects.filter(
+        id=instance.collection_id
+    ).update(
+        conditions_revision=F('conditions_revision') + 1
+    )
+    if models.Condition.collection.is_cached(instance):
+        instance.collection.conditions_revision += 1
+
+    collection = models.Collection.objects.filter(
+        id=instance.collection_id
+    ).first()
+    if collection:
+        membership.rebuild_collection(collection)
+
+
+@receiver(post_save, sender=models.Collection)
+def rebuild_collection(sender, instance, created, **kwargs):
+    if not created:
+        membership.rebuild_collection(instance)
+
+
+@receiver(pre_delete, sender=models.Collection)
+def begin_collection_delete(sender, instance, **kwargs):
+    membership.begin_delete(instance)
+
+
+@receiver(post_delete, sender=models.Collection)
+def end_collection_delete(sender, instance, **kwargs):
+    membership.end_delete(instance)
+
+
+@receiver(pre_save, sender=models.Product)
+def detect_stock_change(sender, instance, **kwargs):
+    """A sharded product whose stock changes needs its buckets refilled"""
+    instance._stock_changed = bool(instance.pk) and sender.objects.filter(
+        pk=instance.pk,
+        stock_buckets__isnull=False
+    ).exclude(
+        stock=instance.stock
+    ).exists()
+
+
+@receiver(post_save, sender=models.Product)
+def rebalance_stock_buckets(sender, instance, **kwargs):
+    if getattr(instance, '_stock_changed', False):
+        instance._stock_changed = False
+        inventory.rebalance(instance)
+
+
+@receiver(post_save, sender=models.Product)
+def refresh_product_membership(sender, instance, **kwargs):
+    membership.refresh_product(instance)
+
+
+@receiver(m2m_changed, sender=models.Product.tags.through)
+def refresh_product_tags_membership(sender, instance, action, **kwargs):
+    if isinstance(instance, models.Product) and \
+            action in ('post_add', 'post_remove', 'post_clear'):
+        membership.refresh_product(instance)
+
+
+@receiver(post_save, sender=models.ProductType)
+@receiver(post_delete, sender=models.ProductType)
+def refresh_product_type_membership(sender, instance, **kwargs):
+    membership.refresh_product_type(instance)
+
+
+def _invalidate_stores(store_ids):
+    """Drop the cached responses of the stores, store_ids can be a subquery"""
+    stores = models.Store.objects.filter(id__in=store_ids)
+    for slug in stores.values_list('slug', flat=True):
+        cache.invalidate_store(slug)
+
+
+@receiver(pre_save, sender=models.Store)
+def invalidate_renamed_store_cache(sender, instance, **kwargs):
+    """Nothing cached under a previous slug must be served anymore"""
+    if instance.pk:
+        previous = models.Store.objects.filter(
+            id=instance.pk
+        ).values_list('slug', flat=True).first()
+        if previous and previous != instance.slug:
+            cache.invalidate_store(previous)
+            stores.forget_store(previous)
+
+
+@receiver(post_save, sender=models.Store)
+@receiver(post_delete, sender=models.Store)
+def invalidate_store_cache(sender, instance, **kwargs):
+    cache.invalidate_store(instance.slug)
+    stores.forget_store(instance.slug)
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_delete, sender=models.Product)
+@receiver(post_save, sender=models.Collection)
+@receiver(post_delete, sender=models.Collection)
+@receiver(post_save, sender=models.ProductType)
+@receiver(post_delete, sender=models.ProductType)
+def invalidate_catalogue_cache(sender, instance, **kwargs):
+    _invalidate_stores([instance.store_id])
+
+
+@receiver(post_save, sender=models.ProductImage)
+@receiver(post_delete, sender=models.ProductImage)
+@receiver(post_save, sender=models.ProductAttachment)
 @receiver(post_delete, sender=models.ProductAttachment)
-def update_alternative_attachment_is_primary(sender, instance, **kwargs):
-    q = models.ProductAttachment.objects.filter(
-        product__id=instance.product.id
-    ).annotate(
-        total=Count('id', distinct=True)
-    ).annotate(
-        primary=Count('is_primary', filter=Q(is_primary=True), distinct=True)
+def invalidate_product_file_cache(sender, instance, **kwargs):
+    _invalidate_stores(
+        models.Product.objects.filter(
+            id=instance.product_id
+        ).values('store_id')
     )
-    if q and q[0].total and not q[0].primary:
-        post_save.disconnect(
-            update_primary_attachment, sender=models.ProductAttachment
-        )
-        pi = models.ProductAttachment.objects.filter(
-            product__id=instance.product.id
-        )[:1].get()
-        pi.is_primary = True
-        pi.save()
-        post_save.connect(
-            update_primary_attachment, sender=models.ProductAttachment
+
+
+@receiver(post_save, sender=models.Condition)
+@receiver(post_delete, sender=models.Condition)
+def invalidate_condition_cache(sender, instance, **kwargs):
+    _invalidate_stores(
+        models.Collection.objects.filter(
+            id=instance.collection_id
+        ).values('store_id')
+    )
+
+
+@receiver(post_save, sender=models.Product.tags.through)
+@receiver(post_delete, sender=models.Product.tags.through)
+def invalidate_product_tag_cache(sender, instance, **kwargs):
+    product_type = ContentType.objects.get_for_model(models.Product)
+    if instance.content_type_id == product_type.id:
+        _invalidate_stores(
+            models.Product.objects.filter(
+                id=instance.object_id
+            ).values('store_id')
         )
+
+
+@receiver(pre_delete, sender=models.Cart)
+def release_cart_reservations(sender, instance, **kwargs):
+    """Give back the units held by a cart before it is deleted"""
+    inventory.release(instance.reservations.all())
@@ -6,6 +6,7 @@ from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Store, Product, Collection, Condition, ProductType
+from core.tests.utils import QueryBudgetMixin
 from store import serializers
 
 
@@ -88,7 +89,7 @@ class PublicCollectionApiTests(TestCase):
         serializer = serializers.CollectionSerializer(collection)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer.data, res.data)
+        self.assertIn(serializer.data, res.data['results'])
 
     def test_get_products_by_collection_any(self):
         owner = sample_user()
@@ -113,9 +114,9 @@ class PublicCollectionApiTests(TestCase):
         serializer_notin1 = serializers.ProductSerializer(product3)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer_in1.data, res.data)
-        self.assertIn(serializer_in2.data, res.data)
-        self.assertNotIn(serializer_notin1.data, res.data)
+        self.assertIn(serializer_in1.data, res.data['results'])
+        self.assertIn(serializer_in2.data, res.data['results'])
+        self.assertNotIn(serializer_notin1.data, res.data['results'])
 
     def test_get_products_by_collection_all(self):
         owner = sample_user()
@@ -140,9 +141,9 @@ class PublicCollectionApiTests(TestCase):
         serializer_notin1 = serializers.ProductSerializer(product3)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer_in1.data, res.data)
-        self.assertIn(serializer_in2.data, res.data)
-        self.assertNotIn(serializer_notin1.data, res.data)
+        self.assertIn(serializer_in1.data, res.data['results'])
+        self.assertIn(serializer_in2.data, res.data['results'])
+        self.assertNotIn(serializer_notin1.data, res.data['results'])
 
     def test_get_products_by_collection_type(self):
         owner = sample_user()
@@ -188,9 +189,9 @@ class PublicCollectionApiTests(TestCase):
         serializer_notin2 = serializers.ProductSerializer(product3)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer_in1.data, res.data)
-        self.assertIn(serializer_in2.data, res.data)
-        self.assertNotIn(serializer_notin2.data, res.data)
+        self.assertIn(serializer_in1.data, res.data['results'])
+        self.assertIn(serializer_in2.data, res.data['results'])
+        self.assertNotIn(serializer_notin2.data, res.data['results'])
 
         collection.type = Collection.ALL
         collection.save()
@@ -205,9 +206,9 @@ class PublicCollectionApiTests(TestCase):
         serializer_notin2 = serializers.ProductSerializer(product3)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer_in1.data, res.data)
-        self.assertIn(serializer_in2.data, res.data)
-        self.assertNotIn(serializer_notin2.data, res.data)
+        self.assertIn(serializer_in1.data, res.data['results'])
+        self.assertIn(serializer_in2.data, res.data['results'])
+        self.assertNotIn(serializer_notin2.data, res.data['results'])
 
     def test_get_products_by_collection_complex(self):
         owner = sample_user()
@@ -268,9 +269,9 @@ class PublicCollectionApiTests(TestCase):
         serializer3 = serializers.ProductSerializer(product3)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
 
         collection.type = Collection.ANY
         collection.save()
@@ -285,6 +286,41 @@ class PublicCollectionApiTests(TestCase):
         serializer3 = serializers.ProductSerializer(product3)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
+
+
+class CollectionQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    def test_collection_product_list_budget(self):
+        client = APIClient()
+        owner = sample_user()
+        store = sample_store(owner)
+        product_type = ProductType.objects.create(
+            name='Quilting Cotton',
+            store=store,
+            user=owner
+        )
+        collection = sample_collection(owner, store)
+        sample_condition(collection, field_val='Disney')
+        url = product_by_collection_url(store.slug, collection.id)
+
+        for count in (1, 10, 20):
+            for i in range(count):
+                product = sample_product(
+                    owner,
+                    store,
+                    title=f'Product {Product.objects.count()}',
+                    type=product_type
+                )
+                product.tags.add('Disney', f'tag {i}')
+
+            with self.assertMaxQueries(4):
+                res = client.get(url)
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                len(res.data['results']),
+                min(Product.objects.count(), 24)
+            )
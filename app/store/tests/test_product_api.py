@@ -1,18 +1,39 @@
+from base64 import urlsafe_b64encode
+import json
 import os
+import re
+import shutil
 import tempfile
+import threading
+from unittest import mock
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, IntegrityError, connection, \
+                      transaction
+from django.http import Http404
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from taggit.models import Tag, TaggedItem
 
+from core import images
+from core.pagination import KeysetPagination
+from core.tests.utils import QueryBudgetMixin
 from core.models import Store, Product, ProductType, ProductImage, \
                          ProductAttachment
-from store import serializers
+from store import downloads, serializers
+from store.cache import get_cache, invalidate_store
 
 
 def image_upload_url(store, product_pk):
@@ -84,7 +105,7 @@ class PublicProductApiTests(TestCase):
         serializer = serializers.ProductSerializer(product1)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer.data, res.data)
+        self.assertIn(serializer.data, res.data['results'])
 
     def test_list_products_by_tags(self):
         owner = sample_user()
@@ -106,8 +127,8 @@ class PublicProductApiTests(TestCase):
         serializer2 = serializers.ProductSerializer(product3)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn(serializer.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_get_products_with_type(self):
         owner = sample_user()
@@ -133,6 +154,280 @@ class PublicProductApiTests(TestCase):
         self.assertEqual(res.data, serializer.data)
 
 
+class ProductQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Listing products takes the same queries whatever their number"""
+    budget = 4
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = sample_user()
+        self.store = sample_store(self.owner)
+        self.product_type = ProductType.objects.create(
+            name='Quilting Cotton',
+            store=self.store,
+            user=self.owner
+        )
+
+    def add_products(self, count):
+        for i in range(count):
+            product = sample_product(
+                self.owner,
+                self.store,
+                title=f'Product {Product.objects.count()}',
+                type=self.product_type
+            )
+            product.tags.add('fabric', f'tag {i}')
+
+    def test_product_list_budget(self):
+        for count in (1, 10, 20):
+            self.add_products(count)
+
+            with self.assertMaxQueries(self.budget):
+                res = self.client.get(product_url(self.store.slug))
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertTrue(all(p['tags'] for p in res.data['results']))
+
+    def test_product_list_by_tags_budget(self):
+        self.add_products(20)
+
+        with self.assertMaxQueries(self.budget):
+            res = self.client.get(
+                product_url(self.store.slug),
+                {'tags': 'fabric'}
+            )
+
+        self.assertEqual(len(res.data['results']), 20)
+
+
+class FastSerializerParityTests(TestCase):
+    """The fast serializers must render exactly the same bytes"""
+
+    def setUp(self):
+        owner = sample_user()
+        self.store = sample_store(owner)
+        self.store.logo = 'uploads/store/logo.png'
+        self.store.save()
+        product_type = ProductType.objects.create(
+            name='Quilting Cotton',
+            store=self.store,
+            user=owner
+        )
+        product = sample_product(
+            owner,
+            self.store,
+            title='Product A',
+            price=12.5,
+            length=1.25,
+            type=product_type
+        )
+        product.tags.add('fabric', 'disney')
+        sample_product(owner, self.store, title='Product B', body='Ünïcode')
+        self.products = serializers.ProductSerializer.setup_eager_loading(
+            Product.objects.order_by('id')
+        )
+
+    def assertSameOutput(self, slow, fast, **kwargs):
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(fast(self.products, many=True, **kwargs).data),
+            renderer.render(slow(self.products, many=True, **kwargs).data)
+        )
+
+    def test_product_serializer(self):
+        self.assertSameOutput(
+            serializers.ProductSerializer,
+            serializers.FastProductSerializer
+        )
+
+    def test_product_serializer_with_request(self):
+        request = Request(APIRequestFactory().get('/'))
+        self.assertSameOutput(
+            serializers.ProductSerializer,
+            serializers.FastProductSerializer,
+            context={'request': request}
+        )
+
+    def test_simple_product_serializer(self):
+        self.assertSameOutput(
+            serializers.SimpleProductSerializer,
+            serializers.FastSimpleProductSerializer
+        )
+
+    def test_product_list_endpoint(self):
+        client = APIClient()
+        url = product_url(self.store.slug)
+        expected = client.get(url).content
+        invalidate_store(self.store.slug)
+
+        with self.settings(FAST_SERIALIZERS=True):
+            res = client.get(url)
+
+        self.assertEqual(res.content, expected)
+
+
+class ProductPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        owner = sample_user()
+        self.store = sample_store(owner)
+        self.products = [
+            sample_product(owner, self.store, title=f'Product {i}')
+            for i in range(7)
+        ]
+        # products created in the same instant are ordered by id
+        Product.objects.filter(
+            id__in=[p.id for p in self.products[2:5]]
+        ).update(created_at=self.products[2].created_at)
+
+    def walk(self, url, params=None):
+        pages = []
+        while url:
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            pages.append([p['id'] for p in res.data['results']])
+            url, params = res.data['next'], None
+        return pages
+
+    def test_keyset_pages(self):
+        pages = self.walk(product_url(self.store.slug), {'page_size': 3})
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(
+            sum(pages, []),
+            [p.id for p in self.products]
+        )
+
+    def test_previous_page(self):
+        res = self.client.get(product_url(self.store.slug), {'page_size': 3})
+        self.assertIsNone(res.data['previous'])
+        first = res.data['results']
+
+        res = self.client.get(res.data['next'])
+        res = self.client.get(res.data['previous'])
+
+        self.assertEqual(res.data['results'], first)
+        self.assertIsNone(res.data['previous'])
+
+    def test_max_page_size(self):
+        res = self.client.get(
+            product_url(self.store.slug),
+            {'page_size': 1000}
+        )
+
+        self.assertEqual(len(res.data['results']), 7)
+        request = Request(APIRequestFactory().get('/', {'page_size': 1000}))
+        self.assertEqual(
+            KeysetPagination().get_page_size(request),
+            KeysetPagination.max_page_size
+        )
+
+    def test_invalid_cursor(self):
+        res = self.client.get(
+            product_url(self.store.slug),
+            {'cursor': 'not-a-cursor'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_with_invalid_values(self):
+        for position in (['abc', 'x'], [None, 1], [{}, []]):
+            cursor = urlsafe_b64encode(
+                json.dumps({'p': position, 'r': False}).encode()
+            ).decode()
+            res = self.client.get(
+                product_url(self.store.slug),
+                {'cursor': cursor}
+            )
+
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class StoreResponseCacheTests(TestCase):
+    """Public store responses are cached until the catalogue changes"""
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.owner = sample_user()
+        self.store = sample_store(self.owner)
+        self.product = sample_product(self.owner, self.store)
+
+    def assertCached(self, url):
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res
+
+    def test_list_and_detail_are_cached(self):
+        self.assertCached(product_url(self.store.slug))
+        self.assertCached(detail_url(self.store.slug, self.product.id))
+
+    def test_query_params_are_part_of_the_key(self):
+        self.product.tags.add('fabric')
+        url = product_url(self.store.slug)
+        self.client.get(url, {'tags': 'fabric'})
+
+        res = self.client.get(url, {'tags': 'other'})
+
+        self.assertEqual(res.data['results'], [])
+
+    def test_product_change_invalidates(self):
+        url = product_url(self.store.slug)
+        self.assertCached(url)
+
+        self.product.title = 'Renamed'
+        self.product.save()
+        res = self.client.get(url)
+
+        self.assertEqual(res.data['results'][0]['title'], 'Renamed')
+
+    def test_tag_change_invalidates(self):
+        url = detail_url(self.store.slug, self.product.id)
+        self.assertCached(url)
+
+        self.product.tags.add('fabric')
+        self.assertEqual(self.client.get(url).data['tags'], 'fabric')
+        self.product.tags.remove('fabric')
+        self.assertEqual(self.client.get(url).data['tags'], '')
+
+    def test_other_store_is_not_invalidated(self):
+        other = sample_store(self.owner, title='Other Store')
+        url = product_url(self.store.slug)
+        self.client.get(url)
+
+        sample_product(self.owner, other)
+
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_renamed_store_invalidates_old_slug(self):
+        old_slug = self.store.slug
+        url = product_url(old_slug)
+        self.assertCached(url)
+
+        self.store.title = 'Renamed Store'
+        self.store.save()
+        res = self.client.get(url)
+
+        self.assertEqual(res.data['results'], [])
+
+    def test_if_none_match(self):
+        url = product_url(self.store.slug)
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+
+        sample_product(self.owner, self.store, title='New Product')
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+
 class productImageUploadTests(TestCase):
 
     def setUp(self):
@@ -244,6 +539,103 @@ class productImageUploadTests(TestCase):
         self.assertTrue(product_image.is_primary)
 
 
+class productImageBulkUploadTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@cinolabs.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.store = sample_store(user=self.user)
+        self.product = sample_product(user=self.user, store=self.store)
+        self.url = image_upload_url(self.store.slug, self.product.id) + 'bulk/'
+
+    def tearDown(self):
+        """Clean test files added"""
+        for image in self.product.get_images():
+            image.image.delete(save=False)
+        self.product.get_images().delete()
+
+    def upload(self, count, **payload):
+        files = []
+        for _ in range(count):
+            ntf = tempfile.NamedTemporaryFile(suffix='.jpg')
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            files.append(ntf)
+        try:
+            payload['images'] = files
+            return self.client.post(self.url, payload, format='multipart')
+        finally:
+            for ntf in files:
+                ntf.close()
+
+    def test_bulk_upload(self):
+        with CaptureQueriesContext(connection) as context:
+            res = self.upload(3)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 3)
+        inserts = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('INSERT INTO "core_productimage"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        images = ProductImage.objects.filter(product=self.product)
+        self.assertEqual(images.count(), 3)
+        self.assertEqual(
+            [image.is_primary for image in images.order_by('id')],
+            [True, False, False]
+        )
+        for image in images:
+            self.assertTrue(os.path.exists(image.image.path))
+
+    def test_bulk_upload_primary(self):
+        first = self.upload(1).data[0]
+        res = self.upload(2, is_primary=True)
+
+        self.assertEqual(
+            list(ProductImage.objects.filter(
+                product=self.product,
+                is_primary=True
+            ).values_list('id', flat=True)),
+            [res.data[0]['id']]
+        )
+        self.assertNotEqual(first['id'], res.data[0]['id'])
+
+    def test_bulk_upload_is_atomic(self):
+        first = self.upload(1).data[0]
+
+        with mock.patch.object(
+            serializers.blobs,
+            'acquire',
+            side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            self.upload(2, is_primary=True)
+
+        self.assertEqual(
+            list(ProductImage.objects.filter(
+                product=self.product
+            ).values_list('id', 'is_primary')),
+            [(first['id'], True)]
+        )
+
+    def test_bulk_upload_invalid_image(self):
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            ntf.write(b'not an image')
+            ntf.seek(0)
+            res = self.client.post(
+                self.url,
+                {'images': [ntf]},
+                format='multipart'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ProductImage.objects.exists())
+
+
 class productAttachmentUploadTests(TestCase):
 
     def setUp(self):
@@ -273,9 +665,458 @@ class productAttachmentUploadTests(TestCase):
             res = self.client.post(url, payload, format='multipart')
 
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
-        self.assertIn('file', res.data)
         product_attachment = ProductAttachment.objects.get(pk=res.data['id'])
         self.assertTrue(os.path.exists(product_attachment.file.path))
+        # the file is linked through the download action
+        self.assertTrue(res.data['file'].endswith(reverse(
+            'store:product-attachments-download',
+            args=[self.store.slug, self.product.id, product_attachment.id]
+        )))
 
         # test the the first image is saved as is_primary
         self.assertTrue(res.data['is_primary'])
+
+
+def sample_image_upload(size=(1000, 500)):
+    ntf = tempfile.NamedTemporaryFile(suffix='.jpg')
+    Image.new('RGB', size).save(ntf, format='JPEG')
+    ntf.seek(0)
+    return ntf
+
+
+@override_settings(IMAGE_VARIANTS={
+    'SIZES': {'thumbnail': 100},
+    'FORMATS': ('webp', 'nope'),
+    'QUALITY': 80,
+    'WORKERS': 0,
+})
+class ImageVariantTests(TransactionTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.client.force_authenticate(self.user)
+        self.store = sample_store(self.user)
+        self.product = sample_product(self.user, self.store)
+        self.url = image_upload_url(self.store.slug, self.product.id)
+
+    def tearDown(self):
+        for image in ProductImage.objects.all():
+            for names in images.variant_names(image.image.name).values():
+                for name in names.values():
+                    image.image.storage.delete(name)
+            image.image.delete(save=False)
+
+    def test_variants_rendered_on_upload(self):
+        with sample_image_upload() as ntf:
+            res = self.client.post(
+                self.url,
+                {'title': 'Main', 'image': ntf},
+                format='multipart'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(res.data['variants']), ['thumbnail'])
+        url = res.data['variants']['thumbnail']['webp']
+        self.assertTrue(url.endswith('_thumbnail.webp'))
+
+        image = ProductImage.objects.get(pk=res.data['id'])
+        name = images.variant_name(image.image.name, 'thumbnail', 'webp')
+        with image.image.storage.open(name) as variant:
+            rendered = Image.open(variant)
+            self.assertEqual(rendered.format, 'WEBP')
+            self.assertEqual(rendered.size, (100, 50))
+
+    def test_render_failure_keeps_upload(self):
+        with sample_image_upload() as ntf, \
+                mock.patch.object(images, 'render', side_effect=OSError), \
+                self.assertLogs('core.images', 'ERROR'):
+            res = self.client.post(
+                self.url,
+                {'title': 'Main', 'image': ntf},
+                format='multipart'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(res.data['variants'])
+        self.assertTrue(
+            ProductImage.objects.filter(id=res.data['id']).exists()
+        )
+
+    def test_bulk_upload_renders_variants(self):
+        with sample_image_upload() as first, sample_image_upload() as second:
+            res = self.client.post(
+                self.url + 'bulk/',
+                {'images': [first, second]},
+                format='multipart'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        for image in ProductImage.objects.all():
+            name = images.variant_name(image.image.name, 'thumbnail', 'webp')
+            self.assertTrue(image.image.storage.exists(name))
+
+    def test_store_logo_variants(self):
+        url = product_url(self.store.slug)
+        res = self.client.get(url)
+        self.assertIsNone(res.data['results'][0]['store']['logo_variants'])
+
+        # a variant is only linked once it is rendered
+        self.store.logo = 'uploads/logo.png'
+        self.store.save()
+        res = self.client.get(url)
+        self.assertIsNone(res.data['results'][0]['store']['logo_variants'])
+
+        name = default_storage.save(
+            'uploads/logo_thumbnail.webp', ContentFile(b'')
+        )
+        self.addCleanup(default_storage.delete, name)
+        invalidate_store(self.store.slug)
+        res = self.client.get(url)
+        variants = res.data['results'][0]['store']['logo_variants']
+        self.assertEqual(list(variants['thumbnail']), ['webp'])
+        self.assertTrue(
+            variants['thumbnail']['webp'].endswith(name)
+        )
+
+
+class AttachmentDownloadTests(TestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.owner = sample_user()
+        self.store = sample_store(self.owner)
+        self.product = sample_product(self.owner, self.store)
+        self.attachment = ProductAttachment.objects.create(
+            product=self.product,
+            title='User Manual',
+            file=SimpleUploadedFile('manual.pdf', self.content)
+        )
+        self.url = reverse(
+            'store:product-attachments-download',
+            args=[self.store.slug, self.product.id, self.attachment.id]
+        )
+        self.client = APIClient()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_download(self):
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+        self.assertEqual(res['Content-Length'], str(len(self.content)))
+        self.assertEqual(res['Content-Type'], 'application/pdf')
+        self.assertEqual(
+            res['Content-Disposition'],
+            'attachment; filename="user-manual.pdf"'
+        )
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+
+    def test_range(self):
+        res = self.client.get(self.url, HTTP_RANGE='bytes=100-299')
+
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(
+            b''.join(res.streaming_content),
+            self.content[100:300]
+        )
+        self.assertEqual(res['Content-Length'], '200')
+        self.assertEqual(
+            res['Content-Range'],
+            f'bytes 100-299/{len(self.content)}'
+        )
+
+        res = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(res.streaming_content), self.content[-10:])
+
+        res = self.client.get(
+            self.url,
+            HTTP_RANGE=f'bytes={len(self.content)}-'
+        )
+        self.assertEqual(
+            res.status_code,
+            status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertEqual(res['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertIn(self.attachment.file.name.split('/')[-1][:64], etag)
+
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = self.client.get(
+            self.url,
+            HTTP_RANGE='bytes=0-9',
+            HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.get(
+            self.url,
+            HTTP_RANGE='bytes=0-9',
+            HTTP_IF_RANGE=etag
+        )
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+    def test_sendfile_offload(self):
+        with override_settings(ATTACHMENT_DOWNLOADS={
+            'SENDFILE': 'x-accel-redirect',
+            'ACCEL_PREFIX': '/protected-media/',
+        }):
+            res = self.client.get(self.url)
+        self.assertEqual(
+            res['X-Accel-Redirect'],
+            '/protected-media/' + self.attachment.file.name
+        )
+        self.assertEqual(res.content, b'')
+
+        with override_settings(ATTACHMENT_DOWNLOADS={
+            'SENDFILE': 'x-sendfile',
+            'ACCEL_PREFIX': '',
+        }):
+            res = self.client.get(self.url)
+        self.assertEqual(res['X-Sendfile'], self.attachment.file.path)
+
+    def test_store_access(self):
+        self.product.published = False
+        self.product.save()
+
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(self.owner)
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+
+        other = sample_store(self.owner, title='Other Store')
+        res = self.client.get(reverse(
+            'store:product-attachments-download',
+            args=[other.slug, self.product.id, self.attachment.id]
+        ))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_media_url_hides_attachments(self):
+        request = APIRequestFactory().get('/media/')
+        with self.assertRaises(Http404):
+            downloads.serve_media(
+                request,
+                self.attachment.file.name,
+                document_root=self.media_root
+            )
+
+        # the same content uploaded as an image is public
+        image = ProductImage.objects.create(
+            product=self.product,
+            title='Manual',
+            image=self.attachment.file.name
+        )
+        res = downloads.serve_media(
+            request,
+            image.image.name,
+            document_root=self.media_root
+        )
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+
+
+class PrimaryFileTests(TestCase):
+
+    def setUp(self):
+        user = sample_user()
+        self.product = sample_product(user, sample_store(user))
+
+    def add(self, model=ProductImage, **params):
+        field = 'image' if model is ProductImage else 'file'
+        params.setdefault(field, 'uploads/sample.jpg')
+        return model.objects.create(
+            product=self.product,
+            title='Sample',
+            **params
+        )
+
+    def primaries(self, model=ProductImage):
+        return list(model.objects.filter(
+            product=self.product,
+            is_primary=True
+        ).values_list('id', flat=True))
+
+    def test_first_becomes_primary(self):
+        for model in (ProductImage, ProductAttachment):
+            first = self.add(model)
+            second = self.add(model)
+
+            self.assertTrue(first.is_primary)
+            self.assertFalse(second.is_primary)
+            self.assertEqual(self.primaries(model), [first.id])
+
+    def test_primary_takes_the_flag(self):
+        self.add()
+        image = self.add(is_primary=True)
+
+        self.assertEqual(self.primaries(), [image.id])
+
+    def test_save_costs_one_update(self):
+        self.add()
+        with CaptureQueriesContext(connection) as context:
+            self.add()
+            self.add(is_primary=True)
+
+        statements = [
+            query['sql'] for query in context.captured_queries
+            if 'core_productimage' in query['sql']
+        ]
+        self.assertEqual(len(statements), 4)
+
+    def test_delete_promotes_another(self):
+        first = self.add()
+        second = self.add()
+        self.add()
+
+        first.delete()
+        self.assertEqual(self.primaries(), [second.id])
+
+        ProductImage.objects.filter(product=self.product).delete()
+        self.assertEqual(self.primaries(), [])
+
+    def test_one_primary_per_product(self):
+        self.add()
+        image = self.add()
+
+        with self.assertRaises(IntegrityError):
+            ProductImage.objects.filter(id=image.id).update(is_primary=True)
+
+
+class CommittedPrimaryFileTests(TransactionTestCase):
+    """Primaries saved by concurrent transactions"""
+
+    def test_concurrent_primaries(self):
+        """A primary saved while another is uncommitted waits its turn"""
+        user = sample_user()
+        product = sample_product(user, sample_store(user))
+        saved = {}
+
+        def add_primary(model):
+            try:
+                saved[model] = model.objects.create(
+                    product=product,
+                    title='Second',
+                    is_primary=True
+                )
+            except IntegrityError as error:
+                saved[model] = error
+            finally:
+                connection.close()
+
+        for model in (ProductImage, ProductAttachment):
+            with transaction.atomic():
+                first = model.objects.create(
+                    product=product,
+                    title='First',
+                    is_primary=True
+                )
+                second = threading.Thread(target=add_primary, args=[model])
+                second.start()
+                second.join(.5)
+                # blocked on the lock of the product
+                self.assertTrue(second.is_alive())
+            second.join()
+
+            self.assertIsInstance(saved[model], model)
+            self.assertEqual(
+                list(model.objects.filter(
+                    product=product,
+                    is_primary=True
+                ).values_list('id', flat=True)),
+                [saved[model].id]
+            )
+            first.refresh_from_db()
+            self.assertFalse(first.is_primary)
+
+
+class ProductQueryPlanTests(TestCase):
+    """Tag filtered listings must not need to de-duplicate products"""
+    product_count = 50000
+    tag_count = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = sample_user()
+        cls.store = sample_store(owner)
+        Product.objects.bulk_create([
+            Product(
+                title=f'Product {i}',
+                slug=f'product-{i}',
+                body='Lorem ipsum dolor sit amet ' * 20,
+                price=5,
+                stock=3,
+                published=True,
+                store=cls.store,
+                user=owner
+            ) for i in range(cls.product_count)
+        ], batch_size=5000)
+        tags = Tag.objects.bulk_create([
+            Tag(name=f'tag-{i}', slug=f'tag-{i}')
+            for i in range(cls.tag_count)
+        ])
+        content_type = ContentType.objects.get_for_model(Product)
+        product_ids = Product.objects.values_list('id', flat=True)
+        TaggedItem.objects.bulk_create([
+            TaggedItem(
+                tag=tags[(product_id + offset) % cls.tag_count],
+                content_type=content_type,
+                object_id=product_id
+            )
+            for product_id in product_ids.iterator()
+            for offset in (0, 1, 7)
+        ], batch_size=10000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain_product_query(self, params):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(product_url(self.store.slug), params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        sql = next(
+            q['sql'] for q in ctx.captured_queries
+            if re.match(r'SELECT (DISTINCT )?"core_product"\."id"', q['sql'])
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            return cursor.fetchone()[0][0]['Plan']
+
+    def deduplicated_relations(self, node, found=None):
+        """
+        Return the relations scanned below Unique and aggregate nodes.
+        Postgres may unique-ify the tag ids of a semi join, what must not
+        happen is de-duplicating whole product rows.
+        """
+        found = set() if found is None else found
+        if node['Node Type'] in ('Unique', 'Aggregate'):
+            found.update(self.relations(node))
+        for child in node.get('Plans', []):
+            self.deduplicated_relations(child, found)
+        return found
+
+    def relations(self, node):
+        names = {node['Relation Name']} if 'Relation Name' in node else set()
+        for child in node.get('Plans', []):
+            names.update(self.relations(child))
+        return names
+
+    def test_tag_filter_does_not_deduplicate_products(self):
+        for tags in ('tag-1', 'tag-1, tag-2, tag-50'):
+            plan = self.explain_product_query({'tags': tags})
+
+            self.assertIn('core_product', self.relations(plan))
+            self.assertNotIn(
+                'core_product',
+                self.deduplicated_relations(plan)
+            )
@@ -46,11 +46,29 @@ class PublicUserApiTests(TestCase):
     def test_list_stores(self):
         sample_store(sample_user())
         res = self.client.get(STORE_URL)
-        stores = Store.objects.all().order_by('-id')
+        stores = Store.objects.all().order_by('created_at', 'id')
         serializer = serializers.StoreSerializer(stores, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+
+    def test_list_stores_paginated(self):
+        user = sample_user()
+        stores = [
+            sample_store(user, title=f'Store {i}', slug=f'store-{i}')
+            for i in range(5)
+        ]
+
+        pages = []
+        url, params = STORE_URL, {'page_size': 2}
+        while url:
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            pages.append([store['slug'] for store in res.data['results']])
+            url, params = res.data['next'], None
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), [store.slug for store in stores])
 
     def test_get_store_detail_by_slug(self):
         store = sample_store(sample_user())
@@ -1,3 +1,10 @@
+import os
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.text import slugify
+
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import viewsets, status, mixins, permissions
@@ -5,9 +12,12 @@ from rest_framework.authentication import TokenAuthentication
 
 from core.models import Store, Product, Collection, \
                         ProductImage, ProductAttachment
-from core import utils
+from core import rules, utils
+from core.pagination import KeysetPagination
+from core.stores import StoreScopedMixin
 from core.permissions import IsOwnerOrReadOnly, IsOwnerOrStaff
-from store import serializers
+from store import downloads, serializers
+from store.cache import cached_store_response
 
 from django.utils import timezone
 
@@ -17,6 +27,7 @@ class StoreViewSet(viewsets.ModelViewSet):
     queryset = Store.objects.all()
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsOwnerOrReadOnly,)
+    pagination_class = KeysetPagination
     lookup_field = 'slug'
 
     def get_queryset(self):
@@ -52,28 +63,33 @@ class StoreViewSet(viewsets.ModelViewSet):
         )
 
 
-class PublicStoreReadOnlyViewSet(viewsets.GenericViewSet,
+class PublicStoreReadOnlyViewSet(StoreScopedMixin,
+                                 viewsets.GenericViewSet,
                                  mixins.ListModelMixin,
                                  mixins.RetrieveModelMixin):
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """Return objects for the base store"""
-        queryset = self.queryset
-        store_slug = self.kwargs['store']
+        return self.queryset.filter(store_id=self.get_store_id())
 
-        return queryset.filter(store__slug=store_slug)
+    @cached_store_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
+    @cached_store_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-class BaseStoreModelViewSet(viewsets.ModelViewSet):
+
+class BaseStoreModelViewSet(StoreScopedMixin, viewsets.ModelViewSet):
     authentication_classes = (TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrStaff,)
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """Return objects for the base store"""
-        queryset = self.queryset
-        store_slug = self.kwargs['store']
-
-        return queryset.filter(store__slug=store_slug)
+        return self.queryset.filter(store_id=self.get_store_id())
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -82,6 +98,10 @@ class BaseStoreModelViewSet(viewsets.ModelViewSet):
 class ProductViewSet(PublicStoreReadOnlyViewSet):
     serializer_class = serializers.ProductSerializer
     queryset = Product.objects.all()
+    page_size = 24
+
+    def get_serializer_class(self):
+        return serializers.product_serializer_class()
 
     def get_queryset(self):
         tags = self.request.query_params.get('tags')
@@ -92,33 +112,48 @@ class ProductViewSet(PublicStoreReadOnlyViewSet):
 
         if tags:
             queryset = queryset.filter(
-                tags__name__in=utils.comma_splitter(tags)
-            ).distinct()
-        return queryset
+                rules.tags_exist(name__in=utils.comma_splitter(tags))
+            )
+        return self.serializer_class.setup_eager_loading(queryset)
 
 
 class ProductAdminViewSet(BaseStoreModelViewSet):
     serializer_class = serializers.ProductSerializer
     queryset = Product.objects.all()
 
+    def get_queryset(self):
+        return self.serializer_class.setup_eager_loading(
+            super().get_queryset()
+        )
+
 
 class CollectionViewSet(PublicStoreReadOnlyViewSet):
     serializer_class = serializers.CollectionSerializer
     queryset = Collection.objects.all()
+    page_size = 50
 
-    @action(methods=['GET'], detail=True, url_path='collection-product-list')
+    @action(methods=['GET'], detail=True, url_path='collection-product-list',
+            page_size=24)
+    @cached_store_response
     def product_list(self, request, store, pk):
-        collection = Collection.objects.get(pk=pk, store__slug=store)
-        products = collection.get_products()
-        serializer = serializers.ProductSerializer(products, many=True)
-
-        return Response(
-            serializer.data,
-            status=status.HTTP_200_OK
+        collection = Collection.objects.get(
+            pk=pk,
+            store_id=self.get_store_id()
+        )
+        products = self.paginate_queryset(
+            serializers.ProductSerializer.setup_eager_loading(
+                collection.get_products()
+            )
+        )
+        serializer = serializers.product_serializer_class()(
+            products,
+            many=True
         )
 
+        return self.get_paginated_response(serializer.data)
 
-class ProductImageViewSet(viewsets.ModelViewSet):
+
+class ProductImageViewSet(StoreScopedMixin, viewsets.ModelViewSet):
     authentication_classes = (TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrStaff,)
     serializer_class = serializers.ProductImageSerializer
@@ -127,20 +162,78 @@ class ProductImageViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Return objects for the base store"""
         return self.queryset.filter(
-            product__store__slug=self.kwargs['store'],
+            product__store_id=self.get_store_id(),
             product__id=self.kwargs['product_pk']
         )
 
+    @action(methods=['POST'], detail=False, url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        """
+        Upload many images as multipart "images" files, each file is
+        streamed to a temporary file instead of being held in memory
+        """
+        # must be set before request.data parses the body
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        product = get_object_or_404(
+            Product.objects.select_related('store'),
+            store_id=self.get_store_id_or_404(),
+            id=self.kwargs['product_pk']
+        )
+        serializer = serializers.ProductImageBulkSerializer(
+            data=request.data,
+            context={'product': product}
+        )
 
-class ProductAttachmentViewSet(viewsets.ModelViewSet):
+        if serializer.is_valid():
+            images = serializer.save()
+            return Response(
+                serializers.ProductImageSerializer(images, many=True).data,
+                status=status.HTTP_201_CREATED
+            )
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+class ProductAttachmentViewSet(StoreScopedMixin, viewsets.ModelViewSet):
     authentication_classes = (TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrStaff,)
     serializer_class = serializers.ProductAttachmentSerializer
     queryset = ProductAttachment.objects.all()
 
+    def get_permissions(self):
+        if self.action == 'download':
+            return []
+        return super().get_permissions()
+
     def get_queryset(self):
         """Return objects for the base store"""
         return self.queryset.filter(
-            product__store__slug=self.kwargs['store'],
+            product__store_id=self.get_store_id(),
             product__id=self.kwargs['product_pk']
         )
+
+    @action(methods=['GET'], detail=True, url_path='download')
+    def download(self, request, *args, **kwargs):
+        """
+        Download the file, with Range and conditional requests. The
+        attachments of published products are public, the store owner can
+        download all of them.
+        """
+        attachment = get_object_or_404(
+            ProductAttachment.objects.select_related('product__store'),
+            id=self.kwargs['pk'],
+            product__id=self.kwargs['product_pk'],
+            product__store_id=self.get_store_id_or_404()
+        )
+        product = attachment.product
+        if not product.published and \
+                product.store.user_id != request.user.id:
+            raise Http404
+        if not attachment.file:
+            raise Http404
+
+        ext = os.path.splitext(attachment.file.name)[1]
+        filename = f'{slugify(attachment.title) or "attachment"}{ext}'
+        return downloads.serve(request, attachment.file, filename)
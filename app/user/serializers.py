@@ -34,6 +34,7 @@ class AuthTokenSerializer(serializers.Serializer):
         style={'input_type': 'password'},
         trim_whitespace=False
     )
+    cart = serializers.UUIDField(required=False)
 
     def validate(self, attrs):
         """validate and authenticate the user"""
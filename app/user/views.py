@@ -1,7 +1,11 @@
 from rest_framework import generics, authentication, permissions
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from commerce.services import CartMergeService
+from core.models import Cart
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -12,10 +16,27 @@ class CreateUserView(generics.CreateAPIView):
 
 
 class CreateTokenView(ObtainAuthToken):
-    """Create a new auth token for user"""
+    """
+    Create a new auth token for user, the guest cart passed as cart is
+    merged into the cart of the user
+    """
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.get_or_create(user=user)
+        data = {'token': token.key}
+
+        cart_id = serializer.validated_data.get('cart')
+        if cart_id is not None:
+            cart = CartMergeService(Cart(id=cart_id)).merge(user)
+            if cart is not None:
+                data['cart'] = str(cart.id)
+        return Response(data)
+
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """Manage authenticated user"""